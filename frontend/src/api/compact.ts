@@ -0,0 +1,141 @@
+import type { DataPoint, LocationStatus } from "./generated/models";
+
+// Compact /current format (`?format=compact` or `?format=msgpack`): today_data
+// is sent as a start epoch, a fixed step or per-point offsets, and busyness
+// scaled to integers.
+export interface CompactSeries {
+  start: number;
+  step: number | null;
+  offsets: number[] | null;
+  scale: number;
+  busyness: (number | null)[];
+}
+
+export interface CompactLocationStatus
+  extends Omit<LocationStatus, "today_data"> {
+  today_data: CompactSeries;
+}
+
+export type CompactFormat = "compact" | "msgpack";
+
+export const decodeSeries = (series: CompactSeries): DataPoint[] => {
+  let seconds = series.start;
+  return series.busyness.map((value, i) => {
+    if (i > 0) seconds += series.step ?? series.offsets![i];
+    return {
+      timestamp: new Date(seconds * 1000).toISOString(),
+      busyness_percentage: value === null ? null : value / series.scale,
+    };
+  });
+};
+
+export const decodeCompactStatus = (
+  status: CompactLocationStatus,
+): LocationStatus => ({
+  ...status,
+  today_data: decodeSeries(status.today_data),
+});
+
+// Decodes the MessagePack subset the API emits: maps, arrays, strings,
+// integers, floats, booleans and nil.
+export const decodeMsgpack = (bytes: Uint8Array): unknown => {
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  const text = new TextDecoder();
+  let pos = 0;
+
+  const take = (size: number) => {
+    const at = pos;
+    pos += size;
+    return at;
+  };
+  const str = (length: number) => {
+    const at = take(length);
+    return text.decode(bytes.subarray(at, at + length));
+  };
+  const array = (length: number) => Array.from({ length }, () => read());
+  const map = (length: number) => {
+    const result: Record<string, unknown> = {};
+    for (let i = 0; i < length; i++) {
+      const key = read() as string;
+      result[key] = read();
+    }
+    return result;
+  };
+
+  const read = (): unknown => {
+    const type = view.getUint8(take(1));
+    if (type <= 0x7f) return type;
+    if (type >= 0xe0) return type - 0x100;
+    if (type <= 0x8f) return map(type & 0x0f);
+    if (type <= 0x9f) return array(type & 0x0f);
+    if (type <= 0xbf) return str(type & 0x1f);
+    switch (type) {
+      case 0xc0:
+        return null;
+      case 0xc2:
+        return false;
+      case 0xc3:
+        return true;
+      case 0xca:
+        return view.getFloat32(take(4));
+      case 0xcb:
+        return view.getFloat64(take(8));
+      case 0xcc:
+        return view.getUint8(take(1));
+      case 0xcd:
+        return view.getUint16(take(2));
+      case 0xce:
+        return view.getUint32(take(4));
+      case 0xcf:
+        return Number(view.getBigUint64(take(8)));
+      case 0xd0:
+        return view.getInt8(take(1));
+      case 0xd1:
+        return view.getInt16(take(2));
+      case 0xd2:
+        return view.getInt32(take(4));
+      case 0xd3:
+        return Number(view.getBigInt64(take(8)));
+      case 0xd9:
+        return str(view.getUint8(take(1)));
+      case 0xda:
+        return str(view.getUint16(take(2)));
+      case 0xdb:
+        return str(view.getUint32(take(4)));
+      case 0xdc:
+        return array(view.getUint16(take(2)));
+      case 0xdd:
+        return array(view.getUint32(take(4)));
+      case 0xde:
+        return map(view.getUint16(take(2)));
+      case 0xdf:
+        return map(view.getUint32(take(4)));
+      default:
+        throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+    }
+  };
+
+  return read();
+};
+
+export const getCurrentCompact = async (
+  format: CompactFormat,
+  { maxPoints, signal }: { maxPoints?: number; signal?: AbortSignal } = {},
+): Promise<LocationStatus[]> => {
+  const params = new URLSearchParams({ format });
+  if (maxPoints !== undefined) params.set("max_points", String(maxPoints));
+  const response = await fetch(`/api/current?${params}`, { signal });
+  if (!response.ok) {
+    const error = await response.json().catch(() => ({
+      message: `HTTP Error: ${response.status} ${response.statusText}`,
+    }));
+    throw error;
+  }
+
+  const statuses = (
+    format === "msgpack"
+      ? decodeMsgpack(new Uint8Array(await response.arrayBuffer()))
+      : await response.json()
+  ) as CompactLocationStatus[];
+  return statuses.map(decodeCompactStatus);
+};
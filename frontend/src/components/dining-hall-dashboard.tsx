@@ -1,15 +1,23 @@
+import { getCurrentCompact } from "@/api/compact";
 import { useGetCurrentCurrentGet } from "@/api/generated/default/default";
 import { DiningHallCard } from "@/components/dining-hall-card";
 import { ThemeToggle } from "@/components/theme-toggle";
 import { InfoDialog } from "@/components/info-dialog";
 import { Loader2 } from "lucide-react";
 
+// Points per chart series; the server downsamples today_data to this budget
+const CHART_MAX_POINTS = 240;
+
 export function DiningHallDashboard() {
   const isDev =
     new URLSearchParams(window.location.search).get("dev") === "true";
 
   const { data, isLoading, error } = useGetCurrentCurrentGet({
-    query: { enabled: isDev },
+    query: {
+      enabled: isDev,
+      queryFn: ({ signal }) =>
+        getCurrentCompact("msgpack", { maxPoints: CHART_MAX_POINTS, signal }),
+    },
   });
 
   if (isDev && isLoading) {
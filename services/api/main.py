@@ -1,35 +1,77 @@
+import argparse
+import asyncio
+import csv
 import hashlib
+import heapq
 import hmac
+import multiprocessing
 import os
+import re
 import secrets
+import socket
 import sqlite3
+import tempfile
+import threading
+from array import array
 from base64 import urlsafe_b64decode, urlsafe_b64encode
-from collections.abc import AsyncIterator, Generator
-from contextlib import asynccontextmanager
-from datetime import UTC, datetime, timedelta
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, asynccontextmanager
+from datetime import UTC, date, datetime, timedelta, timezone
 from html import escape
+from itertools import groupby, pairwise
+from multiprocessing.process import BaseProcess
 from pathlib import Path
 from time import time
-from typing import Annotated, Literal, cast
+from typing import Annotated, BinaryIO, Concatenate, Literal, cast
+from urllib.parse import urlencode
 from zoneinfo import ZoneInfo
 
+import ormsgpack
 from fastapi import (
-    Depends,
     FastAPI,
     File,
     Form,
     Header,
     HTTPException,
+    Query,
     Request,
     UploadFile,
 )
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, Response
 from loguru import logger
-from pydantic import BaseModel
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    StringConstraints,
+    TypeAdapter,
+    ValidationError,
+)
+
+from middlines_common.chunks import CHUNK_SECONDS, decode_chunk
+from middlines_common.shards import (
+    DEFAULT_SHARD,
+    all_shards,
+    shard_database_path,
+    shard_for_location,
+)
+from middlines_common.stats import (
+    BASELINE_END_HOUR,
+    BASELINE_START_HOUR,
+    DAILY_STATS_GRACE_MINUTES,
+    compute_baseline_stats,
+    current_stats_day,
+    daily_stats_as_of,
+)
 
 DATABASE_PATH = "/data/middlines.db"
 CONTROL_DATABASE_PATH = "/data/device_control.db"
+SNAPSHOT_DATABASE_PATH = "/data/api_snapshot.db"
 ARTIFACTS_DIR = Path("/data/ota")
 TIMEZONE = ZoneInfo(os.environ.get("TZ", "America/New_York"))
 
@@ -40,10 +82,62 @@ SESSION_SECRET = os.environ.get("MIDDLINES_SESSION_SECRET", "dev-session-secret"
 DEFAULT_NODES = ("ross", "proctor", "atwater")
 DEFAULT_POLL_INTERVAL_S = 300
 SESSION_COOKIE = "middlines_admin"
+# Admin: rows per page in the node and firmware listings
+ADMIN_PAGE_SIZE = 50
+# Admin: most recent firmware uploads offered as a node's OTA target
+ADMIN_FIRMWARE_CHOICES = 20
+# Admin: nodes not seen for this many of their poll intervals count as stale
+STALE_NODE_POLLS = 3
+# Admin: how a node with no reported version is listed and filtered
+UNKNOWN_VERSION = "unknown"
+# Admin: recent rollouts shown on the dashboard
+ADMIN_ROLLOUT_LIMIT = 10
+
+# Rollouts: defaults for nodes per wave and nodes downloading at once
+ROLLOUT_WAVE_SIZE = 10
+ROLLOUT_MAX_CONCURRENT = 5
+# Rollouts: a released node that hasn't reported the new version after this many
+# seconds fails, which pauses its rollout
+ROLLOUT_NODE_TIMEOUT_S = 1800
+# Rollouts: seconds between background checks for timed-out nodes
+ROLLOUT_CHECK_SECONDS = 60
+
+# Manifest polling: delay while a node has an OTA or restart to pick up or confirm
+# (the firmware's minimum)
+POLL_URGENT_S = 30
+# Manifest polling: longest delay handed out (the firmware's maximum)
+POLL_MAX_S = 3600
+# Manifest polling: nodes whose desired state hasn't changed for this many seconds...
+POLL_IDLE_AFTER_S = 86400
+# Manifest polling: ...poll this many times less often than their base interval
+POLL_IDLE_MULTIPLIER = 2
+# Manifest polling: fleet-wide manifest requests per second that non-urgent polling
+# is stretched to stay under
+MANIFEST_TARGET_RPS = 5.0
+# Manifest polling: each node's delay is stretched by a fixed per-node fraction up to this
+POLL_JITTER_FRACTION = 0.2
 PUBLIC_API_PREFIX = "/api"
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
 
-# Cache TTL in seconds
+# Cache TTL in seconds (how often the shared /current snapshot is recomputed)
 CACHE_TTL = 30
+# Snapshot: seconds a worker holds the refresh lease without renewing it; it is
+# renewed every third of that while a refresh (up to a full pass) runs
+SNAPSHOT_LEASE_SECONDS = 90
+
+# DB executors: threads per pool (public reads, control-plane queries and bulk count
+# uploads, parsed on their pool too, are separate, so a long upload holding a shard's
+# write lock only queues other uploads)
+PUBLIC_DB_WORKERS = 8
+CONTROL_DB_WORKERS = 4
+INGEST_DB_WORKERS = 2
+# DB executors: calls allowed to wait for a thread before new ones are rejected with 503
+DB_MAX_QUEUED = 64
+# DB timeouts: seconds an endpoint waits for its query, including time spent queued
+CURRENT_TIMEOUT_S = 2.0
+MANIFEST_TIMEOUT_S = 10.0
+ADMIN_TIMEOUT_S = 15.0
+INGEST_TIMEOUT_S = 30.0
 
 # Trend: compare current count to N rows back
 TREND_LOOKBACK_ROWS = 20
@@ -58,10 +152,88 @@ LOOKBACK_DAYS = 45
 MAX_PERCENTILE = 0.9995
 # Aggregation: multiplier of baseline below which location is considered closed
 CLOSED_THRESHOLD = 1.5
-
+# Aggregation: seconds between full 45-day recomputes (new rows are folded in every CACHE_TTL)
+AGGREGATE_REFRESH_SECONDS = 3600
+# Aggregation: "python" or "duckdb" (needs the optional duckdb extra)
+AGGREGATE_BACKEND = os.environ.get("MIDDLINES_AGGREGATE_BACKEND", "python")
+# Aggregation: processes computing locations in parallel during the full pass; with 1
+# they run one after another in the refreshing thread
+AGGREGATE_WORKERS = int(
+    os.environ.get("MIDDLINES_AGGREGATE_WORKERS", str(os.cpu_count() or 1))
+)
+# Aggregation: seconds the full pass waits for its locations; any still running keep
+# their previous aggregates until the next pass
+AGGREGATE_TIMEOUT_S = 600
+# Smoothing: EMA parameter, must match the smoothed_counts view created by db-init
+EMA_ALPHA = 0.20
+# Storage: "chunked" when the ingester packs old readings into count_chunks; they are
+# then decoded and smoothed here instead of through the smoothed_counts view
+STORAGE_LAYOUT = os.environ.get("MIDDLINES_STORAGE_LAYOUT", "rows")
+# Smoothing: hours read before a window to seed its EMA where readings are smoothed
+# in Python (the view seeds it at a location's first reading, but 0.8**n has
+# vanished long before)
+EMA_WARMUP_HOURS = 24
+# Hot tier: hours of smoothed readings each worker keeps in memory per location
+HOT_TIER_HOURS = 24
 # Trend: minimum busyness percentage to report a trend (below this, trend is None)
 TREND_MIN_BUSYNESS = 10.0
 
+# Wire format: compact today_data sends busyness as round(percentage * BUSYNESS_SCALE)
+BUSYNESS_SCALE = 10
+# Wire format: Accept media types that select the compact JSON and MessagePack formats
+COMPACT_JSON_MEDIA_TYPE = "application/vnd.middlines.compact+json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Typical profiles: how long clients and proxies may cache /typical responses; the
+# ETag only changes when a full aggregate pass changes the profile
+TYPICAL_MAX_AGE_S = 86400
+
+# Downsampling: smallest max_points accepted (LTTB always keeps the first and last point)
+MIN_MAX_POINTS = 3
+# Downsampling: (format, max_points) encodings cached per snapshot generation, least
+# recently used evicted first
+MAX_CACHED_ENCODINGS = 16
+
+# Ingestion: largest request body accepted by /node/{node}/counts, in bytes
+MAX_INGEST_BYTES = 4 * 1024 * 1024
+# Ingestion: readings accepted per request
+MAX_INGEST_READINGS = 50_000
+# Ingestion: readings stamped further than this in the future are rejected
+MAX_INGEST_CLOCK_SKEW_S = 300
+# Ingestion: ...or older than this, which usually means the device clock never synced
+MAX_INGEST_AGE_DAYS = 365
+# Ingestion: readings outside these years are rejected before any time zone
+# conversion, which would overflow datetime's range
+MIN_INGEST_YEAR = 2
+MAX_INGEST_YEAR = 9998
+# Ingestion: validation errors listed in a 422 response
+MAX_INGEST_ERRORS = 20
+# Ingestion: line protocol measurement and timestamp units per precision, in both the
+# InfluxDB v1/v2 spelling and the v3 one the firmware's uploader sends
+LINE_PROTOCOL_MEASUREMENT = "counts"
+LINE_PROTOCOL_PRECISIONS = {
+    "s": 1,
+    "ms": 10**3,
+    "us": 10**6,
+    "ns": 10**9,
+    "second": 1,
+    "millisecond": 10**3,
+    "microsecond": 10**6,
+    "nanosecond": 10**9,
+}
+
+type WireFormat = Literal["json", "compact", "msgpack"]
+type SortOrder = Literal["asc", "desc"]
+type NodeSort = Literal["node", "version", "last_seen"]
+type ArtifactSort = Literal["uploaded", "version"]
+type Precision = Literal[
+    "s", "ms", "us", "ns", "second", "millisecond", "microsecond", "nanosecond"
+]
+# Locations become MQTT topic segments, so they can't contain topic separators
+type LocationName = Annotated[
+    str, StringConstraints(min_length=1, max_length=64, pattern=r"^[^/+#]+$")
+]
+
 
 class DataPoint(BaseModel):
     timestamp: datetime
@@ -77,18 +249,245 @@ class LocationStatus(BaseModel):
     today_data: list[DataPoint]
 
 
+class CompactSeries(BaseModel):
+    # Epoch seconds of the first point
+    start: int
+    # Seconds between consecutive points when they are evenly spaced...
+    step: int | None
+    # ...otherwise seconds since the previous point, one per point (the first is 0)
+    offsets: list[int] | None
+    scale: int
+    # Busyness percentage times `scale`, rounded
+    busyness: list[int | None]
+
+
+class CompactLocationStatus(BaseModel):
+    location: str
+    timestamp: datetime
+    busyness_percentage: float | None
+    vs_typical_percentage: float | None
+    trend: Literal["Increasing", "Steady", "Decreasing"] | None
+    today_data: CompactSeries
+
+
+class TypicalPoint(BaseModel):
+    # Start of the time bucket, in minutes after local midnight
+    minute: int
+    busyness_percentage: float | None
+
+
+class TypicalProfile(BaseModel):
+    location: str
+    # Content hash, also sent as the ETag
+    version: str
+    bucket_minutes: int
+    weekday: list[TypicalPoint]
+    weekend: list[TypicalPoint]
+
+
+class FreshnessProbe(BaseModel):
+    # Device timestamp of the latest probe reading in the published snapshot
+    probe_timestamp: datetime | None
+    generation: int
+
+
+class CountReading(BaseModel):
+    location: LocationName
+    # Timestamps without an offset are taken as local time
+    timestamp: datetime
+    count: Annotated[int, Field(ge=0)]
+    seq: Annotated[int, Field(ge=0)] | None = None
+
+
+class CountBatch(BaseModel):
+    readings: list[CountReading]
+
+
+class IngestResult(BaseModel):
+    received: int
+    inserted: int
+    # Repeats of an earlier (location, timestamp) in the same batch
+    duplicates: int
+    # Readings whose (location, timestamp) was already stored
+    existing: int
+
+
 class SmoothedCount(BaseModel):
     location: str
     timestamp: datetime
     count: float
 
 
+class DailyStats(BaseModel):
+    baseline: float
+    max_count: float
+    baseline_samples: int
+    open_samples: int
+
+
 class LocationAggregates(BaseModel):
     baseline: float
     max_count: float
     time_averages: dict[tuple[bool, int], float]
 
 
+class RecentBuffer:
+    # Smoothed readings for one location as parallel arrays of epoch seconds and
+    # counts. Trimming only advances `start`; the dead prefix is dropped once it
+    # makes up half the arrays, so appends and trims stay amortized O(1)
+    def __init__(self, readings: Iterable[tuple[float, float]] = ()) -> None:
+        self.timestamps = array("d")
+        self.counts = array("d")
+        self.start = 0
+        for timestamp, count in readings:
+            self.append(timestamp, count)
+
+    def __len__(self) -> int:
+        return len(self.counts) - self.start
+
+    def __iter__(self) -> Iterator[tuple[float, float]]:
+        return self.since(float("-inf"))
+
+    def append(self, timestamp: float, count: float) -> None:
+        self.timestamps.append(timestamp)
+        self.counts.append(count)
+
+    def trim(self, cutoff: float, keep_rows: int) -> None:
+        start = min(
+            bisect_left(self.timestamps, cutoff, lo=self.start),
+            len(self.counts) - keep_rows,
+        )
+        self.start = max(self.start, start)
+        if self.start * 2 >= len(self.counts):
+            del self.timestamps[: self.start]
+            del self.counts[: self.start]
+            self.start = 0
+
+    def truncate(self, timestamp: float) -> None:
+        # Drops readings at or after `timestamp`, to recompute them after late rows
+        first = bisect_left(self.timestamps, timestamp, lo=self.start)
+        del self.timestamps[first:]
+        del self.counts[first:]
+
+    def first_timestamp(self) -> float:
+        return self.timestamps[self.start]
+
+    def latest(self) -> tuple[float, float]:
+        return self.timestamps[-1], self.counts[-1]
+
+    def count_back(self, rows: int) -> float | None:
+        return self.counts[-1 - rows] if len(self) > rows else None
+
+    def since(self, timestamp: float) -> Iterator[tuple[float, float]]:
+        first = bisect_left(self.timestamps, timestamp, lo=self.start)
+        return zip(self.timestamps[first:], self.counts[first:], strict=True)
+
+
+class AggregateState(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # Highest counts.id already folded into `recent`, per shard
+    watermarks: dict[str, int]
+    aggregates_computed_at: datetime
+    aggregates: dict[str, LocationAggregates]
+    # Hot tier: the last HOT_TIER_HOURS of smoothed readings (and at least the
+    # trend lookback) per location
+    recent: dict[str, RecentBuffer]
+
+
+class AdminListing(BaseModel):
+    node_q: str = ""
+    version: str = ""
+    stale: bool = False
+    node_sort: NodeSort = "node"
+    node_order: SortOrder = "asc"
+    node_page: Annotated[int, Field(ge=1)] = 1
+    artifact_q: str = ""
+    artifact_sort: ArtifactSort = "uploaded"
+    artifact_order: SortOrder = "desc"
+    artifact_page: Annotated[int, Field(ge=1)] = 1
+
+
+class AdminDashboardData(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    nodes: list[sqlite3.Row]
+    node_total: int
+    artifacts: list[sqlite3.Row]
+    artifact_total: int
+    # Node and stale-node counts per current_version across the whole fleet
+    version_counts: list[sqlite3.Row]
+    rollouts: list[sqlite3.Row]
+    firmware_choices: list[sqlite3.Row]
+
+
+status_list_adapter = TypeAdapter(list[LocationStatus])
+compact_list_adapter = TypeAdapter(list[CompactLocationStatus])
+
+
+class DbExecutor:
+    def __init__(self, name: str, max_workers: int) -> None:
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix=f"db-{name}")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _call[**P, T](self, fn: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+    async def run[**P, T](
+        self, timeout: float, fn: Callable[P, T], *args: P.args, **kwargs: P.kwargs
+    ) -> T:
+        with self._lock:
+            if self.queued >= DB_MAX_QUEUED:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="Database busy")
+            self.queued += 1
+        future = self._pool.submit(self._call, fn, *args, **kwargs)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+                # Calls still queued are dropped; running queries finish in the background
+                if future.cancel():
+                    self.queued -= 1
+            logger.warning(f"{self.name} database call {fn.__name__} timed out")
+            raise HTTPException(status_code=504, detail="Database timeout") from None
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "queued": self.queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+public_db = DbExecutor("public", PUBLIC_DB_WORKERS)
+control_db = DbExecutor("control", CONTROL_DB_WORKERS)
+ingest_db = DbExecutor("ingest", INGEST_DB_WORKERS)
+
+
 def utc_now() -> str:
     return datetime.now(UTC).isoformat(timespec="seconds")
 
@@ -97,6 +496,19 @@ def ensure_directories() -> None:
     ARTIFACTS_DIR.mkdir(parents=True, exist_ok=True)
 
 
+def map_shards[T](fn: Callable[[str], T]) -> dict[str, T]:
+    # sqlite3 releases the GIL while a query runs, so shards are read concurrently
+    shards = all_shards()
+    with ThreadPoolExecutor(len(shards), thread_name_prefix="shard") as pool:
+        return dict(zip(shards, pool.map(fn, shards), strict=True))
+
+
+def get_db_connection(shard: str = DEFAULT_SHARD) -> sqlite3.Connection:
+    db = sqlite3.connect(shard_database_path(DATABASE_PATH, shard), timeout=5.0)
+    db.row_factory = sqlite3.Row
+    return db
+
+
 def get_control_db_connection() -> sqlite3.Connection:
     db = sqlite3.connect(CONTROL_DATABASE_PATH, timeout=5.0)
     db.row_factory = sqlite3.Row
@@ -115,6 +527,8 @@ def init_control_db() -> None:
             last_seen_at TEXT,
             last_manifest_fetch_at TEXT,
             last_ip TEXT,
+            node_group TEXT NOT NULL DEFAULT '',
+            locations TEXT NOT NULL DEFAULT '',
             updated_at TEXT NOT NULL
         )
         """
@@ -132,6 +546,28 @@ def init_control_db() -> None:
         )
         """
     )
+    db.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_nodes_last_seen_at ON nodes(last_seen_at)
+        """
+    )
+    db.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_nodes_current_version ON nodes(current_version)
+        """
+    )
+    db.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_firmware_artifacts_uploaded_at
+        ON firmware_artifacts(uploaded_at, id)
+        """
+    )
+    db.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_firmware_artifacts_version
+        ON firmware_artifacts(version)
+        """
+    )
     db.execute(
         """
         CREATE TABLE IF NOT EXISTS node_desired_state (
@@ -144,15 +580,81 @@ def init_control_db() -> None:
         )
         """
     )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS firmware_rollouts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            firmware_id INTEGER NOT NULL,
+            node_group TEXT NOT NULL,
+            wave_size INTEGER NOT NULL,
+            max_concurrent INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            current_wave INTEGER NOT NULL DEFAULT 0,
+            pause_reason TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY(firmware_id) REFERENCES firmware_artifacts(id)
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rollout_nodes (
+            rollout_id INTEGER NOT NULL,
+            node TEXT NOT NULL,
+            wave INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            previous_firmware_id INTEGER,
+            released_at TEXT,
+            finished_at TEXT,
+            PRIMARY KEY(rollout_id, node),
+            FOREIGN KEY(rollout_id) REFERENCES firmware_rollouts(id),
+            FOREIGN KEY(node) REFERENCES nodes(node)
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_rollout_nodes_node_state
+        ON rollout_nodes(node, state)
+        """
+    )
+    db.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_rollout_nodes_rollout_state
+        ON rollout_nodes(rollout_id, state, wave)
+        """
+    )
+    # Older databases predate node groups
+    node_columns = {row["name"] for row in db.execute("PRAGMA table_info(nodes)")}
+    if "node_group" not in node_columns:
+        db.execute("ALTER TABLE nodes ADD COLUMN node_group TEXT NOT NULL DEFAULT ''")
+    # ...and the locations a node may upload counts for; the default nodes are
+    # named after their dining halls
+    if "locations" not in node_columns:
+        db.execute("ALTER TABLE nodes ADD COLUMN locations TEXT NOT NULL DEFAULT ''")
+        db.executemany(
+            "UPDATE nodes SET locations = node WHERE node = ?",
+            [(node,) for node in DEFAULT_NODES],
+        )
     now = utc_now()
+    # Cancelling used to leave a rollout's unfinished nodes pending or downloading
+    db.execute(
+        """
+        UPDATE rollout_nodes SET state = 'cancelled', finished_at = ?
+        WHERE state IN ('pending', 'downloading')
+          AND rollout_id IN (SELECT id FROM firmware_rollouts WHERE status = 'cancelled')
+        """,
+        (now,),
+    )
     for node in DEFAULT_NODES:
         db.execute(
             """
-            INSERT INTO nodes (node, updated_at)
-            VALUES (?, ?)
+            INSERT INTO nodes (node, locations, updated_at)
+            VALUES (?, ?, ?)
             ON CONFLICT(node) DO NOTHING
             """,
-            (node, now),
+            (node, node, now),
         )
         db.execute(
             """
@@ -166,135 +668,1146 @@ def init_control_db() -> None:
     db.close()
 
 
-def _compute_aggregates(counts: list[SmoothedCount]) -> dict[str, LocationAggregates]:
-    now = datetime.now(TIMEZONE)
-    yesterday = now - timedelta(days=1)
-    lookback_start = now - timedelta(days=LOOKBACK_DAYS)
-
-    by_location: dict[str, list[SmoothedCount]] = {}
-    for c in counts:
-        by_location.setdefault(c.location, []).append(c)
+def get_snapshot_db_connection() -> sqlite3.Connection:
+    db = sqlite3.connect(SNAPSHOT_DATABASE_PATH, timeout=5.0)
+    db.row_factory = sqlite3.Row
+    return db
 
-    result: dict[str, LocationAggregates] = {}
-    for location, location_counts in by_location.items():
-        baseline_counts = [
-            c.count
-            for c in location_counts
-            if c.timestamp > yesterday and c.timestamp.hour in set(range(1, 4))
-        ]
-        baseline = sum(baseline_counts) / len(baseline_counts) if baseline_counts else 0
 
-        open_counts = sorted(
-            c.count
-            for c in location_counts
-            if c.timestamp > lookback_start and c.count > baseline * CLOSED_THRESHOLD
+def init_snapshot_db() -> None:
+    db = get_snapshot_db_connection()
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS status_snapshot (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL,
+            computed_at TEXT NOT NULL,
+            payload BLOB NOT NULL
         )
-        if open_counts:
-            percentile_idx = int(len(open_counts) * MAX_PERCENTILE)
-            percentile_idx = min(percentile_idx, len(open_counts) - 1)
-            max_count = open_counts[percentile_idx] - baseline
-        else:
-            max_count = 0
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS snapshot_freshness_probe (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL,
+            probe_timestamp TEXT
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS snapshot_lease (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS aggregate_watermark (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            aggregates_computed_at TEXT NOT NULL
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS shard_watermarks (
+            shard TEXT PRIMARY KEY,
+            last_count_id INTEGER NOT NULL
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS location_aggregates (
+            location TEXT PRIMARY KEY,
+            baseline REAL NOT NULL,
+            max_count REAL NOT NULL
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS location_time_averages (
+            location TEXT NOT NULL,
+            is_weekend INTEGER NOT NULL,
+            minute INTEGER NOT NULL,
+            average REAL NOT NULL,
+            PRIMARY KEY (location, is_weekend, minute)
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS typical_profiles (
+            location TEXT PRIMARY KEY,
+            version TEXT NOT NULL,
+            payload BLOB NOT NULL
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS location_recent (
+            location TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            smoothed_count REAL NOT NULL
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_location_recent_location_timestamp
+        ON location_recent(location, timestamp)
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT NOT NULL,
+            location TEXT NOT NULL,
+            baseline REAL NOT NULL,
+            max_count REAL NOT NULL,
+            baseline_samples INTEGER NOT NULL,
+            open_samples INTEGER NOT NULL,
+            computed_at TEXT NOT NULL,
+            PRIMARY KEY (day, location)
+        )
+        """
+    )
+    db.commit()
+    db.close()
+
+
+def _compute_aggregates(
+    counts: Iterable[SmoothedCount], daily_stats: dict[str, DailyStats]
+) -> dict[str, LocationAggregates]:
+    # `counts` is consumed once, in (location, timestamp) order. Locations with
+    # stored daily stats take baseline and max count from them; the rest compute
+    # both from `counts` as of now
+    if AGGREGATE_BACKEND == "duckdb":
+        return _compute_aggregates_duckdb(counts, daily_stats)
+    if AGGREGATE_BACKEND != "python":
+        raise ValueError(f"Unknown aggregate backend {AGGREGATE_BACKEND!r}")
+    return _compute_aggregates_python(counts, daily_stats)
+
+
+def _compute_daily_stats(
+    location_counts: list[SmoothedCount], now: datetime
+) -> DailyStats:
+    stats = compute_baseline_stats(
+        [(c.timestamp, c.count) for c in location_counts],
+        now,
+        LOOKBACK_DAYS,
+        CLOSED_THRESHOLD,
+        MAX_PERCENTILE,
+    )
+    return DailyStats(
+        baseline=stats.baseline,
+        max_count=stats.max_count,
+        baseline_samples=stats.baseline_samples,
+        open_samples=stats.open_samples,
+    )
+
+
+def _compute_aggregates_python(
+    counts: Iterable[SmoothedCount], daily_stats: dict[str, DailyStats]
+) -> dict[str, LocationAggregates]:
+    now = datetime.now(TIMEZONE)
+    lookback_start = now - timedelta(days=LOOKBACK_DAYS)
 
-        time_buckets: dict[tuple[bool, int], list[float]] = {}
+    result: dict[str, LocationAggregates] = {}
+    for location, location_counts in groupby(counts, key=lambda c: c.location):
+        stats = daily_stats.get(location)
+        if stats is None:
+            # The baseline comes from the end of the window, so a location without
+            # stored stats is held in memory (on its own) to compute it first
+            held = list(location_counts)
+            stats = _compute_daily_stats(held, now)
+            location_counts = iter(held)
+        threshold = stats.baseline * CLOSED_THRESHOLD
+
+        # Running sums per bucket, so memory doesn't grow with the readings
+        bucket_sums: dict[tuple[bool, int], float] = {}
+        bucket_samples: dict[tuple[bool, int], int] = {}
         for c in location_counts:
             if c.timestamp <= lookback_start:
                 continue
-            if c.count <= baseline * CLOSED_THRESHOLD:
+            if c.count <= threshold:
                 continue
             is_weekend = c.timestamp.weekday() >= 5
             minutes = (
                 c.timestamp.hour * 60
                 + (c.timestamp.minute // TIME_BUCKET_SIZE) * TIME_BUCKET_SIZE
             )
-            time_buckets.setdefault((is_weekend, minutes), []).append(c.count)
+            bucket = (is_weekend, minutes)
+            bucket_sums[bucket] = bucket_sums.get(bucket, 0.0) + c.count
+            bucket_samples[bucket] = bucket_samples.get(bucket, 0) + 1
 
         result[location] = LocationAggregates(
-            baseline=baseline,
-            max_count=max_count,
-            time_averages={k: sum(v) / len(v) for k, v in time_buckets.items()},
+            baseline=stats.baseline,
+            max_count=stats.max_count,
+            time_averages={
+                bucket: total / bucket_samples[bucket]
+                for bucket, total in bucket_sums.items()
+            },
         )
 
     return result
 
 
-def _calculate_busyness(
-    count: float | None,
-    baseline: float | None,
-    max_count: float | None,
-) -> float | None:
-    if count is None or baseline is None or max_count is None or max_count <= 0:
-        return None
-    busyness = ((count - baseline) / max_count) * 100
-    return max(0.0, min(100.0, busyness))
-
+def _compute_aggregates_duckdb(
+    counts: Iterable[SmoothedCount], daily_stats: dict[str, DailyStats]
+) -> dict[str, LocationAggregates]:
+    # Optional dependency, only imported when this backend is selected
+    import duckdb
 
-def _build_location_status(db: sqlite3.Connection) -> list[LocationStatus]:
     now = datetime.now(TIMEZONE)
-    midnight_today = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    lookback_start = now - timedelta(days=LOOKBACK_DAYS)
+    yesterday = (now - timedelta(days=1)).timestamp()
+    lookback_start = (now - timedelta(days=LOOKBACK_DAYS)).timestamp()
+
+    con = duckdb.connect()
+    try:
+        # Binding Python lists as parameters is orders of magnitude slower than
+        # letting DuckDB's CSV reader load a columnar export of the readings
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", newline="") as export:
+            # Instants for the window comparisons, local wall-clock time for the
+            # hour/minute/weekday buckets, matching the Python backend
+            csv.writer(export).writerows(
+                (
+                    c.location,
+                    c.timestamp.timestamp(),
+                    c.timestamp.replace(tzinfo=None).isoformat(sep=" "),
+                    c.count,
+                )
+                for c in counts
+            )
+            export.flush()
+            con.execute(
+                """
+                CREATE TABLE readings AS
+                SELECT * FROM read_csv(
+                    $path,
+                    header = false,
+                    columns = {
+                        'location': 'VARCHAR',
+                        'epoch': 'DOUBLE',
+                        'local_ts': 'TIMESTAMP',
+                        'count': 'DOUBLE'
+                    }
+                )
+                """,
+                {"path": export.name},
+            )
+        con.execute(
+            "CREATE TABLE daily_stats (location VARCHAR, baseline DOUBLE, max_count DOUBLE)"
+        )
+        if daily_stats:
+            con.executemany(
+                "INSERT INTO daily_stats VALUES (?, ?, ?)",
+                [
+                    (location, stats.baseline, stats.max_count)
+                    for location, stats in daily_stats.items()
+                ],
+            )
+        con.execute(
+            """
+            CREATE TABLE open_readings AS
+            WITH computed AS (
+                SELECT
+                    location,
+                    COALESCE(
+                        AVG(count) FILTER (
+                            WHERE epoch > $yesterday
+                            AND hour(local_ts) >= $baseline_start
+                            AND hour(local_ts) < $baseline_end
+                        ),
+                        0
+                    ) AS baseline
+                FROM readings
+                GROUP BY location
+            ),
+            baselines AS (
+                SELECT
+                    c.location,
+                    COALESCE(d.baseline, c.baseline) AS baseline,
+                    d.max_count AS stored_max_count
+                FROM computed c
+                LEFT JOIN daily_stats d USING (location)
+            )
+            SELECT b.location, r.local_ts, r.count, b.baseline, b.stored_max_count
+            FROM baselines b
+            LEFT JOIN readings r
+                ON r.location = b.location
+                AND r.epoch > $lookback_start
+                AND r.count > b.baseline * $closed_threshold
+            """,
+            {
+                "yesterday": yesterday,
+                "lookback_start": lookback_start,
+                "closed_threshold": CLOSED_THRESHOLD,
+                "baseline_start": BASELINE_START_HOUR,
+                "baseline_end": BASELINE_END_HOUR,
+            },
+        )
+        location_rows = con.execute(
+            """
+            WITH ranked AS (
+                SELECT
+                    location,
+                    baseline,
+                    stored_max_count,
+                    count,
+                    ROW_NUMBER() OVER (PARTITION BY location ORDER BY count) - 1 AS idx,
+                    COUNT(count) OVER (PARTITION BY location) AS n
+                FROM open_readings
+            )
+            SELECT
+                location,
+                ANY_VALUE(baseline) AS baseline,
+                COALESCE(
+                    ANY_VALUE(stored_max_count),
+                    MAX(count - baseline) FILTER (
+                        WHERE idx = LEAST(FLOOR(n * $max_percentile)::BIGINT, n - 1)
+                    ),
+                    0
+                ) AS max_count
+            FROM ranked
+            GROUP BY location
+            """,
+            {"max_percentile": MAX_PERCENTILE},
+        ).fetchall()
+        bucket_rows = con.execute(
+            """
+            SELECT
+                location,
+                isodow(local_ts) >= 6 AS is_weekend,
+                hour(local_ts) * 60
+                    + (minute(local_ts) // $bucket_size) * $bucket_size AS minutes,
+                AVG(count) AS average
+            FROM open_readings
+            WHERE count IS NOT NULL
+            GROUP BY ALL
+            """,
+            {"bucket_size": TIME_BUCKET_SIZE},
+        ).fetchall()
+    finally:
+        con.close()
+
+    result = {
+        cast(str, location): LocationAggregates(
+            baseline=cast(float, baseline),
+            max_count=cast(float, max_count),
+            time_averages={},
+        )
+        for location, baseline, max_count in location_rows
+    }
+    for location, is_weekend, minutes, average in bucket_rows:
+        result[cast(str, location)].time_averages[
+            (cast(bool, is_weekend), cast(int, minutes))
+        ] = cast(float, average)
+    return result
+
+
+def _decode_chunk_rows(
+    rows: Iterable[sqlite3.Row],
+) -> Iterator[tuple[str, datetime, int]]:
+    for row in rows:
+        offset = timezone(timedelta(seconds=row["utc_offset"]))
+        for ts, count in decode_chunk(
+            row["first_ts"], row["first_count"], row["payload"]
+        ):
+            yield row["location"], datetime.fromtimestamp(ts, offset), count
+
+
+def _iter_readings(
+    db: sqlite3.Connection,
+    since: datetime,
+    until: datetime | None,
+    location: str | None = None,
+    until_id: int | None = None,
+) -> Iterator[tuple[str, datetime, int]]:
+    # Raw readings from count_chunks and the counts rows not packed (yet), in
+    # (location, timestamp) order; optionally only one location's, and only
+    # counts rows up to `until_id`
+    location_filter = "" if location is None else "AND location = ?"
+    location_params = () if location is None else (location,)
+    since_ts = int(since.timestamp())
+    chunk_rows = db.execute(
+        f"""
+        SELECT location, utc_offset, first_ts, first_count, payload
+        FROM count_chunks
+        WHERE chunk_start >= ? AND chunk_start <= COALESCE(?, chunk_start)
+            {location_filter}
+        ORDER BY location, chunk_start
+        """,
+        (
+            since_ts - since_ts % CHUNK_SECONDS,
+            int(until.timestamp()) if until else None,
+            *location_params,
+        ),
+    )
+    rows = db.execute(
+        f"""
+        SELECT location, timestamp, count
+        FROM counts
+        WHERE timestamp >= ? AND timestamp <= COALESCE(?, timestamp)
+            AND id <= COALESCE(?, id) {location_filter}
+        ORDER BY location, timestamp
+        """,
+        (
+            since.isoformat(sep=" ", timespec="seconds"),
+            until.isoformat(sep=" ", timespec="seconds") if until else None,
+            until_id,
+            *location_params,
+        ),
+    )
+    return heapq.merge(
+        _decode_chunk_rows(chunk_rows),
+        (
+            (
+                cast(str, row["location"]),
+                datetime.fromisoformat(row["timestamp"]),
+                cast(int, row["count"]),
+            )
+            for row in rows
+        ),
+        key=lambda reading: (reading[0], reading[1]),
+    )
+
 
+def _smooth_readings(
+    readings: Iterable[tuple[str, datetime, int]],
+    since: datetime,
+    until: datetime | None,
+) -> Iterator[SmoothedCount]:
+    # The smoothed_counts view's recurrence, seeded by the first reading given
+    for location, location_readings in groupby(readings, key=lambda r: r[0]):
+        smoothed: float | None = None
+        for _, timestamp, count in location_readings:
+            smoothed = (
+                float(count)
+                if smoothed is None
+                else EMA_ALPHA * count + (1 - EMA_ALPHA) * smoothed
+            )
+            if timestamp >= since and (until is None or timestamp <= until):
+                yield SmoothedCount(
+                    location=location, timestamp=timestamp, count=smoothed
+                )
+
+
+def _iter_smoothed_counts(
+    db: sqlite3.Connection, since: datetime, until: datetime | None = None
+) -> Iterator[SmoothedCount]:
+    if STORAGE_LAYOUT == "chunked":
+        warmup = since - timedelta(hours=EMA_WARMUP_HOURS)
+        yield from _smooth_readings(_iter_readings(db, warmup, until), since, until)
+        return
     rows = db.execute(
         """
         SELECT location, timestamp, smoothed_count
         FROM smoothed_counts
-        WHERE timestamp >= ?
+        WHERE timestamp >= ? AND timestamp <= COALESCE(?, timestamp)
         ORDER BY location, timestamp
         """,
-        (lookback_start.isoformat(sep=" ", timespec="seconds"),),
-    ).fetchall()
-
-    if not rows:
-        raise HTTPException(status_code=503, detail="No data available")
-
-    counts = [
-        SmoothedCount(
+        (
+            since.isoformat(sep=" ", timespec="seconds"),
+            until.isoformat(sep=" ", timespec="seconds") if until else None,
+        ),
+    )
+    for row in rows:
+        yield SmoothedCount(
             location=row["location"],
             timestamp=datetime.fromisoformat(row["timestamp"]),
             count=row["smoothed_count"],
         )
-        for row in rows
-    ]
 
-    aggregates = _compute_aggregates(counts)
-    by_location: dict[str, list[SmoothedCount]] = {}
-    for c in counts:
-        by_location.setdefault(c.location, []).append(c)
 
-    results: list[LocationStatus] = []
-    for location, location_counts in sorted(by_location.items()):
-        agg = aggregates.get(location)
-        if not agg:
-            continue
+def _load_smoothed_counts(
+    db: sqlite3.Connection, since: datetime, until: datetime | None = None
+) -> list[SmoothedCount]:
+    return list(_iter_smoothed_counts(db, since, until))
 
-        latest = location_counts[-1]
-        past_count = (
-            location_counts[-1 - TREND_LOOKBACK_ROWS].count
-            if len(location_counts) > TREND_LOOKBACK_ROWS
-            else None
+
+def _trim_recent(buffer: RecentBuffer) -> None:
+    # Keep the hot tier window (today_data) and never fewer rows than the trend
+    # lookback needs
+    cutoff = datetime.now(TIMEZONE) - timedelta(hours=HOT_TIER_HOURS)
+    buffer.trim(cutoff.timestamp(), TREND_LOOKBACK_ROWS + 1)
+
+
+def _format_timestamp(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, TIMEZONE).isoformat(
+        sep=" ", timespec="seconds"
+    )
+
+
+def _feed_recent(
+    counts: Iterable[SmoothedCount], recent: dict[str, RecentBuffer]
+) -> Iterator[SmoothedCount]:
+    # Fills the hot tier as rows stream past. Rows older than the window are
+    # trimmed as they pile up, so a buffer never holds more than twice the trend
+    # lookback of them
+    cutoff = (datetime.now(TIMEZONE) - timedelta(hours=HOT_TIER_HOURS)).timestamp()
+    keep_rows = TREND_LOOKBACK_ROWS + 1
+    for c in counts:
+        timestamp = c.timestamp.timestamp()
+        buffer = recent.get(c.location)
+        if buffer is None:
+            buffer = recent[c.location] = RecentBuffer()
+        buffer.append(timestamp, c.count)
+        if timestamp < cutoff and len(buffer) > 2 * keep_rows:
+            buffer.trim(cutoff, keep_rows)
+        yield c
+
+
+def compute_location_state(
+    location: str, watermarks: dict[str, int], stats: DailyStats | None
+) -> tuple[LocationAggregates, RecentBuffer] | None:
+    # One location's share of the full pass, run on the aggregate pool: its
+    # lookback window from every shard (counts rows up to the pass's watermarks),
+    # smoothed and streamed through its hot tier buffer into its aggregates. The
+    # smoothed_counts view can't be narrowed to one location, so the readings
+    # are smoothed here
+    since = datetime.now(TIMEZONE) - timedelta(days=LOOKBACK_DAYS)
+    warmup = since - timedelta(hours=EMA_WARMUP_HOURS)
+    with ExitStack() as stack:
+        shard_readings: list[Iterator[tuple[str, datetime, int]]] = []
+        for shard, watermark_id in watermarks.items():
+            db = get_db_connection(shard)
+            stack.callback(db.close)
+            # Chunks and counts rows from one snapshot, so compaction can't move
+            # rows between the two reads
+            db.execute("BEGIN")
+            shard_readings.append(
+                _iter_readings(db, warmup, None, location, watermark_id)
+            )
+        recent: dict[str, RecentBuffer] = {}
+        aggregates = _compute_aggregates(
+            _feed_recent(
+                _smooth_readings(
+                    heapq.merge(*shard_readings, key=lambda reading: reading[1]),
+                    since,
+                    None,
+                ),
+                recent,
+            ),
+            {location: stats} if stats else {},
         )
-        busyness = _calculate_busyness(latest.count, agg.baseline, agg.max_count)
+    if location not in recent:
+        return None
+    buffer = recent[location]
+    _trim_recent(buffer)
+    return aggregates[location], buffer
 
-        is_weekend = latest.timestamp.weekday() >= 5
-        minutes = (
-            latest.timestamp.hour * 60
-            + (latest.timestamp.minute // TIME_BUCKET_SIZE) * TIME_BUCKET_SIZE
+
+def _read_shard_locations(shard: str) -> tuple[int, list[str]]:
+    since = int((datetime.now(TIMEZONE) - timedelta(days=LOOKBACK_DAYS)).timestamp())
+    db = get_db_connection(shard)
+    try:
+        # The watermark and the locations up to it from one consistent snapshot
+        db.execute("BEGIN")
+        watermark_id = cast(
+            int, db.execute("SELECT COALESCE(MAX(id), 0) FROM counts").fetchone()[0]
         )
-        typical = agg.time_averages.get((is_weekend, minutes))
-        vs_typical = (
-            ((latest.count - typical) / typical) * 100
-            if typical and typical > 0
-            else None
+        locations = [
+            cast(str, row["location"])
+            for row in db.execute(
+                """
+                SELECT location FROM counts WHERE timestamp >= ? AND id <= ?
+                UNION
+                SELECT location FROM count_chunks WHERE chunk_start >= ?
+                """,
+                (
+                    _format_timestamp(since),
+                    watermark_id,
+                    since - since % CHUNK_SECONDS,
+                ),
+            )
+        ]
+        db.rollback()
+    finally:
+        db.close()
+    return watermark_id, locations
+
+
+# Process pool for the full pass, started on first use and kept across passes
+_aggregate_pool: ProcessPoolExecutor | None = None
+
+
+def _map_locations(
+    locations: list[str],
+    watermarks: dict[str, int],
+    daily_stats: dict[str, DailyStats],
+) -> dict[str, tuple[LocationAggregates, RecentBuffer]]:
+    # Every location succeeds or fails on its own; failed ones are left out
+    global _aggregate_pool
+    results: dict[str, tuple[LocationAggregates, RecentBuffer] | None] = {}
+    if AGGREGATE_WORKERS <= 1:
+        for location in locations:
+            try:
+                results[location] = compute_location_state(
+                    location, watermarks, daily_stats.get(location)
+                )
+            except Exception as e:
+                logger.error(f"Aggregating {location} failed: {e}")
+        return {k: v for k, v in results.items() if v is not None}
+
+    if _aggregate_pool is None:
+        # Spawned rather than forked, since this process runs threads
+        _aggregate_pool = ProcessPoolExecutor(
+            AGGREGATE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    futures = {
+        _aggregate_pool.submit(
+            compute_location_state, location, watermarks, daily_stats.get(location)
+        ): location
+        for location in locations
+    }
+    done, not_done = wait(futures, timeout=AGGREGATE_TIMEOUT_S)
+    for future in not_done:
+        future.cancel()
+        logger.error(f"Aggregating {futures[future]} timed out")
+    pool_failed = bool(not_done)
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            logger.error(f"Aggregating {futures[future]} failed: {e}")
+            pool_failed |= isinstance(e, BrokenProcessPool)
+    if pool_failed:
+        # A crashed worker breaks the pool and a stuck one would hold a slot, so
+        # the next pass starts a fresh one. Shutting down leaves a worker that is
+        # still computing running, so the old pool's workers are terminated (the
+        # executor doesn't expose them, and drops its reference on shutdown)
+        processes: dict[int, BaseProcess] = (
+            getattr(_aggregate_pool, "_processes", None) or {}
         )
+        workers = list(processes.values())
+        _aggregate_pool.shutdown(wait=False, cancel_futures=True)
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join()
+        _aggregate_pool = None
+    return {k: v for k, v in results.items() if v is not None}
+
+
+def shutdown_aggregate_pool() -> None:
+    if _aggregate_pool is not None:
+        _aggregate_pool.shutdown(cancel_futures=True)
+
+
+def compute_aggregate_state(
+    daily_stats: dict[str, DailyStats], previous: AggregateState | None = None
+) -> AggregateState:
+    # Locations are computed independently, in parallel, and merged into one
+    # state; memory per location scales with its buckets and hot tier window
+    by_shard = map_shards(_read_shard_locations)
+    locations = sorted(
+        {
+            location
+            for _, shard_locations in by_shard.values()
+            for location in shard_locations
+        }
+    )
+    if not locations:
+        raise HTTPException(status_code=503, detail="No data available")
+    watermarks = {shard: watermark_id for shard, (watermark_id, _) in by_shard.items()}
+
+    results = _map_locations(locations, watermarks, daily_stats)
+    aggregates = {location: agg for location, (agg, _) in results.items()}
+    recent = {location: buffer for location, (_, buffer) in results.items()}
+    if previous is not None:
+        # A failed location keeps its previous aggregates until the next pass, and
+        # its previous readings caught up to the new watermarks, which later
+        # catch-ups continue from
+        for location in set(locations) - results.keys():
+            if location not in previous.aggregates or location not in previous.recent:
+                continue
+            aggregates[location] = previous.aggregates[location]
+            buffer = recent[location] = previous.recent[location]
+            for shard, watermark_id in watermarks.items():
+                rows = _read_new_location_counts(
+                    shard, location, previous.watermarks.get(shard, 0), watermark_id
+                )
+                if rows:
+                    _catch_up_location(shard, location, buffer, rows)
+            _trim_recent(buffer)
+
+    return AggregateState(
+        watermarks=watermarks,
+        aggregates_computed_at=datetime.now(TIMEZONE),
+        aggregates=aggregates,
+        recent=recent,
+    )
 
-        trend: Literal["Increasing", "Steady", "Decreasing"] | None = None
-        if (
-            busyness is not None
+
+def _read_shard_stats_window(
+    shard: str, since: datetime, until: datetime
+) -> list[SmoothedCount]:
+    db = get_db_connection(shard)
+    try:
+        return _load_smoothed_counts(db, since, until)
+    finally:
+        db.close()
+
+
+def compute_daily_stats(days: list[date]) -> dict[date, dict[str, DailyStats]]:
+    # Each day's stats are what the full pass would have computed at that day's
+    # BASELINE_END_HOUR, so one read of the widest window covers every day
+    as_of = {day: daily_stats_as_of(day, TIMEZONE) for day in days}
+    since = min(as_of.values()) - timedelta(days=LOOKBACK_DAYS)
+    until = max(as_of.values())
+
+    by_location: dict[str, list[SmoothedCount]] = {}
+    for shard_counts in map_shards(
+        lambda shard: _read_shard_stats_window(shard, since, until)
+    ).values():
+        for c in shard_counts:
+            by_location.setdefault(c.location, []).append(c)
+    for location_counts in by_location.values():
+        location_counts.sort(key=lambda c: c.timestamp)
+
+    result: dict[date, dict[str, DailyStats]] = {}
+    for day, moment in as_of.items():
+        result[day] = {}
+        for location, location_counts in by_location.items():
+            first = bisect_right(
+                location_counts,
+                moment - timedelta(days=LOOKBACK_DAYS),
+                key=lambda c: c.timestamp,
+            )
+            last = bisect_right(location_counts, moment, key=lambda c: c.timestamp)
+            if first < last:
+                result[day][location] = _compute_daily_stats(
+                    location_counts[first:last], moment
+                )
+    return result
+
+
+def save_daily_stats(
+    db: sqlite3.Connection, stats: dict[date, dict[str, DailyStats]]
+) -> None:
+    computed_at = utc_now()
+    db.executemany(
+        """
+        INSERT INTO daily_stats (
+            day, location, baseline, max_count, baseline_samples, open_samples,
+            computed_at
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(day, location) DO UPDATE SET
+            baseline = excluded.baseline,
+            max_count = excluded.max_count,
+            baseline_samples = excluded.baseline_samples,
+            open_samples = excluded.open_samples,
+            computed_at = excluded.computed_at
+        """,
+        [
+            (
+                day.isoformat(),
+                location,
+                location_stats.baseline,
+                location_stats.max_count,
+                location_stats.baseline_samples,
+                location_stats.open_samples,
+                computed_at,
+            )
+            for day, day_stats in stats.items()
+            for location, location_stats in day_stats.items()
+        ],
+    )
+    db.commit()
+
+
+def load_daily_stats(db: sqlite3.Connection, day: date) -> dict[str, DailyStats]:
+    return {
+        row["location"]: DailyStats(
+            baseline=row["baseline"],
+            max_count=row["max_count"],
+            baseline_samples=row["baseline_samples"],
+            open_samples=row["open_samples"],
+        )
+        for row in db.execute(
+            """
+            SELECT location, baseline, max_count, baseline_samples, open_samples
+            FROM daily_stats
+            WHERE day = ?
+            """,
+            (day.isoformat(),),
+        )
+    }
+
+
+def _read_new_counts(shard: str, after_id: int) -> list[sqlite3.Row]:
+    db = get_db_connection(shard)
+    try:
+        rows = db.execute(
+            """
+            SELECT id, location, timestamp, count
+            FROM counts
+            WHERE id > ?
+            ORDER BY id
+            """,
+            (after_id,),
+        ).fetchall()
+    finally:
+        db.close()
+    return cast(list[sqlite3.Row], rows)
+
+
+def _read_new_location_counts(
+    shard: str, location: str, after_id: int, until_id: int
+) -> list[sqlite3.Row]:
+    db = get_db_connection(shard)
+    try:
+        rows = db.execute(
+            """
+            SELECT id, location, timestamp, count
+            FROM counts
+            WHERE location = ? AND id > ? AND id <= ?
+            ORDER BY id
+            """,
+            (location, after_id, until_id),
+        ).fetchall()
+    finally:
+        db.close()
+    return cast(list[sqlite3.Row], rows)
+
+
+def _read_location_counts(
+    shard: str, location: str, since: str, until_id: int
+) -> list[sqlite3.Row]:
+    db = get_db_connection(shard)
+    try:
+        rows = db.execute(
+            """
+            SELECT timestamp, count
+            FROM counts
+            WHERE location = ? AND timestamp >= ? AND id <= ?
+            ORDER BY timestamp, id
+            """,
+            (location, since, until_id),
+        ).fetchall()
+    finally:
+        db.close()
+    return cast(list[sqlite3.Row], rows)
+
+
+def _catch_up_location(
+    shard: str, location: str, buffer: RecentBuffer, rows: list[sqlite3.Row]
+) -> list[tuple[float, float]]:
+    # New rows usually extend the series. Rows stamped before the newest smoothed
+    # reading (device-buffered or replayed) change every EMA value after them, so
+    # the buffer is cut back to the earliest late row and that stretch is
+    # re-smoothed from SQLite; how far back is bounded by the hot tier window
+    readings = sorted(
+        (
+            (datetime.fromisoformat(row["timestamp"]).timestamp(), row["timestamp"])
+            for row in rows
+        ),
+        key=lambda reading: reading[0],
+    )
+    recompute_from: str | None = None
+    if len(buffer) and readings[0][0] < buffer.latest()[0]:
+        in_window = [r for r in readings if r[0] >= buffer.first_timestamp()]
+        if len(in_window) < len(readings):
+            # Older rows reach the hot tier with the next full aggregate pass
+            logger.info(
+                f"{len(readings) - len(in_window)} late counts for {location} "
+                f"predate the hot tier"
+            )
+        if not in_window:
+            return []
+        buffer.truncate(in_window[0][0])
+        recompute_from = in_window[0][1]
+
+    counts = (
+        _read_location_counts(shard, location, recompute_from, rows[-1]["id"])
+        if recompute_from is not None
+        else sorted(rows, key=lambda row: datetime.fromisoformat(row["timestamp"]))
+    )
+    tail: list[tuple[float, float]] = []
+    for row in counts:
+        smoothed = (
+            EMA_ALPHA * row["count"] + (1 - EMA_ALPHA) * buffer.latest()[1]
+            if len(buffer)
+            else float(row["count"])
+        )
+        timestamp = datetime.fromisoformat(row["timestamp"]).timestamp()
+        buffer.append(timestamp, smoothed)
+        tail.append((timestamp, smoothed))
+    return tail
+
+
+def catch_up_aggregate_state(
+    state: AggregateState,
+) -> dict[str, list[tuple[float, float]]]:
+    # Continue each location's EMA from its last smoothed value, the same way the
+    # smoothed_counts view would, for rows added since each shard's watermark.
+    # Returns each changed location's rewritten tail of the hot tier
+    new_rows = map_shards(
+        lambda shard: _read_new_counts(shard, state.watermarks.get(shard, 0))
+    )
+
+    tails: dict[str, list[tuple[float, float]]] = {}
+    for shard, rows in new_rows.items():
+        by_location: dict[str, list[sqlite3.Row]] = {}
+        for row in rows:
+            by_location.setdefault(row["location"], []).append(row)
+        for location, location_rows in by_location.items():
+            buffer = state.recent.setdefault(location, RecentBuffer())
+            tail = _catch_up_location(shard, location, buffer, location_rows)
+            if tail:
+                tails[location] = tail
+                _trim_recent(buffer)
+        if rows:
+            state.watermarks[shard] = rows[-1]["id"]
+
+    return tails
+
+
+def load_aggregate_state(db: sqlite3.Connection) -> AggregateState | None:
+    watermark = db.execute(
+        "SELECT aggregates_computed_at FROM aggregate_watermark WHERE id = 1"
+    ).fetchone()
+    if watermark is None:
+        return None
+    watermarks = {
+        row["shard"]: row["last_count_id"]
+        for row in db.execute("SELECT shard, last_count_id FROM shard_watermarks")
+    }
+
+    aggregates = {
+        row["location"]: LocationAggregates(
+            baseline=row["baseline"], max_count=row["max_count"], time_averages={}
+        )
+        for row in db.execute(
+            "SELECT location, baseline, max_count FROM location_aggregates"
+        )
+    }
+    for row in db.execute(
+        "SELECT location, is_weekend, minute, average FROM location_time_averages"
+    ):
+        aggregates[row["location"]].time_averages[
+            (bool(row["is_weekend"]), row["minute"])
+        ] = row["average"]
+
+    recent: dict[str, RecentBuffer] = {}
+    for row in db.execute(
+        """
+        SELECT location, timestamp, smoothed_count
+        FROM location_recent
+        ORDER BY location, timestamp, rowid
+        """
+    ):
+        recent.setdefault(row["location"], RecentBuffer()).append(
+            datetime.fromisoformat(row["timestamp"]).timestamp(),
+            row["smoothed_count"],
+        )
+
+    return AggregateState(
+        watermarks=watermarks,
+        aggregates_computed_at=datetime.fromisoformat(
+            watermark["aggregates_computed_at"]
+        ),
+        aggregates=aggregates,
+        recent=recent,
+    )
+
+
+def _insert_recent(
+    db: sqlite3.Connection, location: str, readings: Iterable[tuple[float, float]]
+) -> None:
+    db.executemany(
+        "INSERT INTO location_recent (location, timestamp, smoothed_count) VALUES (?, ?, ?)",
+        [
+            (location, _format_timestamp(timestamp), count)
+            for timestamp, count in readings
+        ],
+    )
+
+
+def _begin_as_lease_holder(db: sqlite3.Connection) -> None:
+    # Snapshot writes only go through while this worker still holds the lease; the
+    # write lock keeps another worker from taking it over until they commit
+    db.execute("BEGIN IMMEDIATE")
+    if (
+        db.execute(
+            """
+            SELECT 1 FROM snapshot_lease
+            WHERE id = 1 AND holder = ? AND expires_at >= ?
+            """,
+            (WORKER_ID, time()),
+        ).fetchone()
+        is None
+    ):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Snapshot lease lost")
+
+
+def _save_watermark(db: sqlite3.Connection, state: AggregateState) -> None:
+    db.execute(
+        """
+        INSERT INTO aggregate_watermark (id, aggregates_computed_at)
+        VALUES (1, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            aggregates_computed_at = excluded.aggregates_computed_at
+        """,
+        (state.aggregates_computed_at.isoformat(),),
+    )
+    db.executemany(
+        """
+        INSERT INTO shard_watermarks (shard, last_count_id)
+        VALUES (?, ?)
+        ON CONFLICT(shard) DO UPDATE SET last_count_id = excluded.last_count_id
+        """,
+        list(state.watermarks.items()),
+    )
+
+
+def build_typical_profile(location: str, agg: LocationAggregates) -> TypicalProfile:
+    series: dict[bool, list[TypicalPoint]] = {False: [], True: []}
+    for (is_weekend, minute), average in sorted(agg.time_averages.items()):
+        series[is_weekend].append(
+            TypicalPoint(
+                minute=minute,
+                busyness_percentage=_calculate_busyness(
+                    average, agg.baseline, agg.max_count
+                ),
+            )
+        )
+    profile = TypicalProfile(
+        location=location,
+        version="",
+        bucket_minutes=TIME_BUCKET_SIZE,
+        weekday=series[False],
+        weekend=series[True],
+    )
+    # Hashed without the version itself, so an unchanged profile keeps its ETag
+    # across hourly passes
+    version = hashlib.sha256(profile.model_dump_json().encode()).hexdigest()[:16]
+    return profile.model_copy(update={"version": version})
+
+
+def save_aggregate_state(db: sqlite3.Connection, state: AggregateState) -> None:
+    _begin_as_lease_holder(db)
+    db.execute("DELETE FROM location_aggregates")
+    db.execute("DELETE FROM location_time_averages")
+    db.execute("DELETE FROM typical_profiles")
+    db.execute("DELETE FROM location_recent")
+    db.executemany(
+        "INSERT INTO location_aggregates (location, baseline, max_count) VALUES (?, ?, ?)",
+        [
+            (location, agg.baseline, agg.max_count)
+            for location, agg in state.aggregates.items()
+        ],
+    )
+    db.executemany(
+        """
+        INSERT INTO location_time_averages (location, is_weekend, minute, average)
+        VALUES (?, ?, ?, ?)
+        """,
+        [
+            (location, is_weekend, minute, average)
+            for location, agg in state.aggregates.items()
+            for (is_weekend, minute), average in agg.time_averages.items()
+        ],
+    )
+    # Profiles are rebuilt here only, since only a full pass changes aggregates
+    profiles = [
+        build_typical_profile(location, agg)
+        for location, agg in state.aggregates.items()
+    ]
+    db.executemany(
+        "INSERT INTO typical_profiles (location, version, payload) VALUES (?, ?, ?)",
+        [
+            (profile.location, profile.version, profile.model_dump_json())
+            for profile in profiles
+        ],
+    )
+    for location, buffer in state.recent.items():
+        _insert_recent(db, location, buffer)
+    _save_watermark(db, state)
+    db.commit()
+
+
+def save_caught_up_state(
+    db: sqlite3.Connection,
+    state: AggregateState,
+    tails: dict[str, list[tuple[float, float]]],
+) -> None:
+    _begin_as_lease_holder(db)
+    for location, tail in tails.items():
+        buffer = state.recent[location]
+        db.execute(
+            """
+            DELETE FROM location_recent
+            WHERE location = ? AND (timestamp < ? OR timestamp >= ?)
+            """,
+            (
+                location,
+                _format_timestamp(buffer.first_timestamp()),
+                _format_timestamp(tail[0][0]),
+            ),
+        )
+        # Rows trimmed away in the same pass they arrived in were never stored
+        _insert_recent(db, location, tail[-len(buffer) :])
+    _save_watermark(db, state)
+    db.commit()
+
+
+def _calculate_busyness(
+    count: float | None,
+    baseline: float | None,
+    max_count: float | None,
+) -> float | None:
+    if count is None or baseline is None or max_count is None or max_count <= 0:
+        return None
+    busyness = ((count - baseline) / max_count) * 100
+    return max(0.0, min(100.0, busyness))
+
+
+def _build_location_status(state: AggregateState) -> list[LocationStatus]:
+    now = datetime.now(TIMEZONE)
+    midnight_today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    results: list[LocationStatus] = []
+    for location, buffer in sorted(state.recent.items()):
+        agg = state.aggregates.get(location)
+        if not agg or not len(buffer):
+            continue
+
+        latest_timestamp, latest_count = buffer.latest()
+        latest_time = datetime.fromtimestamp(latest_timestamp, TIMEZONE)
+        past_count = buffer.count_back(TREND_LOOKBACK_ROWS)
+        busyness = _calculate_busyness(latest_count, agg.baseline, agg.max_count)
+
+        is_weekend = latest_time.weekday() >= 5
+        minutes = (
+            latest_time.hour * 60
+            + (latest_time.minute // TIME_BUCKET_SIZE) * TIME_BUCKET_SIZE
+        )
+        typical = agg.time_averages.get((is_weekend, minutes))
+        vs_typical = (
+            ((latest_count - typical) / typical) * 100
+            if typical and typical > 0
+            else None
+        )
+
+        trend: Literal["Increasing", "Steady", "Decreasing"] | None = None
+        if (
+            busyness is not None
             and busyness >= TREND_MIN_BUSYNESS
             and past_count
             and past_count > 0
         ):
-            change = (latest.count - past_count) / past_count
+            change = (latest_count - past_count) / past_count
             if change > TREND_THRESHOLD:
                 trend = "Increasing"
             elif change < -TREND_THRESHOLD:
@@ -305,19 +1818,18 @@ def _build_location_status(db: sqlite3.Connection) -> list[LocationStatus]:
         results.append(
             LocationStatus(
                 location=location,
-                timestamp=latest.timestamp,
+                timestamp=latest_time,
                 busyness_percentage=busyness,
                 vs_typical_percentage=vs_typical,
                 trend=trend,
                 today_data=[
                     DataPoint(
-                        timestamp=c.timestamp,
+                        timestamp=datetime.fromtimestamp(timestamp, TIMEZONE),
                         busyness_percentage=_calculate_busyness(
-                            c.count, agg.baseline, agg.max_count
+                            count, agg.baseline, agg.max_count
                         ),
                     )
-                    for c in location_counts
-                    if c.timestamp >= midnight_today
+                    for timestamp, count in buffer.since(midnight_today.timestamp())
                 ],
             )
         )
@@ -408,104 +1920,1281 @@ def render_admin_shell(title: str, content: str) -> HTMLResponse:
     return html_page(title, body)
 
 
-def fetch_admin_dashboard_data() -> tuple[list[sqlite3.Row], list[sqlite3.Row]]:
+def listing_url(listing: AdminListing, **changes: object) -> str:
+    query = urlencode(
+        listing.model_copy(update=changes).model_dump(exclude_defaults=True)
+    )
+    return f"{PUBLIC_API_PREFIX}/admin" + (f"?{query}" if query else "")
+
+
+def render_sort_header(
+    listing: AdminListing, prefix: Literal["node", "artifact"], sort: str, label: str
+) -> str:
+    # Clicking the active column flips its order; other columns start ascending
+    current_sort = getattr(listing, f"{prefix}_sort")
+    current_order = getattr(listing, f"{prefix}_order")
+    order = "desc" if current_sort == sort and current_order == "asc" else "asc"
+    arrow = {"asc": " ▲", "desc": " ▼"}[current_order] if current_sort == sort else ""
+    url = listing_url(
+        listing,
+        **{f"{prefix}_sort": sort, f"{prefix}_order": order, f"{prefix}_page": 1},
+    )
+    return f"<th><a href='{escape(url)}'>{escape(label)}{arrow}</a></th>"
+
+
+def render_pager(
+    listing: AdminListing, prefix: Literal["node", "artifact"], total: int
+) -> str:
+    page = getattr(listing, f"{prefix}_page")
+    first = (page - 1) * ADMIN_PAGE_SIZE
+    links = [
+        f"<span class='muted'>{min(first + 1, total)}-{min(first + ADMIN_PAGE_SIZE, total)} "
+        f"of {total}</span>"
+    ]
+    if page > 1:
+        url = listing_url(listing, **{f"{prefix}_page": page - 1})
+        links.append(f"<a href='{escape(url)}'>Previous</a>")
+    if first + ADMIN_PAGE_SIZE < total:
+        url = listing_url(listing, **{f"{prefix}_page": page + 1})
+        links.append(f"<a href='{escape(url)}'>Next</a>")
+    return f"<p>{' · '.join(links)}</p>"
+
+
+def render_listing_inputs(
+    listing: AdminListing, prefix: Literal["node", "artifact"]
+) -> str:
+    # A filter form resets its own listing but keeps the other one as it was
+    own_fields = {"node": {"node_q", "version", "stale"}, "artifact": {"artifact_q"}}
+    return "".join(
+        f"<input type='hidden' name='{name}' value='{escape(str(value))}'>"
+        for name, value in listing.model_dump(exclude_defaults=True).items()
+        if name not in own_fields[prefix] and name != f"{prefix}_page"
+    )
+
+
+# Matches nodes that haven't fetched a manifest in STALE_NODE_POLLS poll intervals;
+# takes the current time and STALE_NODE_POLLS as parameters
+STALE_NODE_SQL = """
+    (n.last_seen_at IS NULL
+     OR julianday(n.last_seen_at) < julianday(?) - n.poll_interval_s * ? / 86400.0)
+"""
+
+NODE_SORT_COLUMNS: dict[NodeSort, str] = {
+    "node": "n.node",
+    "version": "n.current_version",
+    "last_seen": "n.last_seen_at",
+}
+ARTIFACT_SORT_COLUMNS: dict[ArtifactSort, str] = {
+    "uploaded": "uploaded_at",
+    "version": "version",
+}
+
+
+def _like_pattern(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def fetch_admin_dashboard_data(listing: AdminListing) -> AdminDashboardData:
+    now = utc_now()
     db = get_control_db_connection()
-    nodes = db.execute(
+    try:
+        conditions: list[str] = []
+        params: list[object] = []
+        if listing.node_q:
+            conditions.append("n.node LIKE ? ESCAPE '\\'")
+            params.append(_like_pattern(listing.node_q))
+        if listing.version == UNKNOWN_VERSION:
+            conditions.append("n.current_version IS NULL")
+        elif listing.version:
+            conditions.append("n.current_version = ?")
+            params.append(listing.version)
+        if listing.stale:
+            conditions.append(STALE_NODE_SQL)
+            params.extend((now, STALE_NODE_POLLS))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        node_total = db.execute(
+            f"SELECT COUNT(*) FROM nodes n {where}", params
+        ).fetchone()[0]
+        nodes = db.execute(
+            f"""
+            SELECT n.node, n.poll_interval_s, n.current_version, n.last_seen_at,
+                   fa.version AS target_version, {STALE_NODE_SQL} AS is_stale
+            FROM nodes n
+            LEFT JOIN node_desired_state ds ON ds.node = n.node
+            LEFT JOIN firmware_artifacts fa ON fa.id = ds.target_firmware_id
+            {where}
+            ORDER BY {NODE_SORT_COLUMNS[listing.node_sort]} {listing.node_order},
+                     n.node {listing.node_order}
+            LIMIT ? OFFSET ?
+            """,
+            [
+                now,
+                STALE_NODE_POLLS,
+                *params,
+                ADMIN_PAGE_SIZE,
+                (listing.node_page - 1) * ADMIN_PAGE_SIZE,
+            ],
+        ).fetchall()
+
+        version_counts = db.execute(
+            f"""
+            SELECT n.current_version AS version, COUNT(*) AS nodes,
+                   SUM({STALE_NODE_SQL}) AS stale
+            FROM nodes n
+            GROUP BY n.current_version
+            ORDER BY nodes DESC, n.current_version
+            """,
+            (now, STALE_NODE_POLLS),
+        ).fetchall()
+
+        artifact_where = ""
+        artifact_params: list[object] = []
+        if listing.artifact_q:
+            artifact_where = (
+                "WHERE version LIKE ? ESCAPE '\\' OR filename LIKE ? ESCAPE '\\'"
+            )
+            artifact_params = [_like_pattern(listing.artifact_q)] * 2
+        artifact_total = db.execute(
+            f"SELECT COUNT(*) FROM firmware_artifacts {artifact_where}",
+            artifact_params,
+        ).fetchone()[0]
+        artifacts = db.execute(
+            f"""
+            SELECT id, filename, version, size_bytes, uploaded_at
+            FROM firmware_artifacts
+            {artifact_where}
+            ORDER BY {ARTIFACT_SORT_COLUMNS[listing.artifact_sort]}
+                         {listing.artifact_order},
+                     id {listing.artifact_order}
+            LIMIT ? OFFSET ?
+            """,
+            [
+                *artifact_params,
+                ADMIN_PAGE_SIZE,
+                (listing.artifact_page - 1) * ADMIN_PAGE_SIZE,
+            ],
+        ).fetchall()
+        rollouts = db.execute(
+            """
+            SELECT r.id, r.node_group, r.status, r.current_wave, r.wave_size,
+                   r.max_concurrent, r.pause_reason, r.created_at, fa.version,
+                   COUNT(rn.node) AS nodes,
+                   COALESCE(MAX(rn.wave) + 1, 0) AS waves,
+                   COALESCE(SUM(rn.state = 'done'), 0) AS done,
+                   COALESCE(SUM(rn.state = 'downloading'), 0) AS downloading,
+                   COALESCE(SUM(rn.state = 'failed'), 0) AS failed
+            FROM firmware_rollouts r
+            JOIN firmware_artifacts fa ON fa.id = r.firmware_id
+            LEFT JOIN rollout_nodes rn ON rn.rollout_id = r.id
+            GROUP BY r.id
+            ORDER BY r.id DESC
+            LIMIT ?
+            """,
+            (ADMIN_ROLLOUT_LIMIT,),
+        ).fetchall()
+        firmware_choices = db.execute(
+            """
+            SELECT id, version, filename
+            FROM firmware_artifacts
+            ORDER BY uploaded_at DESC, id DESC
+            LIMIT ?
+            """,
+            (ADMIN_FIRMWARE_CHOICES,),
+        ).fetchall()
+    finally:
+        db.close()
+
+    return AdminDashboardData(
+        nodes=cast(list[sqlite3.Row], nodes),
+        node_total=node_total,
+        artifacts=cast(list[sqlite3.Row], artifacts),
+        artifact_total=artifact_total,
+        version_counts=cast(list[sqlite3.Row], version_counts),
+        rollouts=cast(list[sqlite3.Row], rollouts),
+        firmware_choices=cast(list[sqlite3.Row], firmware_choices),
+    )
+
+
+def fetch_node_detail(node: str) -> tuple[sqlite3.Row, list[sqlite3.Row]]:
+    db = get_control_db_connection()
+    row = db.execute(
         """
         SELECT n.node, n.token, n.poll_interval_s, n.current_version, n.last_seen_at,
-               n.last_manifest_fetch_at, n.last_ip,
-               ds.restart_nonce, fa.version AS target_version
+               n.last_manifest_fetch_at, n.last_ip, n.node_group, n.locations,
+               ds.restart_nonce, fa.id AS target_firmware_id, fa.version AS target_version
         FROM nodes n
         LEFT JOIN node_desired_state ds ON ds.node = n.node
         LEFT JOIN firmware_artifacts fa ON fa.id = ds.target_firmware_id
-        ORDER BY n.node
-        """
-    ).fetchall()
+        WHERE n.node = ?
+        """,
+        (node,),
+    ).fetchone()
+    if row is None:
+        db.close()
+        raise HTTPException(status_code=404, detail="Unknown node")
     artifacts = db.execute(
         """
-        SELECT id, filename, original_filename, version, sha256, size_bytes, uploaded_at
+        SELECT id, version, filename, sha256, uploaded_at
         FROM firmware_artifacts
         ORDER BY uploaded_at DESC, id DESC
-        """
+        LIMIT ?
+        """,
+        (ADMIN_FIRMWARE_CHOICES,),
     ).fetchall()
+    # The current target stays selectable even once newer uploads push it out
+    target_id = row["target_firmware_id"]
+    if target_id is not None and all(a["id"] != target_id for a in artifacts):
+        artifacts.extend(
+            db.execute(
+                """
+                SELECT id, version, filename, sha256, uploaded_at
+                FROM firmware_artifacts
+                WHERE id = ?
+                """,
+                (target_id,),
+            ).fetchall()
+        )
     db.close()
-    return cast(list[sqlite3.Row], nodes), cast(list[sqlite3.Row], artifacts)
+    return row, cast(list[sqlite3.Row], artifacts)
 
 
-def fetch_node_detail(node: str) -> tuple[sqlite3.Row, list[sqlite3.Row]]:
+def parse_node_locations(value: str) -> list[str]:
+    # Stored and entered as a comma-separated list
+    return sorted(
+        {location.strip() for location in value.split(",") if location.strip()}
+    )
+
+
+def execute_control_write(query: str, params: tuple[object, ...]) -> None:
+    db = get_control_db_connection()
+    db.execute(query, params)
+    db.commit()
+    db.close()
+
+
+def update_node_seen(node: str, version: str | None, client_ip: str | None) -> None:
+    db = get_control_db_connection()
+    db.execute(
+        """
+        UPDATE nodes
+        SET current_version = COALESCE(?, current_version),
+            last_seen_at = ?,
+            last_manifest_fetch_at = ?,
+            last_ip = ?,
+            updated_at = ?
+        WHERE node = ?
+        """,
+        (version or None, utc_now(), utc_now(), client_ip, utc_now(), node),
+    )
+    db.commit()
+    db.close()
+
+
+def get_node_state(node: str) -> sqlite3.Row | None:
     db = get_control_db_connection()
     row = db.execute(
         """
-        SELECT n.node, n.token, n.poll_interval_s, n.current_version, n.last_seen_at,
-               n.last_manifest_fetch_at, n.last_ip,
-               ds.restart_nonce, fa.id AS target_firmware_id, fa.version AS target_version
+        SELECT n.node, n.token, n.poll_interval_s, n.last_manifest_fetch_at,
+               n.locations, ds.restart_nonce, ds.updated_at AS desired_updated_at,
+               fa.version, fa.filename, fa.sha256, rn.rollout_id,
+               EXISTS (
+                   SELECT 1
+                   FROM rollout_nodes rp
+                   JOIN firmware_rollouts r ON r.id = rp.rollout_id
+                   WHERE rp.node = n.node AND rp.state = 'pending'
+                     AND r.status = 'active' AND rp.wave = r.current_wave
+               ) AS rollout_pending,
+               (SELECT COUNT(*) FROM nodes) AS fleet_size
         FROM nodes n
         LEFT JOIN node_desired_state ds ON ds.node = n.node
         LEFT JOIN firmware_artifacts fa ON fa.id = ds.target_firmware_id
+        LEFT JOIN rollout_nodes rn
+            ON rn.node = n.node AND rn.state = 'downloading'
+            AND rn.rollout_id IN (
+                SELECT id FROM firmware_rollouts WHERE status IN ('active', 'paused')
+            )
         WHERE n.node = ?
         """,
         (node,),
     ).fetchone()
-    if row is None:
+    db.close()
+    return row
+
+
+def next_poll_delay(state: sqlite3.Row, reported_version: str | None) -> int:
+    # Nodes with an OTA outstanding, a restart requested since their last poll, or a
+    # place in the current wave of a rollout poll at the firmware minimum. Others
+    # poll at their base interval, doubled once their desired state has been quiet
+    # for a day, and stretched so the whole fleet stays under MANIFEST_TARGET_RPS
+    # and while the control-plane pool is backed up
+    pending = (
+        (state["version"] is not None and state["version"] != reported_version)
+        or bool(state["rollout_pending"])
+        or (
+            state["restart_nonce"] is not None
+            and state["restart_nonce"] >= (state["last_manifest_fetch_at"] or "")
+        )
+    )
+    if pending:
+        delay = float(POLL_URGENT_S)
+    else:
+        delay = float(state["poll_interval_s"])
+        idle_since = datetime.now(UTC) - timedelta(seconds=POLL_IDLE_AFTER_S)
+        if (
+            state["desired_updated_at"] is None
+            or datetime.fromisoformat(state["desired_updated_at"]) < idle_since
+        ):
+            delay *= POLL_IDLE_MULTIPLIER
+        pool = control_db.stats()
+        delay *= max(
+            1.0,
+            state["fleet_size"] / (MANIFEST_TARGET_RPS * delay),
+            (pool["active"] + pool["queued"]) / pool["max_workers"],
+        )
+
+    # Jitter is fixed per node, so nodes that rebooted together drift apart instead
+    # of polling in lockstep
+    delay = min(delay, POLL_MAX_S / (1 + POLL_JITTER_FRACTION))
+    digest = hashlib.sha256(state["node"].encode()).digest()
+    jitter = int.from_bytes(digest[:8]) / 2**64
+    return round(delay * (1 + POLL_JITTER_FRACTION * jitter))
+
+
+def _set_node_target(
+    db: sqlite3.Connection, node: str, firmware_id: int | None, now: str
+) -> None:
+    db.execute(
+        """
+        INSERT INTO node_desired_state (node, target_firmware_id, updated_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(node) DO UPDATE SET
+            target_firmware_id = excluded.target_firmware_id,
+            updated_at = excluded.updated_at
+        """,
+        (node, firmware_id, now),
+    )
+
+
+def _fail_timed_out_nodes(
+    db: sqlite3.Connection, rollout: sqlite3.Row, now: str
+) -> bool:
+    cutoff = (
+        datetime.fromisoformat(now) - timedelta(seconds=ROLLOUT_NODE_TIMEOUT_S)
+    ).isoformat(timespec="seconds")
+    failed = db.execute(
+        """
+        SELECT rn.node, rn.previous_firmware_id, ds.target_firmware_id
+        FROM rollout_nodes rn
+        LEFT JOIN node_desired_state ds ON ds.node = rn.node
+        WHERE rn.rollout_id = ? AND rn.state = 'downloading' AND rn.released_at < ?
+        """,
+        (rollout["id"], cutoff),
+    ).fetchall()
+    if not failed:
+        return False
+
+    for row in failed:
+        db.execute(
+            """
+            UPDATE rollout_nodes SET state = 'failed', finished_at = ?
+            WHERE rollout_id = ? AND node = ?
+            """,
+            (now, rollout["id"], row["node"]),
+        )
+        # Put the node back on its old target so it stops retrying the update,
+        # unless an admin has retargeted it since
+        if row["target_firmware_id"] == rollout["firmware_id"]:
+            _set_node_target(db, row["node"], row["previous_firmware_id"], now)
+    reason = (
+        f"{', '.join(row['node'] for row in failed)} did not report "
+        f"{rollout['version']} within {ROLLOUT_NODE_TIMEOUT_S}s"
+    )
+    db.execute(
+        """
+        UPDATE firmware_rollouts SET status = 'paused', pause_reason = ?, updated_at = ?
+        WHERE id = ?
+        """,
+        (reason, now, rollout["id"]),
+    )
+    logger.warning(f"Rollout {rollout['id']} paused: {reason}")
+    return True
+
+
+def advance_rollout(db: sqlite3.Connection, rollout_id: int) -> None:
+    # Releases pending nodes of the current wave up to max_concurrent downloads at a
+    # time, and moves to the next wave once every node of this one reports the new
+    # version. A released node gets the rollout's firmware as its target, so the
+    # manifest reads it from node_desired_state like any other target
+    rollout = db.execute(
+        """
+        SELECT r.*, fa.version
+        FROM firmware_rollouts r
+        JOIN firmware_artifacts fa ON fa.id = r.firmware_id
+        WHERE r.id = ?
+        """,
+        (rollout_id,),
+    ).fetchone()
+    if rollout is None or rollout["status"] != "active":
+        return
+    now = utc_now()
+    if _fail_timed_out_nodes(db, rollout, now):
+        return
+
+    wave = rollout["current_wave"]
+    while True:
+        downloading = db.execute(
+            """
+            SELECT COUNT(*) FROM rollout_nodes
+            WHERE rollout_id = ? AND state = 'downloading'
+            """,
+            (rollout_id,),
+        ).fetchone()[0]
+        if downloading >= rollout["max_concurrent"]:
+            return
+        candidates = db.execute(
+            """
+            SELECT rn.node, n.current_version, ds.target_firmware_id
+            FROM rollout_nodes rn
+            JOIN nodes n ON n.node = rn.node
+            LEFT JOIN node_desired_state ds ON ds.node = rn.node
+            WHERE rn.rollout_id = ? AND rn.wave = ? AND rn.state = 'pending'
+            ORDER BY rn.node
+            LIMIT ?
+            """,
+            (rollout_id, wave, rollout["max_concurrent"] - downloading),
+        ).fetchall()
+
+        if not candidates:
+            if downloading:
+                return
+            next_wave = db.execute(
+                """
+                SELECT MIN(wave) FROM rollout_nodes
+                WHERE rollout_id = ? AND state = 'pending'
+                """,
+                (rollout_id,),
+            ).fetchone()[0]
+            if next_wave is None:
+                db.execute(
+                    """
+                    UPDATE firmware_rollouts SET status = 'completed', updated_at = ?
+                    WHERE id = ?
+                    """,
+                    (now, rollout_id),
+                )
+                logger.info(f"Rollout {rollout_id} of {rollout['version']} completed")
+                return
+            wave = next_wave
+            db.execute(
+                """
+                UPDATE firmware_rollouts SET current_wave = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (wave, now, rollout_id),
+            )
+            logger.info(f"Rollout {rollout_id} advanced to wave {wave + 1}")
+            continue
+
+        for row in candidates:
+            if row["current_version"] == rollout["version"]:
+                db.execute(
+                    """
+                    UPDATE rollout_nodes SET state = 'done', finished_at = ?
+                    WHERE rollout_id = ? AND node = ?
+                    """,
+                    (now, rollout_id, row["node"]),
+                )
+                continue
+            db.execute(
+                """
+                UPDATE rollout_nodes
+                SET state = 'downloading', released_at = ?, previous_firmware_id = ?
+                WHERE rollout_id = ? AND node = ?
+                """,
+                (now, row["target_firmware_id"], rollout_id, row["node"]),
+            )
+            _set_node_target(db, row["node"], rollout["firmware_id"], now)
+
+
+def run_rollout_transaction[**P](
+    fn: Callable[Concatenate[sqlite3.Connection, P], None],
+    *args: P.args,
+    **kwargs: P.kwargs,
+) -> None:
+    db = get_control_db_connection()
+    try:
+        # Workers advance rollouts concurrently; the write lock serializes them
+        db.execute("BEGIN IMMEDIATE")
+        fn(db, *args, **kwargs)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
         db.close()
-        raise HTTPException(status_code=404, detail="Unknown node")
-    artifacts = db.execute(
+
+
+def create_rollout(
+    db: sqlite3.Connection,
+    firmware_id: int,
+    node_group: str,
+    wave_size: int,
+    max_concurrent: int,
+) -> None:
+    if (
+        db.execute(
+            "SELECT 1 FROM firmware_artifacts WHERE id = ?", (firmware_id,)
+        ).fetchone()
+        is None
+    ):
+        raise HTTPException(status_code=404, detail="Unknown firmware")
+    # Nodes still owned by an unfinished rollout are left out
+    nodes = db.execute(
         """
-        SELECT id, version, filename, sha256, uploaded_at
-        FROM firmware_artifacts
-        ORDER BY uploaded_at DESC, id DESC
+        SELECT n.node
+        FROM nodes n
+        WHERE (? = '' OR n.node_group = ?)
+          AND NOT EXISTS (
+              SELECT 1
+              FROM rollout_nodes rn
+              JOIN firmware_rollouts r ON r.id = rn.rollout_id
+              WHERE rn.node = n.node
+                AND r.status IN ('active', 'paused')
+                AND rn.state IN ('pending', 'downloading', 'failed')
+          )
+        ORDER BY n.node
+        """,
+        (node_group, node_group),
+    ).fetchall()
+    if not nodes:
+        raise HTTPException(status_code=400, detail="No nodes available to roll out to")
+
+    now = utc_now()
+    rollout_id = db.execute(
+        """
+        INSERT INTO firmware_rollouts
+            (firmware_id, node_group, wave_size, max_concurrent, status,
+             created_at, updated_at)
+        VALUES (?, ?, ?, ?, 'active', ?, ?)
+        """,
+        (firmware_id, node_group, wave_size, max_concurrent, now, now),
+    ).lastrowid
+    db.executemany(
+        """
+        INSERT INTO rollout_nodes (rollout_id, node, wave, state)
+        VALUES (?, ?, ?, 'pending')
+        """,
+        [
+            (rollout_id, row["node"], index // wave_size)
+            for index, row in enumerate(nodes)
+        ],
+    )
+    logger.info(
+        f"Rollout {rollout_id} created for {len(nodes)} nodes in waves of {wave_size}"
+    )
+    advance_rollout(db, cast(int, rollout_id))
+
+
+def set_rollout_status(
+    db: sqlite3.Connection,
+    rollout_id: int,
+    status: Literal["active", "paused", "cancelled"],
+) -> None:
+    rollout = db.execute(
+        "SELECT status, firmware_id FROM firmware_rollouts WHERE id = ?",
+        (rollout_id,),
+    ).fetchone()
+    if rollout is None or rollout["status"] not in ("active", "paused"):
+        return
+    now = utc_now()
+    if status == "cancelled":
+        # Released nodes go back to the target they had before the rollout, unless
+        # an admin has retargeted them since, so they don't finish its download
+        released = db.execute(
+            """
+            SELECT rn.node, rn.previous_firmware_id, ds.target_firmware_id
+            FROM rollout_nodes rn
+            LEFT JOIN node_desired_state ds ON ds.node = rn.node
+            WHERE rn.rollout_id = ? AND rn.state = 'downloading'
+            """,
+            (rollout_id,),
+        ).fetchall()
+        for row in released:
+            if row["target_firmware_id"] == rollout["firmware_id"]:
+                _set_node_target(db, row["node"], row["previous_firmware_id"], now)
+        db.execute(
+            """
+            UPDATE rollout_nodes SET state = 'cancelled', finished_at = ?
+            WHERE rollout_id = ? AND state IN ('pending', 'downloading')
+            """,
+            (now, rollout_id),
+        )
+        if released:
+            logger.info(
+                f"Rollout {rollout_id} cancelled; {len(released)} released nodes "
+                "put back on their old target"
+            )
+    if status == "active":
+        # Resuming retries the nodes that failed
+        db.execute(
+            """
+            UPDATE rollout_nodes SET state = 'pending', released_at = NULL, finished_at = NULL
+            WHERE rollout_id = ? AND state = 'failed'
+            """,
+            (rollout_id,),
+        )
+    db.execute(
+        """
+        UPDATE firmware_rollouts
+        SET status = ?, pause_reason = ?, updated_at = ?
+        WHERE id = ?
+        """,
+        (status, "Paused by admin" if status == "paused" else None, now, rollout_id),
+    )
+    advance_rollout(db, rollout_id)
+
+
+def complete_rollout_node(db: sqlite3.Connection, rollout_id: int, node: str) -> None:
+    db.execute(
+        """
+        UPDATE rollout_nodes SET state = 'done', finished_at = ?
+        WHERE rollout_id = ? AND node = ? AND state = 'downloading'
+        """,
+        (utc_now(), rollout_id, node),
+    )
+    advance_rollout(db, rollout_id)
+
+
+def supervise_rollouts(db: sqlite3.Connection) -> None:
+    for row in db.execute(
+        "SELECT id FROM firmware_rollouts WHERE status = 'active'"
+    ).fetchall():
+        advance_rollout(db, row["id"])
+
+
+def _split_unescaped(text: str, separator: str, maxsplit: int = 0) -> list[str]:
+    return re.split(rf"(?<!\\){re.escape(separator)}", text, maxsplit=maxsplit)
+
+
+def _unescape(text: str) -> str:
+    return re.sub(r"\\([ ,=])", r"\1", text)
+
+
+def _split_pairs(text: str) -> dict[str, str]:
+    pairs: dict[str, str] = {}
+    for item in _split_unescaped(text, ","):
+        key_value = _split_unescaped(item, "=", maxsplit=1)
+        if len(key_value) != 2:
+            raise ValueError(f"malformed key=value pair {item!r}")
+        pairs[_unescape(key_value[0])] = _unescape(key_value[1])
+    return pairs
+
+
+def _parse_count_line(line: str, precision: Precision) -> CountReading:
+    parts = _split_unescaped(line, " ")
+    if len(parts) != 3:
+        raise ValueError(
+            f"expected '{LINE_PROTOCOL_MEASUREMENT},location=<location> "
+            "count=<count>i <timestamp>'"
+        )
+    key, fields, timestamp = parts
+    measurement, _, tags = key.partition(",")
+    if _unescape(measurement) != LINE_PROTOCOL_MEASUREMENT:
+        raise ValueError(f"measurement must be {LINE_PROTOCOL_MEASUREMENT!r}")
+    location = _split_pairs(tags).get("location") if tags else None
+    if location is None:
+        raise ValueError("missing location tag")
+    field_values = _split_pairs(fields)
+    count = re.fullmatch(r"(\d+)[iu]?", field_values.get("count", ""))
+    if count is None:
+        raise ValueError("count field must be a non-negative integer")
+    seq = re.fullmatch(r"(\d+)[iu]?", field_values.get("seq", "0"))
+    if seq is None:
+        raise ValueError("seq field must be a non-negative integer")
+    seconds = int(timestamp) / LINE_PROTOCOL_PRECISIONS[precision]
+    if not (
+        datetime(MIN_INGEST_YEAR, 1, 1, tzinfo=UTC).timestamp()
+        <= seconds
+        < datetime(MAX_INGEST_YEAR + 1, 1, 1, tzinfo=UTC).timestamp()
+    ):
+        raise ValueError("timestamp is out of range")
+    return CountReading(
+        location=location,
+        timestamp=datetime.fromtimestamp(seconds, UTC),
+        count=int(count[1]),
+        seq=int(seq[1]) if "seq" in field_values else None,
+    )
+
+
+def parse_line_protocol(body: str, precision: Precision) -> list[CountReading]:
+    readings: list[CountReading] = []
+    errors: list[dict[str, object]] = []
+    for number, line in enumerate(body.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            readings.append(_parse_count_line(line, precision))
+        except ValidationError as e:
+            errors.append({"line": number, "msg": e.errors()[0]["msg"]})
+        except ValueError as e:
+            errors.append({"line": number, "msg": str(e)})
+    if errors:
+        raise HTTPException(status_code=422, detail=errors[:MAX_INGEST_ERRORS])
+    return readings
+
+
+def prepare_count_batch(
+    readings: list[CountReading],
+) -> tuple[dict[str, list[tuple[str, int, str, int, int | None]]], int]:
+    # Counts are stored at second resolution in local time with the epoch second as
+    # device_ts, the same as the ingester writes them; the last reading wins when a
+    # batch repeats one
+    latest_allowed = time() + MAX_INGEST_CLOCK_SKEW_S
+    earliest_allowed = time() - MAX_INGEST_AGE_DAYS * 86400
+    unique: dict[tuple[str, int], tuple[str, int, int | None]] = {}
+    errors: list[dict[str, object]] = []
+    for index, reading in enumerate(readings):
+        if not MIN_INGEST_YEAR <= reading.timestamp.year <= MAX_INGEST_YEAR:
+            errors.append({"reading": index, "msg": "timestamp is out of range"})
+            continue
+        timestamp = (
+            reading.timestamp.replace(tzinfo=TIMEZONE)
+            if reading.timestamp.tzinfo is None
+            else reading.timestamp
+        ).astimezone(TIMEZONE)
+        if timestamp.timestamp() > latest_allowed:
+            errors.append({"reading": index, "msg": "timestamp is in the future"})
+            continue
+        if timestamp.timestamp() < earliest_allowed:
+            errors.append(
+                {
+                    "reading": index,
+                    "msg": f"timestamp is more than {MAX_INGEST_AGE_DAYS} days old",
+                }
+            )
+            continue
+        unique[(reading.location, int(timestamp.timestamp()))] = (
+            timestamp.isoformat(sep=" ", timespec="seconds"),
+            reading.count,
+            reading.seq,
+        )
+    if errors:
+        raise HTTPException(status_code=422, detail=errors[:MAX_INGEST_ERRORS])
+
+    by_shard: dict[str, list[tuple[str, int, str, int, int | None]]] = {}
+    for (location, device_ts), (stored, count, seq) in sorted(unique.items()):
+        by_shard.setdefault(shard_for_location(location), []).append(
+            (location, count, stored, device_ts, seq)
+        )
+    return by_shard, len(readings) - len(unique)
+
+
+def write_count_batch(
+    by_shard: dict[str, list[tuple[str, int, str, int, int | None]]],
+) -> int:
+    # Readings already stored hit the (location, device_ts) unique index and are
+    # skipped, so retrying an upload is a no-op
+    inserted = 0
+    for shard, rows in by_shard.items():
+        db = get_db_connection(shard)
+        try:
+            changes_before = db.total_changes
+            db.executemany(
+                """
+                INSERT INTO counts (location, count, timestamp, device_ts, seq)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
+                """,
+                rows,
+            )
+            db.commit()
+            inserted += db.total_changes - changes_before
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    return inserted
+
+
+def ingest_count_upload(
+    node: str,
+    allowed_locations: list[str],
+    body: bytes,
+    line_protocol: bool,
+    precision: Precision,
+) -> IngestResult:
+    if line_protocol:
+        try:
+            text = body.decode()
+        except UnicodeDecodeError:
+            raise HTTPException(
+                status_code=400, detail="Body is not valid UTF-8"
+            ) from None
+        readings = parse_line_protocol(text, precision)
+    else:
+        try:
+            readings = CountBatch.model_validate_json(body).readings
+        except ValidationError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=e.errors(include_url=False, include_input=False)[
+                    :MAX_INGEST_ERRORS
+                ],
+            ) from None
+    if len(readings) > MAX_INGEST_READINGS:
+        raise HTTPException(
+            status_code=413, detail=f"More than {MAX_INGEST_READINGS} readings"
+        )
+    # A node's token only covers the locations it is assigned in the admin UI
+    foreign = sorted(
+        {reading.location for reading in readings} - set(allowed_locations)
+    )
+    if foreign:
+        raise HTTPException(
+            status_code=403,
+            detail=f"Node {node} may not upload counts for {', '.join(foreign)}",
+        )
+
+    by_shard, duplicates = prepare_count_batch(readings)
+    inserted = write_count_batch(by_shard)
+    existing = len(readings) - duplicates - inserted
+    logger.info(
+        f"Node {node} uploaded {len(readings)} counts: {inserted} inserted, "
+        f"{duplicates} duplicates, {existing} already stored"
+    )
+    return IngestResult(
+        received=len(readings),
+        inserted=inserted,
+        duplicates=duplicates,
+        existing=existing,
+    )
+
+
+def acquire_snapshot_lease() -> bool:
+    # Take the lease if it is free or expired, or renew it if we already hold it
+    now = time()
+    db = get_snapshot_db_connection()
+    cursor = db.execute(
         """
-    ).fetchall()
+        INSERT INTO snapshot_lease (id, holder, expires_at)
+        VALUES (1, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            holder = excluded.holder,
+            expires_at = excluded.expires_at
+        WHERE snapshot_lease.holder = excluded.holder
+           OR snapshot_lease.expires_at < ?
+        """,
+        (WORKER_ID, now + SNAPSHOT_LEASE_SECONDS, now),
+    )
+    db.commit()
     db.close()
-    return row, cast(list[sqlite3.Row], artifacts)
+    return cursor.rowcount == 1
 
 
-def update_node_seen(node: str, version: str | None, client_ip: str | None) -> None:
-    db = get_control_db_connection()
+def _renew_snapshot_lease(stop: threading.Event) -> None:
+    # A full pass can outlast the lease, so it is renewed while a refresh runs
+    while not stop.wait(SNAPSHOT_LEASE_SECONDS / 3):
+        try:
+            if not acquire_snapshot_lease():
+                logger.warning("Snapshot lease lost during refresh")
+                return
+        except sqlite3.Error as e:
+            logger.warning(f"Renewing snapshot lease failed: {e}")
+
+
+def release_snapshot_lease() -> None:
+    db = get_snapshot_db_connection()
+    db.execute("DELETE FROM snapshot_lease WHERE holder = ?", (WORKER_ID,))
+    db.commit()
+    db.close()
+
+
+def read_freshness_probe() -> str | None:
+    db = get_db_connection()
+    try:
+        row = db.execute(
+            "SELECT timestamp FROM freshness_probe WHERE id = 1"
+        ).fetchone()
+    finally:
+        db.close()
+    return None if row is None else row["timestamp"]
+
+
+def publish_snapshot(
+    statuses: list[LocationStatus], probe_timestamp: str | None
+) -> int:
+    db = get_snapshot_db_connection()
+    try:
+        _begin_as_lease_holder(db)
+    except HTTPException:
+        db.close()
+        raise
     db.execute(
         """
-        UPDATE nodes
-        SET current_version = COALESCE(?, current_version),
-            last_seen_at = ?,
-            last_manifest_fetch_at = ?,
-            last_ip = ?,
-            updated_at = ?
-        WHERE node = ?
+        INSERT INTO status_snapshot (id, generation, computed_at, payload)
+        VALUES (1, 1, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            generation = status_snapshot.generation + 1,
+            computed_at = excluded.computed_at,
+            payload = excluded.payload
         """,
-        (version or None, utc_now(), utc_now(), client_ip, utc_now(), node),
+        (utc_now(), status_list_adapter.dump_json(statuses)),
+    )
+    generation = cast(
+        int,
+        db.execute("SELECT generation FROM status_snapshot WHERE id = 1").fetchone()[0],
+    )
+    db.execute(
+        """
+        INSERT INTO snapshot_freshness_probe (id, generation, probe_timestamp)
+        VALUES (1, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            generation = excluded.generation,
+            probe_timestamp = excluded.probe_timestamp
+        """,
+        (generation, probe_timestamp),
     )
     db.commit()
     db.close()
+    return generation
 
 
-def get_node_state(node: str) -> sqlite3.Row | None:
-    db = get_control_db_connection()
-    row = db.execute(
-        """
-        SELECT n.node, n.token, n.poll_interval_s, ds.restart_nonce,
-               fa.version, fa.filename, fa.sha256
-        FROM nodes n
-        LEFT JOIN node_desired_state ds ON ds.node = n.node
-        LEFT JOIN firmware_artifacts fa ON fa.id = ds.target_firmware_id
-        WHERE n.node = ?
-        """,
-        (node,),
+# This worker's aggregate state, kept in memory across refreshes while it holds
+# the lease so the hot tier isn't reloaded from the snapshot db every time
+_aggregate_state: AggregateState | None = None
+
+
+def _is_persisted_state(db: sqlite3.Connection, state: AggregateState) -> bool:
+    # Another worker may have refreshed the persisted state while this one didn't
+    # hold the lease, in which case memory is stale
+    watermark = db.execute(
+        "SELECT aggregates_computed_at FROM aggregate_watermark WHERE id = 1"
     ).fetchone()
-    db.close()
-    return row
+    if watermark is None or (
+        datetime.fromisoformat(watermark["aggregates_computed_at"])
+        != state.aggregates_computed_at
+    ):
+        return False
+    watermarks = {
+        row["shard"]: row["last_count_id"]
+        for row in db.execute("SELECT shard, last_count_id FROM shard_watermarks")
+    }
+    return watermarks == state.watermarks
+
+
+def refresh_daily_stats(db: sqlite3.Connection) -> bool:
+    # Scheduled job: compute today's stats once the baseline window has closed
+    now = datetime.now(TIMEZONE)
+    day = now.date()
+    if now < daily_stats_as_of(day, TIMEZONE) + timedelta(
+        minutes=DAILY_STATS_GRACE_MINUTES
+    ):
+        return False
+    if db.execute(
+        "SELECT 1 FROM daily_stats WHERE day = ? LIMIT 1", (day.isoformat(),)
+    ).fetchone():
+        return False
+    stats = compute_daily_stats([day])
+    save_daily_stats(db, stats)
+    logger.info(f"Computed daily stats for {day} ({len(stats[day])} locations)")
+    return True
+
+
+def refresh_aggregate_state() -> AggregateState:
+    global _aggregate_state
+    snapshot_db = get_snapshot_db_connection()
+    try:
+        new_daily_stats = refresh_daily_stats(snapshot_db)
+        state = _aggregate_state
+        if state is None or not _is_persisted_state(snapshot_db, state):
+            state = load_aggregate_state(snapshot_db)
+        if (
+            state is not None
+            and not new_daily_stats
+            and datetime.now(TIMEZONE) - state.aggregates_computed_at
+            < timedelta(seconds=AGGREGATE_REFRESH_SECONDS)
+        ):
+            tails = catch_up_aggregate_state(state)
+            if not tails.keys() - state.aggregates.keys():
+                save_caught_up_state(snapshot_db, state, tails)
+                _aggregate_state = state
+                return state
+            logger.info("New location reporting, recomputing aggregates")
+
+        state = compute_aggregate_state(
+            load_daily_stats(snapshot_db, current_stats_day(datetime.now(TIMEZONE))),
+            state,
+        )
+        save_aggregate_state(snapshot_db, state)
+        _aggregate_state = state
+        logger.info(f"Recomputed aggregates up to count ids {state.watermarks}")
+        return state
+    finally:
+        snapshot_db.close()
+
+
+def refresh_snapshot() -> None:
+    if not acquire_snapshot_lease():
+        return
+    stop = threading.Event()
+    renewer = threading.Thread(
+        target=_renew_snapshot_lease, args=(stop,), name="snapshot-lease", daemon=True
+    )
+    renewer.start()
+    try:
+        # Read before the counts, so every reading committed with the probe is in
+        # this snapshot
+        probe_timestamp = read_freshness_probe()
+        state = refresh_aggregate_state()
+        generation = publish_snapshot(_build_location_status(state), probe_timestamp)
+    finally:
+        stop.set()
+        renewer.join()
+    logger.debug(f"Published status snapshot generation {generation}")
+
+
+async def run_rollout_supervisor() -> None:
+    # Fails nodes that never reported their new version, even when nothing polls
+    while True:
+        await asyncio.sleep(ROLLOUT_CHECK_SECONDS)
+        try:
+            await control_db.run(
+                ADMIN_TIMEOUT_S, run_rollout_transaction, supervise_rollouts
+            )
+        except HTTPException as e:
+            logger.warning(f"Rollout check skipped: {e.detail}")
+        except Exception as e:
+            logger.error(f"Rollout check failed: {e}")
+
+
+async def run_snapshot_refresher() -> None:
+    while True:
+        try:
+            await asyncio.to_thread(refresh_snapshot)
+        except HTTPException as e:
+            logger.warning(f"Snapshot refresh skipped: {e.detail}")
+        except Exception as e:
+            logger.error(f"Snapshot refresh failed: {e}")
+        await asyncio.sleep(CACHE_TTL)
+
+
+# Last snapshot payload this worker read, keyed by generation
+_snapshot: tuple[int, bytes] | None = None
+
+
+def read_snapshot() -> tuple[int, bytes]:
+    global _snapshot
+    db = get_snapshot_db_connection()
+    try:
+        row = db.execute(
+            "SELECT generation FROM status_snapshot WHERE id = 1"
+        ).fetchone()
+        if row is None:
+            raise HTTPException(status_code=503, detail="No data available")
+        if _snapshot is None or _snapshot[0] != row["generation"]:
+            row = db.execute(
+                "SELECT generation, payload FROM status_snapshot WHERE id = 1"
+            ).fetchone()
+            _snapshot = (row["generation"], row["payload"])
+    finally:
+        db.close()
+    return _snapshot
+
+
+def read_snapshot_freshness_probe() -> FreshnessProbe:
+    db = get_snapshot_db_connection()
+    try:
+        row = db.execute(
+            """
+            SELECT generation, probe_timestamp
+            FROM snapshot_freshness_probe
+            WHERE id = 1
+            """
+        ).fetchone()
+    finally:
+        db.close()
+    if row is None:
+        raise HTTPException(status_code=503, detail="No data available")
+    return FreshnessProbe(
+        probe_timestamp=row["probe_timestamp"], generation=row["generation"]
+    )
+
+
+def read_typical_profile(location: str) -> tuple[str, bytes] | None:
+    db = get_snapshot_db_connection()
+    try:
+        row = db.execute(
+            "SELECT version, payload FROM typical_profiles WHERE location = ?",
+            (location,),
+        ).fetchone()
+    finally:
+        db.close()
+    return None if row is None else (row["version"], row["payload"])
+
+
+def negotiate_wire_format(
+    requested: WireFormat | None, accept: str | None
+) -> WireFormat:
+    # An explicit ?format= wins; otherwise the recognised Accept media type with
+    # the highest q-value, the first listed on ties. q=0 refuses a type, and
+    # wildcards stand for plain JSON
+    if requested is not None:
+        return requested
+    best: tuple[float, WireFormat] | None = None
+    for media_range in (accept or "").split(","):
+        media_type, *params = (part.strip().lower() for part in media_range.split(";"))
+        wire_format: WireFormat
+        if media_type == COMPACT_JSON_MEDIA_TYPE:
+            wire_format = "compact"
+        elif media_type in MSGPACK_MEDIA_TYPES:
+            wire_format = "msgpack"
+        elif media_type in ("application/json", "application/*", "*/*"):
+            wire_format = "json"
+        else:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if 0 < quality <= 1 and (best is None or quality > best[0]):
+            best = (quality, wire_format)
+    return "json" if best is None else best[1]
+
+
+def compact_status(status: LocationStatus) -> CompactLocationStatus:
+    epochs = [round(point.timestamp.timestamp()) for point in status.today_data]
+    deltas = [later - earlier for earlier, later in pairwise(epochs)]
+    step = deltas[0] if deltas and len(set(deltas)) == 1 else None
+    return CompactLocationStatus(
+        location=status.location,
+        timestamp=status.timestamp,
+        busyness_percentage=status.busyness_percentage,
+        vs_typical_percentage=status.vs_typical_percentage,
+        trend=status.trend,
+        today_data=CompactSeries(
+            start=epochs[0] if epochs else 0,
+            step=step,
+            offsets=None if step is not None else [0, *deltas] if epochs else [],
+            scale=BUSYNESS_SCALE,
+            busyness=[
+                None
+                if point.busyness_percentage is None
+                else round(point.busyness_percentage * BUSYNESS_SCALE)
+                for point in status.today_data
+            ],
+        ),
+    )
 
 
-_cache: tuple[float, list[LocationStatus]] | None = None
+def downsample_lttb(points: list[DataPoint], max_points: int) -> list[DataPoint]:
+    # Largest-Triangle-Three-Buckets: keep the first and last point, and from each
+    # bucket in between the point forming the largest triangle with the previous
+    # pick and the next bucket's average. Unknown busyness counts as 0 for the
+    # area, but the picked points keep their original values
+    if len(points) <= max_points:
+        return points
+    xs = [point.timestamp.timestamp() for point in points]
+    ys = [point.busyness_percentage or 0.0 for point in points]
+    bucket_size = (len(points) - 2) / (max_points - 2)
+
+    sampled = [points[0]]
+    previous = 0
+    for bucket in range(max_points - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, len(points))
+        average_x = sum(xs[end:next_end]) / (next_end - end)
+        average_y = sum(ys[end:next_end]) / (next_end - end)
+        anchor_x, anchor_y = xs[previous], ys[previous]
+        previous = max(
+            range(start, end),
+            key=lambda i: abs(
+                (anchor_x - average_x) * (ys[i] - anchor_y)
+                - (anchor_x - xs[i]) * (average_y - anchor_y)
+            ),
+        )
+        sampled.append(points[previous])
+    sampled.append(points[-1])
+    return sampled
+
+
+def encode_snapshot(
+    payload: bytes, wire_format: WireFormat, max_points: int | None
+) -> bytes:
+    if wire_format == "json" and max_points is None:
+        return payload
+    statuses = status_list_adapter.validate_json(payload)
+    if max_points is not None:
+        statuses = [
+            status.model_copy(
+                update={"today_data": downsample_lttb(status.today_data, max_points)}
+            )
+            for status in statuses
+        ]
+    if wire_format == "json":
+        return status_list_adapter.dump_json(statuses)
+    compact = [compact_status(status) for status in statuses]
+    if wire_format == "compact":
+        return compact_list_adapter.dump_json(compact)
+    return ormsgpack.packb(compact_list_adapter.dump_python(compact, mode="json"))
+
+
+# Encodings of the current snapshot generation this worker has served, by format
+# and max_points, in least to most recently used order
+_encoded_snapshot: (
+    tuple[int, OrderedDict[tuple[WireFormat, int | None], bytes]] | None
+) = None
+_encoded_snapshot_lock = threading.Lock()
+
+
+def read_current(wire_format: WireFormat, max_points: int | None) -> bytes:
+    global _encoded_snapshot
+    generation, payload = read_snapshot()
+    key = (wire_format, max_points)
+    with _encoded_snapshot_lock:
+        if _encoded_snapshot is None or _encoded_snapshot[0] != generation:
+            _encoded_snapshot = (generation, OrderedDict())
+        encoded = _encoded_snapshot[1]
+        if key in encoded:
+            encoded.move_to_end(key)
+            return encoded[key]
+    body = encode_snapshot(payload, wire_format, max_points)
+    with _encoded_snapshot_lock:
+        if _encoded_snapshot[0] == generation:
+            encoded[key] = body
+            if len(encoded) > MAX_CACHED_ENCODINGS:
+                encoded.popitem(last=False)
+    return body
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     ensure_directories()
     init_control_db()
+    init_snapshot_db()
     logger.info(
-        f"API starting, database at {DATABASE_PATH}, control db at {CONTROL_DATABASE_PATH}"
+        f"API worker {WORKER_ID} starting with {AGGREGATE_BACKEND} aggregates, "
+        f"database at {DATABASE_PATH}, "
+        f"control db at {CONTROL_DATABASE_PATH}, snapshot db at {SNAPSHOT_DATABASE_PATH}"
     )
+    refresher = asyncio.create_task(run_snapshot_refresher())
+    rollout_supervisor = asyncio.create_task(run_rollout_supervisor())
     yield
+    refresher.cancel()
+    rollout_supervisor.cancel()
+    release_snapshot_lease()
+    public_db.shutdown()
+    control_db.shutdown()
+    ingest_db.shutdown()
+    shutdown_aggregate_pool()
     logger.info("API shutting down")
 
 
@@ -513,43 +3202,85 @@ app = FastAPI(lifespan=lifespan, root_path="/api")
 app.add_middleware(GZipMiddleware)
 
 
-def get_db() -> Generator[sqlite3.Connection]:
-    db = sqlite3.connect(DATABASE_PATH, timeout=5.0)
-    db.row_factory = sqlite3.Row
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @app.get("/health")
-def health() -> str:
+async def health() -> str:
     return "Ok"
 
 
-@app.get("/current")
-def get_current(
-    db: Annotated[sqlite3.Connection, Depends(get_db)],
-) -> list[LocationStatus]:
-    global _cache
-    now = time()
-    if _cache is not None:
-        cached_time, cached_data = _cache
-        if now - cached_time < CACHE_TTL:
-            return cached_data
-    results = _build_location_status(db)
-    _cache = (now, results)
-    return results
+@app.get("/health/db")
+async def health_db() -> dict[str, dict[str, int]]:
+    return {
+        "public": public_db.stats(),
+        "control": control_db.stats(),
+        "ingest": ingest_db.stats(),
+    }
 
 
-@app.get("/node/{node}/manifest")
-def get_node_manifest(
-    request: Request,
-    node: str,
-    authorization: Annotated[str | None, Header()] = None,
-    x_middlines_version: Annotated[str | None, Header()] = None,
-) -> dict[str, object | None]:
-    state = get_node_state(node)
+@app.get("/health/freshness")
+async def health_freshness() -> FreshnessProbe:
+    # Latest freshness probe reading visible in /current, for the simulator's
+    # probe mode; the probe itself is never a location
+    return await public_db.run(CURRENT_TIMEOUT_S, read_snapshot_freshness_probe)
+
+
+@app.get(
+    "/current",
+    response_model=list[LocationStatus],
+    responses={
+        200: {
+            "description": "`format=compact` or `format=msgpack` (or the matching "
+            f"Accept types `{COMPACT_JSON_MEDIA_TYPE}` and `{MSGPACK_MEDIA_TYPES[0]}`) "
+            "return CompactLocationStatus items instead",
+            "content": {COMPACT_JSON_MEDIA_TYPE: {}, MSGPACK_MEDIA_TYPES[0]: {}},
+        }
+    },
+)
+async def get_current(
+    requested_format: Annotated[WireFormat | None, Query(alias="format")] = None,
+    max_points: Annotated[int | None, Query(ge=MIN_MAX_POINTS)] = None,
+    accept: Annotated[str | None, Header()] = None,
+) -> Response:
+    # Served straight from the shared snapshot so every worker returns the same data
+    wire_format = negotiate_wire_format(requested_format, accept)
+    payload = await public_db.run(
+        CURRENT_TIMEOUT_S, read_current, wire_format, max_points
+    )
+    return Response(
+        content=payload,
+        media_type={
+            "json": "application/json",
+            "compact": COMPACT_JSON_MEDIA_TYPE,
+            "msgpack": MSGPACK_MEDIA_TYPES[0],
+        }[wire_format],
+        headers={"Vary": "Accept"},
+    )
+
+
+@app.get(
+    "/typical/{location}",
+    response_model=TypicalProfile,
+    responses={304: {"description": "The profile matches If-None-Match"}},
+)
+async def get_typical(
+    location: str, if_none_match: Annotated[str | None, Header()] = None
+) -> Response:
+    # Weekday and weekend busyness by time bucket, from the last full aggregate pass
+    profile = await public_db.run(CURRENT_TIMEOUT_S, read_typical_profile, location)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Unknown location")
+    version, payload = profile
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={TYPICAL_MAX_AGE_S}"}
+    if if_none_match is not None and (
+        if_none_match.strip() == "*"
+        or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    ):
+        return Response(status_code=304, headers=headers)
+    return Response(content=payload, media_type="application/json", headers=headers)
+
+
+async def require_node_token(node: str, authorization: str | None) -> sqlite3.Row:
+    state = await control_db.run(MANIFEST_TIMEOUT_S, get_node_state, node)
     if state is None:
         raise HTTPException(status_code=404, detail="Unknown node")
 
@@ -559,11 +3290,33 @@ def get_node_manifest(
 
     if authorization != f"Bearer {expected_token}":
         raise HTTPException(status_code=401, detail="Invalid node token")
+    return state
+
+
+@app.get("/node/{node}/manifest")
+async def get_node_manifest(
+    request: Request,
+    node: str,
+    authorization: Annotated[str | None, Header()] = None,
+    x_middlines_version: Annotated[str | None, Header()] = None,
+) -> dict[str, object | None]:
+    state = await require_node_token(node, authorization)
 
     client_ip = request.headers.get("x-forwarded-for") or (
         request.client.host if request.client else None
     )
-    update_node_seen(node, x_middlines_version, client_ip)
+    await control_db.run(
+        MANIFEST_TIMEOUT_S, update_node_seen, node, x_middlines_version, client_ip
+    )
+    # Only a node mid-rollout that now runs its target costs extra queries
+    if state["rollout_id"] is not None and x_middlines_version == state["version"]:
+        await control_db.run(
+            MANIFEST_TIMEOUT_S,
+            run_rollout_transaction,
+            complete_rollout_node,
+            state["rollout_id"],
+            node,
+        )
 
     firmware = None
     if state["version"] and state["filename"] and state["sha256"]:
@@ -575,14 +3328,46 @@ def get_node_manifest(
 
     return {
         "node": node,
-        "poll_interval_s": state["poll_interval_s"],
+        "poll_interval_s": next_poll_delay(state, x_middlines_version),
         "firmware": firmware,
         "restart_nonce": state["restart_nonce"],
     }
 
 
+@app.post("/node/{node}/counts")
+async def post_node_counts(
+    request: Request,
+    node: str,
+    precision: Precision = "ns",
+    authorization: Annotated[str | None, Header()] = None,
+    content_type: Annotated[str | None, Header()] = None,
+    content_length: Annotated[int | None, Header()] = None,
+) -> IngestResult:
+    # Batched alternative to MQTT: a JSON CountBatch, or line protocol
+    # ("counts,location=<location> count=<count>i <timestamp>") sent as text/plain
+    state = await require_node_token(node, authorization)
+
+    if content_length is not None and content_length > MAX_INGEST_BYTES:
+        raise HTTPException(status_code=413, detail="Request body too large")
+    body = await request.body()
+    if len(body) > MAX_INGEST_BYTES:
+        raise HTTPException(status_code=413, detail="Request body too large")
+
+    # Parsing and validating a full batch takes about a second of CPU, so it runs
+    # on the ingest pool with the write rather than on the event loop
+    return await ingest_db.run(
+        INGEST_TIMEOUT_S,
+        ingest_count_upload,
+        node,
+        parse_node_locations(state["locations"]),
+        body,
+        (content_type or "").startswith("text/plain"),
+        precision,
+    )
+
+
 @app.get("/node/artifacts/{filename}")
-def get_artifact(filename: str) -> FileResponse:
+async def get_artifact(filename: str) -> FileResponse:
     artifact_path = ARTIFACTS_DIR / Path(filename).name
     if not artifact_path.is_file():
         raise HTTPException(status_code=404, detail="Artifact not found")
@@ -590,7 +3375,7 @@ def get_artifact(filename: str) -> FileResponse:
 
 
 @app.get("/admin/login")
-def admin_login_page() -> HTMLResponse:
+async def admin_login_page() -> HTMLResponse:
     return html_page(
         "Admin Login",
         """
@@ -607,7 +3392,7 @@ def admin_login_page() -> HTMLResponse:
 
 
 @app.post("/admin/login")
-def admin_login_submit(
+async def admin_login_submit(
     username: Annotated[str, Form()],
     password: Annotated[str, Form()],
 ) -> RedirectResponse:
@@ -621,32 +3406,84 @@ def admin_login_submit(
 
 
 @app.post("/admin/logout")
-def admin_logout() -> RedirectResponse:
+async def admin_logout() -> RedirectResponse:
     response = RedirectResponse(f"{PUBLIC_API_PREFIX}/admin/login", status_code=303)
     response.delete_cookie(SESSION_COOKIE)
     return response
 
 
 @app.get("/admin")
-def admin_dashboard(request: Request) -> HTMLResponse:
+async def admin_dashboard(
+    request: Request, listing: Annotated[AdminListing, Query()]
+) -> HTMLResponse:
     require_admin(request)
-    nodes, artifacts = fetch_admin_dashboard_data()
-
+    data = await control_db.run(ADMIN_TIMEOUT_S, fetch_admin_dashboard_data, listing)
+
+    total_nodes = sum(row["nodes"] for row in data.version_counts)
+    stale_nodes = sum(row["stale"] for row in data.version_counts)
+    version_rows = "".join(
+        f"<tr><td><a href='{escape(listing_url(listing, version=row['version'] or UNKNOWN_VERSION, node_page=1))}'>"
+        f"{escape(row['version'] or UNKNOWN_VERSION)}</a></td>"
+        f"<td>{row['nodes']}</td><td>{row['stale']}</td></tr>"
+        for row in data.version_counts
+    )
     node_rows = "".join(
         f"<tr><td><a href='{PUBLIC_API_PREFIX}/admin/nodes/{escape(row['node'])}'>{escape(row['node'])}</a></td>"
-        f"<td>{escape(row['current_version'] or 'unknown')}</td>"
+        f"<td>{escape(row['current_version'] or UNKNOWN_VERSION)}</td>"
         f"<td>{escape(row['target_version'] or 'none')}</td>"
-        f"<td>{escape(row['last_seen_at'] or 'never')}</td></tr>"
-        for row in nodes
+        f"<td>{escape(row['last_seen_at'] or 'never')}{' (stale)' if row['is_stale'] else ''}</td></tr>"
+        for row in data.nodes
     )
     artifact_rows = "".join(
         f"<tr><td>{escape(row['version'])}</td><td class='mono'>{escape(row['filename'])}</td>"
         f"<td>{row['size_bytes']}</td><td>{escape(row['uploaded_at'])}</td></tr>"
-        for row in artifacts
+        for row in data.artifacts
+    )
+
+    firmware_options = (
+        "".join(
+            f"<option value='{row['id']}'>{escape(row['version'])} ({escape(row['filename'])})</option>"
+            for row in data.firmware_choices
+        )
+        or "<option value=''>No uploaded firmware</option>"
+    )
+    rollout_actions = {
+        "active": ("pause", "Pause"),
+        "paused": ("resume", "Resume"),
+    }
+    rollout_rows = "".join(
+        f"<tr><td>{row['id']}</td><td>{escape(row['version'])}</td>"
+        f"<td>{escape(row['node_group'] or 'all')}</td>"
+        f"<td>{escape(row['status'])}"
+        f"{f'<div class=muted>{escape(row["pause_reason"])}</div>' if row['pause_reason'] else ''}</td>"
+        f"<td>{min(row['current_wave'] + 1, row['waves'])}/{row['waves']}</td>"
+        f"<td>{row['done']}/{row['nodes']} done, {row['downloading']} downloading, {row['failed']} failed</td>"
+        "<td>"
+        + "".join(
+            f"<form method='post' action='{PUBLIC_API_PREFIX}/admin/rollouts/{row['id']}/{action}'>"
+            f"<button type='submit' class='secondary'>{label}</button></form>"
+            for action, label in (
+                [rollout_actions[row["status"]], ("cancel", "Cancel")]
+                if row["status"] in rollout_actions
+                else []
+            )
+        )
+        + "</td></tr>"
+        for row in data.rollouts
     )
 
     content = f"""
     <div class='grid'>
+      <div class='card'>
+        <h2>Fleet</h2>
+        <p><strong>Nodes:</strong> {total_nodes}</p>
+        <p><strong>Stale:</strong> <a href='{escape(listing_url(listing, stale=True, node_page=1))}'>{stale_nodes}</a>
+          <span class='muted'>(not seen in {STALE_NODE_POLLS} poll intervals)</span></p>
+        <table>
+          <thead><tr><th>Version</th><th>Nodes</th><th>Stale</th></tr></thead>
+          <tbody>{version_rows}</tbody>
+        </table>
+      </div>
       <div class='card'>
         <h2>Upload Firmware</h2>
         <form method='post' action='/api/admin/firmware/upload' enctype='multipart/form-data'>
@@ -655,29 +3492,69 @@ def admin_dashboard(request: Request) -> HTMLResponse:
           <button type='submit'>Upload OTA Binary</button>
         </form>
       </div>
-      <div class='card'>
-        <h2>Nodes</h2>
-        <table>
-          <thead><tr><th>Node</th><th>Current</th><th>Target</th><th>Last Seen</th></tr></thead>
-          <tbody>{node_rows}</tbody>
-        </table>
-      </div>
+    </div>
+    <div class='card'>
+      <h2>Rollouts</h2>
+      <form method='post' action='{PUBLIC_API_PREFIX}/admin/rollouts' class='row'>
+        <label>Firmware<select name='firmware_id'>{firmware_options}</select></label>
+        <label>Node group<input name='node_group' placeholder='all nodes'></label>
+        <label>Wave size<input name='wave_size' type='number' min='1' value='{ROLLOUT_WAVE_SIZE}' required></label>
+        <label>Concurrent<input name='max_concurrent' type='number' min='1' value='{ROLLOUT_MAX_CONCURRENT}' required></label>
+        <button type='submit'>Start rollout</button>
+      </form>
+      <table>
+        <thead><tr><th>#</th><th>Version</th><th>Group</th><th>Status</th><th>Wave</th><th>Progress</th><th></th></tr></thead>
+        <tbody>{rollout_rows or '<tr><td colspan="7">No rollouts yet.</td></tr>'}</tbody>
+      </table>
+    </div>
+    <div class='card'>
+      <h2>Nodes</h2>
+      <form method='get' action='{PUBLIC_API_PREFIX}/admin' class='row'>
+        {render_listing_inputs(listing, "node")}
+        <label>Node<input name='node_q' value='{escape(listing.node_q)}'></label>
+        <label>Version<input name='version' value='{escape(listing.version)}' placeholder='any'></label>
+        <label>Stale only<select name='stale'>
+          <option value='false'>No</option>
+          <option value='true' {"selected" if listing.stale else ""}>Yes</option>
+        </select></label>
+        <button type='submit'>Filter</button>
+      </form>
+      <table>
+        <thead><tr>
+          {render_sort_header(listing, "node", "node", "Node")}
+          {render_sort_header(listing, "node", "version", "Current")}
+          <th>Target</th>
+          {render_sort_header(listing, "node", "last_seen", "Last Seen")}
+        </tr></thead>
+        <tbody>{node_rows or '<tr><td colspan="4">No matching nodes.</td></tr>'}</tbody>
+      </table>
+      {render_pager(listing, "node", data.node_total)}
     </div>
     <div class='card'>
       <h2>Uploaded Firmware</h2>
+      <form method='get' action='{PUBLIC_API_PREFIX}/admin' class='row'>
+        {render_listing_inputs(listing, "artifact")}
+        <label>Version or file<input name='artifact_q' value='{escape(listing.artifact_q)}'></label>
+        <button type='submit'>Filter</button>
+      </form>
       <table>
-        <thead><tr><th>Version</th><th>Stored File</th><th>Bytes</th><th>Uploaded</th></tr></thead>
+        <thead><tr>
+          {render_sort_header(listing, "artifact", "version", "Version")}
+          <th>Stored File</th><th>Bytes</th>
+          {render_sort_header(listing, "artifact", "uploaded", "Uploaded")}
+        </tr></thead>
         <tbody>{artifact_rows or '<tr><td colspan="4">No firmware uploaded yet.</td></tr>'}</tbody>
       </table>
+      {render_pager(listing, "artifact", data.artifact_total)}
     </div>
     """
     return render_admin_shell("Control Dashboard", content)
 
 
 @app.get("/admin/nodes/{node}")
-def admin_node_detail(request: Request, node: str) -> HTMLResponse:
+async def admin_node_detail(request: Request, node: str) -> HTMLResponse:
     require_admin(request)
-    detail, artifacts = fetch_node_detail(node)
+    detail, artifacts = await control_db.run(ADMIN_TIMEOUT_S, fetch_node_detail, node)
     artifact_options = "".join(
         f"<option value='{row['id']}' {'selected' if row['id'] == detail['target_firmware_id'] else ''}>{escape(row['version'])} ({escape(row['filename'])})</option>"
         for row in artifacts
@@ -707,10 +3584,24 @@ def admin_node_detail(request: Request, node: str) -> HTMLResponse:
           <button type='submit' class='secondary'>Generate new token</button>
         </form>
       </div>
+      <div class='card'>
+        <h2>Group</h2>
+        <form method='post' action='{PUBLIC_API_PREFIX}/admin/nodes/{escape(node)}/group'>
+          <label>Rollout group<input name='node_group' value='{escape(detail["node_group"])}' placeholder='none'></label>
+          <button type='submit'>Save group</button>
+        </form>
+      </div>
+      <div class='card'>
+        <h2>Count Locations</h2>
+        <form method='post' action='{PUBLIC_API_PREFIX}/admin/nodes/{escape(node)}/locations'>
+          <label>Locations this node may upload counts for<input name='locations' value='{escape(", ".join(parse_node_locations(detail["locations"])))}' placeholder='none, comma-separated'></label>
+          <button type='submit'>Save locations</button>
+        </form>
+      </div>
       <div class='card'>
         <h2>Polling</h2>
         <form method='post' action='{PUBLIC_API_PREFIX}/admin/nodes/{escape(node)}/poll-interval'>
-          <label>Poll interval (seconds)<input name='poll_interval_s' type='number' min='30' step='1' value='{detail["poll_interval_s"]}' required></label>
+          <label>Base poll interval (seconds)<input name='poll_interval_s' type='number' min='30' step='1' value='{detail["poll_interval_s"]}' required></label>
           <button type='submit'>Save poll interval</button>
         </form>
       </div>
@@ -736,6 +3627,17 @@ def admin_node_detail(request: Request, node: str) -> HTMLResponse:
     return render_admin_shell(f"Node {node}", content)
 
 
+def store_artifact(source: BinaryIO, target_path: Path) -> tuple[str, int]:
+    hasher = hashlib.sha256()
+    size_bytes = 0
+    with target_path.open("wb") as output:
+        while chunk := source.read(1024 * 1024):
+            output.write(chunk)
+            hasher.update(chunk)
+            size_bytes += len(chunk)
+    return hasher.hexdigest(), size_bytes
+
+
 @app.post("/admin/firmware/upload")
 async def admin_upload_firmware(
     request: Request,
@@ -746,21 +3648,15 @@ async def admin_upload_firmware(
     cleaned_name = Path(artifact.filename or "firmware.bin").name
     safe_name = cleaned_name.replace(" ", "-")
     stored_name = f"{version}-{safe_name}"
-    target_path = ARTIFACTS_DIR / stored_name
-    hasher = hashlib.sha256()
-    size_bytes = 0
-
-    with target_path.open("wb") as output:
-        while True:
-            chunk = await artifact.read(1024 * 1024)
-            if not chunk:
-                break
-            output.write(chunk)
-            hasher.update(chunk)
-            size_bytes += len(chunk)
+    # Copied and hashed off the event loop, so a large upload doesn't hold up
+    # other endpoints; file I/O stays off the control pool's threads too
+    sha256, size_bytes = await asyncio.to_thread(
+        store_artifact, artifact.file, ARTIFACTS_DIR / stored_name
+    )
 
-    db = get_control_db_connection()
-    db.execute(
+    await control_db.run(
+        ADMIN_TIMEOUT_S,
+        execute_control_write,
         """
         INSERT INTO firmware_artifacts (filename, original_filename, version, sha256, size_bytes, uploaded_at)
         VALUES (?, ?, ?, ?, ?, ?)
@@ -771,101 +3667,190 @@ async def admin_upload_firmware(
             size_bytes = excluded.size_bytes,
             uploaded_at = excluded.uploaded_at
         """,
-        (stored_name, cleaned_name, version, hasher.hexdigest(), size_bytes, utc_now()),
+        (stored_name, cleaned_name, version, sha256, size_bytes, utc_now()),
     )
-    db.commit()
-    db.close()
     return RedirectResponse(f"{PUBLIC_API_PREFIX}/admin", status_code=303)
 
 
 @app.post("/admin/nodes/{node}/token")
-def admin_set_node_token(
+async def admin_set_node_token(
     request: Request,
     node: str,
     token: Annotated[str, Form()],
 ) -> RedirectResponse:
     require_admin(request)
-    db = get_control_db_connection()
-    db.execute(
+    await control_db.run(
+        ADMIN_TIMEOUT_S,
+        execute_control_write,
         "UPDATE nodes SET token = ?, updated_at = ? WHERE node = ?",
         (token.strip(), utc_now(), node),
     )
-    db.commit()
-    db.close()
     return RedirectResponse(f"{PUBLIC_API_PREFIX}/admin/nodes/{node}", status_code=303)
 
 
 @app.post("/admin/nodes/{node}/token/generate")
-def admin_generate_node_token(request: Request, node: str) -> RedirectResponse:
+async def admin_generate_node_token(request: Request, node: str) -> RedirectResponse:
     require_admin(request)
     token = secrets.token_urlsafe(24)
-    db = get_control_db_connection()
-    db.execute(
+    await control_db.run(
+        ADMIN_TIMEOUT_S,
+        execute_control_write,
         "UPDATE nodes SET token = ?, updated_at = ? WHERE node = ?",
         (token, utc_now(), node),
     )
-    db.commit()
-    db.close()
+    return RedirectResponse(f"{PUBLIC_API_PREFIX}/admin/nodes/{node}", status_code=303)
+
+
+@app.post("/admin/nodes/{node}/group")
+async def admin_set_node_group(
+    request: Request,
+    node: str,
+    node_group: Annotated[str, Form()] = "",
+) -> RedirectResponse:
+    require_admin(request)
+    await control_db.run(
+        ADMIN_TIMEOUT_S,
+        execute_control_write,
+        "UPDATE nodes SET node_group = ?, updated_at = ? WHERE node = ?",
+        (node_group.strip(), utc_now(), node),
+    )
+    return RedirectResponse(f"{PUBLIC_API_PREFIX}/admin/nodes/{node}", status_code=303)
+
+
+@app.post("/admin/nodes/{node}/locations")
+async def admin_set_node_locations(
+    request: Request,
+    node: str,
+    locations: Annotated[str, Form()] = "",
+) -> RedirectResponse:
+    require_admin(request)
+    await control_db.run(
+        ADMIN_TIMEOUT_S,
+        execute_control_write,
+        "UPDATE nodes SET locations = ?, updated_at = ? WHERE node = ?",
+        (",".join(parse_node_locations(locations)), utc_now(), node),
+    )
     return RedirectResponse(f"{PUBLIC_API_PREFIX}/admin/nodes/{node}", status_code=303)
 
 
 @app.post("/admin/nodes/{node}/poll-interval")
-def admin_set_poll_interval(
+async def admin_set_poll_interval(
     request: Request,
     node: str,
     poll_interval_s: Annotated[int, Form()],
 ) -> RedirectResponse:
     require_admin(request)
     interval = max(30, poll_interval_s)
-    db = get_control_db_connection()
-    db.execute(
+    await control_db.run(
+        ADMIN_TIMEOUT_S,
+        execute_control_write,
         "UPDATE nodes SET poll_interval_s = ?, updated_at = ? WHERE node = ?",
         (interval, utc_now(), node),
     )
-    db.commit()
-    db.close()
     return RedirectResponse(f"{PUBLIC_API_PREFIX}/admin/nodes/{node}", status_code=303)
 
 
 @app.post("/admin/nodes/{node}/target-firmware")
-def admin_set_target_firmware(
+async def admin_set_target_firmware(
     request: Request,
     node: str,
     firmware_id: Annotated[str, Form()],
 ) -> RedirectResponse:
     require_admin(request)
     firmware_value = int(firmware_id) if firmware_id else None
-    db = get_control_db_connection()
-    db.execute(
+    await control_db.run(
+        ADMIN_TIMEOUT_S,
+        execute_control_write,
         "UPDATE node_desired_state SET target_firmware_id = ?, updated_at = ? WHERE node = ?",
         (firmware_value, utc_now(), node),
     )
-    db.commit()
-    db.close()
     return RedirectResponse(f"{PUBLIC_API_PREFIX}/admin/nodes/{node}", status_code=303)
 
 
 @app.post("/admin/nodes/{node}/target-firmware/clear")
-def admin_clear_target_firmware(request: Request, node: str) -> RedirectResponse:
+async def admin_clear_target_firmware(request: Request, node: str) -> RedirectResponse:
     require_admin(request)
-    db = get_control_db_connection()
-    db.execute(
+    await control_db.run(
+        ADMIN_TIMEOUT_S,
+        execute_control_write,
         "UPDATE node_desired_state SET target_firmware_id = NULL, updated_at = ? WHERE node = ?",
         (utc_now(), node),
     )
-    db.commit()
-    db.close()
     return RedirectResponse(f"{PUBLIC_API_PREFIX}/admin/nodes/{node}", status_code=303)
 
 
 @app.post("/admin/nodes/{node}/restart")
-def admin_trigger_restart(request: Request, node: str) -> RedirectResponse:
+async def admin_trigger_restart(request: Request, node: str) -> RedirectResponse:
     require_admin(request)
-    db = get_control_db_connection()
-    db.execute(
+    await control_db.run(
+        ADMIN_TIMEOUT_S,
+        execute_control_write,
         "UPDATE node_desired_state SET restart_nonce = ?, updated_at = ? WHERE node = ?",
         (utc_now(), utc_now(), node),
     )
-    db.commit()
-    db.close()
     return RedirectResponse(f"{PUBLIC_API_PREFIX}/admin/nodes/{node}", status_code=303)
+
+
+@app.post("/admin/rollouts")
+async def admin_create_rollout(
+    request: Request,
+    firmware_id: Annotated[int, Form()],
+    wave_size: Annotated[int, Form(ge=1)],
+    max_concurrent: Annotated[int, Form(ge=1)],
+    node_group: Annotated[str, Form()] = "",
+) -> RedirectResponse:
+    require_admin(request)
+    await control_db.run(
+        ADMIN_TIMEOUT_S,
+        run_rollout_transaction,
+        create_rollout,
+        firmware_id,
+        node_group.strip(),
+        wave_size,
+        max_concurrent,
+    )
+    return RedirectResponse(f"{PUBLIC_API_PREFIX}/admin", status_code=303)
+
+
+@app.post("/admin/rollouts/{rollout_id}/{action}")
+async def admin_update_rollout(
+    request: Request, rollout_id: int, action: Literal["pause", "resume", "cancel"]
+) -> RedirectResponse:
+    require_admin(request)
+    statuses: dict[str, Literal["active", "paused", "cancelled"]] = {
+        "pause": "paused",
+        "resume": "active",
+        "cancel": "cancelled",
+    }
+    await control_db.run(
+        ADMIN_TIMEOUT_S,
+        run_rollout_transaction,
+        set_rollout_status,
+        rollout_id,
+        statuses[action],
+    )
+    return RedirectResponse(f"{PUBLIC_API_PREFIX}/admin", status_code=303)
+
+
+def backfill_daily_stats(start: date, end: date) -> None:
+    init_snapshot_db()
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    stats = compute_daily_stats(days)
+    db = get_snapshot_db_connection()
+    try:
+        save_daily_stats(db, stats)
+    finally:
+        db.close()
+    logger.info(f"Backfilled daily stats for {len(days)} days from {start} to {end}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill = subcommands.add_parser(
+        "backfill-daily-stats", help="(re)compute daily stats for past dates"
+    )
+    backfill.add_argument("--start", type=date.fromisoformat, required=True)
+    backfill.add_argument("--end", type=date.fromisoformat, required=True)
+    args = parser.parse_args()
+    backfill_daily_stats(args.start, args.end)
@@ -0,0 +1,59 @@
+# pyright: reportPrivateUsage=false
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from main import DailyStats, SmoothedCount
+
+
+def _readings(
+    location: str, now: datetime, open_count: float, seed: int
+) -> list[SmoothedCount]:
+    # One reading every 7 minutes over 46 days, offset so none falls within
+    # minutes of the 1-day or 45-day window edges
+    rng = random.Random(seed)
+    readings: list[SmoothedCount] = []
+    for step in range(46 * 24 * 60 // 7, -1, -1):
+        timestamp = now - timedelta(minutes=7 * step + 3.5)
+        count = open_count if 7 <= timestamp.hour < 20 else 2.0
+        readings.append(
+            SmoothedCount(
+                location=location,
+                timestamp=timestamp,
+                count=count * rng.uniform(0.5, 1.5),
+            )
+        )
+    return readings
+
+
+def test_duckdb_aggregates_match_python() -> None:
+    pytest.importorskip("duckdb")
+    now = datetime.now(main.TIMEZONE)
+    counts = [
+        *_readings("atwater", now, 40.0, seed=1),
+        *_readings("proctor", now, 25.0, seed=2),
+        # Never above the closed threshold, so no time averages
+        *(
+            SmoothedCount(location="ross", timestamp=c.timestamp, count=3.0)
+            for c in _readings("ross", now, 0.0, seed=3)
+        ),
+    ]
+    # Only atwater has stored stats; the others compute theirs from `counts`
+    daily_stats = {
+        "atwater": DailyStats(
+            baseline=2.0, max_count=50.0, baseline_samples=25, open_samples=5000
+        )
+    }
+
+    expected = main._compute_aggregates_python(counts, daily_stats)
+    actual = main._compute_aggregates_duckdb(counts, daily_stats)
+
+    assert actual.keys() == expected.keys() == {"atwater", "proctor", "ross"}
+    assert expected["atwater"].max_count == 50.0
+    assert expected["ross"].time_averages == {}
+    for location, aggregates in expected.items():
+        assert actual[location].baseline == pytest.approx(aggregates.baseline)
+        assert actual[location].max_count == pytest.approx(aggregates.max_count)
+        assert actual[location].time_averages == pytest.approx(aggregates.time_averages)
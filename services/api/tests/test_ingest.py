@@ -0,0 +1,31 @@
+import pytest
+from fastapi import HTTPException
+
+from main import CountBatch, Precision, parse_line_protocol, prepare_count_batch
+
+
+@pytest.mark.parametrize(
+    ("body", "precision"),
+    [
+        ("counts,location=ross count=1i 99999999999999999999", "s"),
+        ("counts,location=ross count=1i -99999999999999999999", "ns"),
+    ],
+)
+def test_line_protocol_timestamp_out_of_range(body: str, precision: Precision) -> None:
+    with pytest.raises(HTTPException) as e:
+        parse_line_protocol(f"# header\n{body}", precision)
+    assert e.value.status_code == 422
+    assert e.value.detail == [{"line": 2, "msg": "timestamp is out of range"}]
+
+
+@pytest.mark.parametrize(
+    "timestamp", ["9999-12-31T23:59:59-05:00", "0001-01-01T00:00:00+05:00"]
+)
+def test_json_timestamp_out_of_range(timestamp: str) -> None:
+    batch = CountBatch.model_validate(
+        {"readings": [{"location": "ross", "timestamp": timestamp, "count": 1}]}
+    )
+    with pytest.raises(HTTPException) as e:
+        prepare_count_batch(batch.readings)
+    assert e.value.status_code == 422
+    assert e.value.detail == [{"reading": 0, "msg": "timestamp is out of range"}]
@@ -0,0 +1,128 @@
+# pyright: reportPrivateUsage=false
+import importlib.util
+import random
+from datetime import datetime, time, timedelta
+from pathlib import Path
+
+import pytest
+
+import main as api
+from main import DailyStats, SmoothedCount
+from middlines_common.stats import (
+    DAILY_STATS_GRACE_MINUTES,
+    current_stats_day,
+    daily_stats_as_of,
+)
+
+# The sweep's module is also named main, so it's loaded under its own name
+_spec = importlib.util.spec_from_file_location(
+    "sweep_main", Path(__file__).parents[2] / "sweep" / "main.py"
+)
+assert _spec is not None and _spec.loader is not None
+sweep = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(sweep)
+
+PARAMS = sweep.SweepParams(
+    ema_alpha=api.EMA_ALPHA,
+    closed_threshold=api.CLOSED_THRESHOLD,
+    max_percentile=api.MAX_PERCENTILE,
+    time_bucket_size=api.TIME_BUCKET_SIZE,
+    trend_lookback_rows=20,
+)
+
+
+def _readings(now: datetime) -> list[SmoothedCount]:
+    # One reading every 7 minutes over 47 days, offset so none falls within
+    # minutes of a refresh, a daily stats cutoff or a window edge
+    rng = random.Random(7)
+    readings: list[SmoothedCount] = []
+    for step in range(47 * 24 * 60 // 7, -1, -1):
+        timestamp = now - timedelta(minutes=7 * step + 3.5)
+        count = 40.0 if 7 <= timestamp.hour < 20 else 2.0
+        readings.append(
+            SmoothedCount(
+                location="ross",
+                timestamp=timestamp,
+                count=count * rng.uniform(0.5, 1.5),
+            )
+        )
+    return readings
+
+
+def _api_stats(readings: list[SmoothedCount], refreshed_at: datetime) -> DailyStats:
+    # What the API's full pass at `refreshed_at` uses: the current day's stored
+    # stats once computed, otherwise computed as of then
+    as_of = daily_stats_as_of(current_stats_day(refreshed_at), api.TIMEZONE)
+    if refreshed_at < as_of + timedelta(minutes=DAILY_STATS_GRACE_MINUTES):
+        as_of = refreshed_at
+    return api._compute_daily_stats(
+        [c for c in readings if c.timestamp <= as_of], as_of
+    )
+
+
+def test_replay_uses_the_api_daily_stats_through_a_day() -> None:
+    now = datetime.now(api.TIMEZONE).replace(second=0, microsecond=0)
+    readings = _readings(now)
+    smoothed = [(c.timestamp, c.count) for c in readings]
+    timestamps = [c.timestamp for c in readings]
+
+    day = now.date() - timedelta(days=1)
+    refreshes = sweep.refresh_times(
+        datetime.combine(day, time(), api.TIMEZONE),
+        datetime.combine(now.date(), time(), api.TIMEZONE),
+    )
+    assert (
+        daily_stats_as_of(day, api.TIMEZONE)
+        + timedelta(minutes=DAILY_STATS_GRACE_MINUTES)
+        in refreshes
+    )
+
+    for refreshed_at in refreshes:
+        expected = _api_stats(readings, refreshed_at)
+        stats = sweep.compute_stats(
+            smoothed, timestamps, sweep.stats_as_of(timestamps, refreshed_at), PARAMS
+        )
+        assert stats.baseline == pytest.approx(expected.baseline)
+        assert stats.max_count == pytest.approx(expected.max_count)
+
+    # Before the day's stats are stored, the previous day's baseline is used rather
+    # than one over the closed hours so far
+    overnight = datetime.combine(day, time(2), api.TIMEZONE)
+    live = api._compute_daily_stats(
+        [c for c in readings if c.timestamp <= overnight], overnight
+    )
+    assert _api_stats(readings, overnight).baseline != pytest.approx(live.baseline)
+
+
+def test_aggregates_match_the_api_full_pass() -> None:
+    now = datetime.now(api.TIMEZONE)
+    readings = _readings(now)
+    smoothed = [(c.timestamp, c.count) for c in readings]
+    timestamps = [c.timestamp for c in readings]
+
+    as_of = daily_stats_as_of(current_stats_day(now), api.TIMEZONE)
+    stored = (
+        {
+            "ross": api._compute_daily_stats(
+                [c for c in readings if c.timestamp <= as_of], as_of
+            )
+        }
+        if now >= as_of + timedelta(minutes=DAILY_STATS_GRACE_MINUTES)
+        else {}
+    )
+    expected = api._compute_aggregates_python(readings, stored)["ross"]
+
+    agg = sweep.compute_aggregates(
+        smoothed,
+        timestamps,
+        now,
+        sweep.compute_stats(
+            smoothed, timestamps, sweep.stats_as_of(timestamps, now), PARAMS
+        ),
+        PARAMS,
+    )
+    assert agg.baseline == pytest.approx(expected.baseline)
+    assert agg.max_count == pytest.approx(expected.max_count)
+    assert agg.time_averages.keys() == expected.time_averages.keys()
+    for bucket, average in expected.time_averages.items():
+        assert agg.time_averages[bucket] == pytest.approx(average)
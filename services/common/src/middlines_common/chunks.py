@@ -0,0 +1,49 @@
+from collections.abc import Iterator
+
+# Chunked storage: seconds covered by one count_chunks row (a UTC hour)
+CHUNK_SECONDS = 3600
+
+
+def _zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def encode_chunk(readings: list[tuple[int, int]]) -> bytes:
+    # Readings after the first, as zigzag varints of the timestamp's
+    # delta-of-delta and the count's delta. db-init's count_readings view decodes
+    # the same format in SQL
+    payload = bytearray()
+    previous_ts, previous_count = readings[0]
+    previous_delta = 0
+    for ts, count in readings[1:]:
+        delta = ts - previous_ts
+        for value in (_zigzag(delta - previous_delta), _zigzag(count - previous_count)):
+            while value >= 0x80:
+                payload.append(value & 0x7F | 0x80)
+                value >>= 7
+            payload.append(value)
+        previous_ts, previous_count, previous_delta = ts, count, delta
+    return bytes(payload)
+
+
+def decode_chunk(
+    first_ts: int, first_count: int, payload: bytes
+) -> Iterator[tuple[int, int]]:
+    ts, count, delta = first_ts, first_count, 0
+    yield ts, count
+    value = shift = 0
+    is_count = False
+    for byte in payload:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        decoded = (value >> 1) ^ -(value & 1)
+        value = shift = 0
+        if is_count:
+            count += decoded
+            yield ts, count
+        else:
+            delta += decoded
+            ts += delta
+        is_count = not is_count
@@ -0,0 +1,35 @@
+import os
+from pathlib import Path
+
+# Sharding: "location=shard,..." routes those locations to middlines-{shard}.db next
+# to the main database; every other location stays in the default shard, the main
+# database itself. Every service routes through this map
+DEFAULT_SHARD = "default"
+SHARD_MAP_SPEC = os.environ.get("MIDDLINES_SHARD_MAP", "")
+
+
+def parse_shard_map(spec: str) -> dict[str, str]:
+    shard_map: dict[str, str] = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        location, _, shard = entry.partition("=")
+        shard_map[location.strip()] = shard.strip() or DEFAULT_SHARD
+    return shard_map
+
+
+SHARD_MAP = parse_shard_map(SHARD_MAP_SPEC)
+
+
+def shard_for_location(location: str) -> str:
+    return SHARD_MAP.get(location, DEFAULT_SHARD)
+
+
+def all_shards() -> list[str]:
+    return [DEFAULT_SHARD, *sorted(set(SHARD_MAP.values()) - {DEFAULT_SHARD})]
+
+
+def shard_database_path(database_path: str, shard: str) -> str:
+    if shard == DEFAULT_SHARD:
+        return database_path
+    return str(Path(database_path).with_name(f"middlines-{shard}.db"))
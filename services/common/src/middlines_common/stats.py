@@ -0,0 +1,67 @@
+from collections.abc import Sequence
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, tzinfo
+
+# Baseline: readings from this hour up to (not including) the next are the closed-hours
+# baseline; a day's daily stats are computed as of BASELINE_END_HOUR
+BASELINE_START_HOUR = 1
+BASELINE_END_HOUR = 4
+# Daily stats: minutes after BASELINE_END_HOUR to wait for late readings before computing
+DAILY_STATS_GRACE_MINUTES = 5
+
+
+@dataclass(frozen=True)
+class BaselineStats:
+    baseline: float
+    max_count: float
+    baseline_samples: int
+    open_samples: int
+
+
+def daily_stats_as_of(day: date, tz: tzinfo) -> datetime:
+    return datetime(day.year, day.month, day.day, BASELINE_END_HOUR, tzinfo=tz)
+
+
+def current_stats_day(now: datetime) -> date:
+    # A day's stats apply from its BASELINE_END_HOUR until the next day's
+    return (now - timedelta(hours=BASELINE_END_HOUR)).date()
+
+
+def compute_baseline_stats(
+    readings: Sequence[tuple[datetime, float]],
+    now: datetime,
+    lookback_days: int,
+    closed_threshold: float,
+    max_percentile: float,
+) -> BaselineStats:
+    # Smoothed readings up to `now`: the baseline is the last day's closed hours,
+    # the max count a high percentile of the lookback's open readings above it
+    yesterday = now - timedelta(days=1)
+    lookback_start = now - timedelta(days=lookback_days)
+
+    baseline_counts = [
+        count
+        for timestamp, count in readings
+        if timestamp > yesterday
+        and BASELINE_START_HOUR <= timestamp.hour < BASELINE_END_HOUR
+    ]
+    baseline = sum(baseline_counts) / len(baseline_counts) if baseline_counts else 0
+
+    open_counts = sorted(
+        count
+        for timestamp, count in readings
+        if timestamp > lookback_start and count > baseline * closed_threshold
+    )
+    if open_counts:
+        percentile_idx = int(len(open_counts) * max_percentile)
+        percentile_idx = min(percentile_idx, len(open_counts) - 1)
+        max_count = open_counts[percentile_idx] - baseline
+    else:
+        max_count = 0
+
+    return BaselineStats(
+        baseline=baseline,
+        max_count=max_count,
+        baseline_samples=len(baseline_counts),
+        open_samples=len(open_counts),
+    )
@@ -0,0 +1,39 @@
+import random
+
+from middlines_common.chunks import decode_chunk, encode_chunk
+
+
+def _round_trip(readings: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    first_ts, first_count = readings[0]
+    return list(decode_chunk(first_ts, first_count, encode_chunk(readings)))
+
+
+def test_single_reading_has_empty_payload() -> None:
+    assert encode_chunk([(1000, 10)]) == b""
+    assert _round_trip([(1000, 10)]) == [(1000, 10)]
+
+
+def test_payload_format() -> None:
+    # Stored chunks and db-init's count_readings view depend on these exact bytes
+    readings = [(1000, 10), (1060, 7), (1120, 207), (1150, 7)]
+    assert encode_chunk(readings) == bytes(
+        [
+            0x78, 0x05,  # delta-of-delta +60, count -3
+            0x00, 0x90, 0x03,  # delta-of-delta 0, count +200 (two-byte varint)
+            0x3B, 0x8F, 0x03,  # delta-of-delta -30, count -200 (two-byte varint)
+        ]
+    )  # fmt: skip
+    assert _round_trip(readings) == readings
+
+
+def test_round_trip_negative_deltas_and_multi_byte_varints() -> None:
+    rng = random.Random(1)
+    ts, count = 1_760_000_000, 50
+    readings = [(ts, count)]
+    for _ in range(2000):
+        # Irregular gaps (negative delta-of-deltas), repeated timestamps, and jumps
+        # of days and thousands of people (varints of up to 3 bytes)
+        ts += rng.choice([0, 1, 30, 60, 61, 3600, rng.randrange(300_000)])
+        count += rng.choice([0, -1, 1, rng.randrange(-5000, 5000)])
+        readings.append((ts, count))
+    assert _round_trip(readings) == readings
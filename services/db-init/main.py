@@ -2,15 +2,17 @@ import sqlite3
 
 from loguru import logger
 
+from middlines_common.shards import all_shards, shard_database_path
+
 DATABASE_PATH = "/data/middlines.db"
 
 # EMA smoothing parameter
 EMA_ALPHA = 0.20
 
 
-def init_db() -> None:
-    logger.info(f"Initializing database at {DATABASE_PATH}")
-    conn = sqlite3.connect(DATABASE_PATH)
+def init_db(database_path: str) -> None:
+    logger.info(f"Initializing database at {database_path}")
+    conn = sqlite3.connect(database_path)
 
     # Enable WAL mode for better concurrent read/write performance
     conn.execute("PRAGMA journal_mode=WAL")
@@ -22,9 +24,16 @@ def init_db() -> None:
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             location TEXT NOT NULL,
             count INTEGER NOT NULL,
-            timestamp TEXT NOT NULL
+            timestamp TEXT NOT NULL,
+            device_ts INTEGER,
+            seq INTEGER
         );
     """)
+    # Older databases predate device timestamps and sequence numbers
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(counts)")}
+    for column in ("device_ts", "seq"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE counts ADD COLUMN {column} INTEGER")
     conn.commit()
     logger.info("Counts table ready")
 
@@ -32,8 +41,111 @@ def init_db() -> None:
         CREATE INDEX IF NOT EXISTS idx_counts_location_timestamp
         ON counts(location, timestamp);
     """)
+    # Device-timestamped readings are unique per location and second, so
+    # redelivered or replayed messages are dropped on insert
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_counts_location_device_ts
+        ON counts(location, device_ts) WHERE device_ts IS NOT NULL;
+    """)
+    conn.commit()
+    logger.info("Counts indexes ready")
+
+    # Latest freshness probe reading (simulator probe mode), kept apart from counts
+    # so the probe is never served, aggregated or swept as a location. Probes used
+    # to be stored as counts under "Freshness Probe"
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS freshness_probe (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            timestamp TEXT NOT NULL,
+            seq INTEGER
+        );
+    """)
+    conn.execute("DELETE FROM counts WHERE location = 'Freshness Probe'")
+    conn.commit()
+    logger.info("Freshness probe table ready")
+
+    # Chunked storage (MIDDLINES_STORAGE_LAYOUT=chunked): the ingester packs each
+    # location's readings into one row per UTC hour. The first reading is stored
+    # as is; the payload holds, per later reading, the zigzag varints of the
+    # timestamp's delta-of-delta and of the count's delta (middlines_common.chunks)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS count_chunks (
+            location TEXT NOT NULL,
+            chunk_start INTEGER NOT NULL,
+            utc_offset INTEGER NOT NULL,
+            first_ts INTEGER NOT NULL,
+            first_count INTEGER NOT NULL,
+            readings INTEGER NOT NULL,
+            payload BLOB NOT NULL,
+            PRIMARY KEY (location, chunk_start)
+        ) WITHOUT ROWID;
+    """)
+    conn.commit()
+    logger.info("Count chunks table ready")
+
+    # Every reading, whether still a counts row or packed into a chunk, for SQL
+    # readers. Chunks are decoded here one payload byte per step, which is fine
+    # for ad hoc queries; the services decode them in Python instead. `varint` is
+    # the varint completed by the current byte, `zigzag` its signed value
+    varint = "(d.acc + ((v.value & 127) << d.shift))"
+    zigzag = (
+        f"(CASE WHEN {varint} & 1 THEN -({varint} >> 1) - 1 ELSE {varint} >> 1 END)"
+    )
+    conn.execute("DROP VIEW IF EXISTS count_readings")
+    conn.execute(f"""
+        CREATE VIEW count_readings AS
+        WITH RECURSIVE
+        byte_values (value, hex) AS (
+            SELECT 0, '00'
+            UNION ALL
+            SELECT value + 1, printf('%02X', value + 1)
+            FROM byte_values
+            WHERE value < 255
+        ),
+        decoded AS (
+            -- Seed: the chunk's first reading
+            SELECT
+                location, utc_offset, payload,
+                1 AS pos, 0 AS is_count, 0 AS acc, 0 AS shift,
+                first_ts AS ts, 0 AS delta, first_count AS count, 1 AS emit
+            FROM count_chunks
+
+            UNION ALL
+
+            -- Recursive step: fold one varint byte; a complete varint is either
+            -- the timestamp's delta-of-delta or, emitting a reading, the count's delta
+            SELECT
+                d.location, d.utc_offset, d.payload,
+                d.pos + 1,
+                CASE WHEN v.value < 128 THEN 1 - d.is_count ELSE d.is_count END,
+                CASE WHEN v.value < 128 THEN 0 ELSE {varint} END,
+                CASE WHEN v.value < 128 THEN 0 ELSE d.shift + 7 END,
+                CASE WHEN v.value < 128 AND d.is_count = 0
+                    THEN d.ts + d.delta + {zigzag} ELSE d.ts END,
+                CASE WHEN v.value < 128 AND d.is_count = 0
+                    THEN d.delta + {zigzag} ELSE d.delta END,
+                CASE WHEN v.value < 128 AND d.is_count = 1
+                    THEN d.count + {zigzag} ELSE d.count END,
+                v.value < 128 AND d.is_count = 1
+            FROM decoded d
+            JOIN byte_values v ON v.hex = hex(substr(d.payload, d.pos, 1))
+            WHERE d.pos <= length(d.payload)
+        )
+        SELECT location, timestamp, count FROM counts
+        UNION ALL
+        SELECT
+            location,
+            strftime('%Y-%m-%d %H:%M:%S', ts + utc_offset, 'unixepoch')
+                || CASE WHEN utc_offset < 0 THEN '-' ELSE '+' END
+                || printf(
+                    '%02d:%02d', abs(utc_offset) / 3600, abs(utc_offset) % 3600 / 60
+                ),
+            count
+        FROM decoded
+        WHERE emit;
+    """)
     conn.commit()
-    logger.info("Counts index ready")
+    logger.info("Count readings view created")
 
     # Create (or recreate) the smoothed view
     conn.execute("DROP VIEW IF EXISTS smoothed_counts")
@@ -46,7 +158,7 @@ def init_db() -> None:
                 ROW_NUMBER() OVER (
                     PARTITION BY location ORDER BY timestamp
                 ) AS rn
-            FROM counts
+            FROM count_readings
         ),
         ema AS (
             -- Seed: first row per location in the cutoff window
@@ -75,4 +187,5 @@ def init_db() -> None:
 
 
 if __name__ == "__main__":
-    init_db()
+    for shard in all_shards():
+        init_db(shard_database_path(DATABASE_PATH, shard))
@@ -1,66 +1,609 @@
+import json
 import os
 import sqlite3
-from datetime import datetime
-from typing import Any
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, SimpleQueue
+from time import monotonic, sleep, time
+from typing import Any, override
 from zoneinfo import ZoneInfo
 
 import paho.mqtt.client as mqtt
 from loguru import logger
-from paho.mqtt.client import ConnectFlags, MQTTMessage
+from paho.mqtt.client import ConnectFlags, DisconnectFlags, MQTTMessage
 from paho.mqtt.enums import CallbackAPIVersion
 from paho.mqtt.properties import Properties
 from paho.mqtt.reasoncodes import ReasonCode
 
+from middlines_common.chunks import CHUNK_SECONDS, decode_chunk, encode_chunk
+from middlines_common.shards import (
+    DEFAULT_SHARD,
+    all_shards,
+    shard_database_path,
+    shard_for_location,
+)
+
 TIMEZONE = ZoneInfo(os.environ.get("TZ", "America/New_York"))
 
 MQTT_HOST = "mosquitto"
 MQTT_PORT = 1883
 DATABASE_PATH = "/data/middlines.db"
 TOPIC = "middlines/+/count"
+# MQTT: freshness probe readings, kept out of counts so the probe never shows up
+# as a location
+PROBE_TOPIC = "middlines/probe"
+# MQTT: QoS 1 redeliveries are harmless once messages carry a device timestamp
+SUBSCRIBE_QOS = 1
+# MQTT: fixed client id with a persistent session, so the broker keeps queueing QoS 1
+# messages while the ingester is down and redelivers any it never acked. A message
+# is acked only once its row is committed
+MQTT_CLIENT_ID = "middlines-ingester"
+
+
+# Metrics: local HTTP endpoint serving /metrics and /health
+METRICS_HOST = "0.0.0.0"
+METRICS_PORT = 9100
+
+# Batching: commit once this many rows are pending...
+BATCH_MAX_ROWS = 500
+# Batching: ...or once the oldest pending row has waited this many seconds
+BATCH_MAX_WAIT_SECONDS = 1.0
+# Batching: a batch that fails to commit (e.g. a locked shard) is kept and retried
+# after a backoff that doubles from COMMIT_RETRY_BASE_SECONDS up to the max
+COMMIT_RETRY_BASE_SECONDS = 0.5
+COMMIT_RETRY_MAX_SECONDS = 30.0
+
+# Logging: seconds between throughput summaries
+SUMMARY_INTERVAL_SECONDS = 60
+
+# Device timestamps: messages stamped further than this in the future are dropped
+MAX_CLOCK_SKEW_SECONDS = 300
+# Device timestamps: ...as are ones older than this (usually a clock that never synced)
+MAX_DEVICE_TS_AGE_DAYS = 365
+
+# Health: rows pending longer than this without a commit mark the ingester unhealthy
+HEALTH_MAX_COMMIT_AGE_SECONDS = 120
+
+# Storage: "rows" keeps one counts row per reading; "chunked" also packs readings
+# older than COMPACT_AFTER_HOURS into hourly count_chunks rows
+STORAGE_LAYOUT = os.environ.get("MIDDLINES_STORAGE_LAYOUT", "rows")
+# Storage: readings stay as counts rows this long, past the API's hot tier, which
+# tails them by id
+COMPACT_AFTER_HOURS = 48
+# Storage: seconds between compaction passes
+COMPACT_INTERVAL_SECONDS = 600
+# Storage: counts rows read per compaction transaction, so the write lock is short
+COMPACT_BATCH_ROWS = 20_000
+
+
+@dataclass
+class PendingCount:
+    location: str
+    count: int
+    timestamp: str
+    received_at: float
+    # Device-reported epoch seconds and sequence number, when the message has them
+    device_ts: int | None = None
+    seq: int | None = None
+    # Freshness probe readings go to the default shard's freshness_probe row
+    probe: bool = False
+    # MQTT packet id and QoS to ack after commit, and the connection it arrived on
+    mid: int = 0
+    qos: int = 0
+    session: int = 0
+
+
+@dataclass
+class IngesterMetrics:
+    started_at: float = field(default_factory=time)
+    mqtt_connected: bool = False
+    messages_received: int = 0
+    rows_committed: int = 0
+    duplicates_dropped: int = 0
+    sequence_gaps: int = 0
+    parse_errors: int = 0
+    commit_errors: int = 0
+    retrying_rows: int = 0
+    last_batch_size: int = 0
+    last_commit_latency_ms: float = 0.0
+    last_lag_ms: float = 0.0
+    last_commit_at: float | None = None
+    last_received_at: float | None = None
+    rows_compacted: int = 0
+    chunks_written: int = 0
+
+
+_pending: SimpleQueue[PendingCount] = SimpleQueue()
+_metrics = IngesterMetrics()
+_metrics_lock = threading.Lock()
+# Last sequence number seen per location, to count gaps
+_last_seq: dict[str, int] = {}
+# Bumped on every MQTT connect; packet ids from an earlier connection aren't acked,
+# since the broker redelivers those messages on the new one
+_session = 0
+
+
+def metrics_snapshot() -> dict[str, object]:
+    with _metrics_lock:
+        return {
+            "uptime_s": round(time() - _metrics.started_at, 1),
+            "mqtt_connected": _metrics.mqtt_connected,
+            "messages_received": _metrics.messages_received,
+            "rows_committed": _metrics.rows_committed,
+            "duplicates_dropped": _metrics.duplicates_dropped,
+            "sequence_gaps": _metrics.sequence_gaps,
+            "parse_errors": _metrics.parse_errors,
+            "commit_errors": _metrics.commit_errors,
+            "pending_rows": _pending.qsize(),
+            "retrying_rows": _metrics.retrying_rows,
+            "last_batch_size": _metrics.last_batch_size,
+            "last_commit_latency_ms": round(_metrics.last_commit_latency_ms, 2),
+            "last_lag_ms": round(_metrics.last_lag_ms, 2),
+            "last_commit_at": _metrics.last_commit_at,
+            "last_received_at": _metrics.last_received_at,
+            "rows_compacted": _metrics.rows_compacted,
+            "chunks_written": _metrics.chunks_written,
+        }
+
+
+def health_problems() -> list[str]:
+    problems: list[str] = []
+    with _metrics_lock:
+        if not _metrics.mqtt_connected:
+            problems.append("not connected to MQTT broker")
+        last_progress = _metrics.last_commit_at or _metrics.started_at
+        if (
+            _pending.qsize() > 0 or _metrics.retrying_rows > 0
+        ) and time() - last_progress > HEALTH_MAX_COMMIT_AGE_SECONDS:
+            problems.append(
+                f"no commit in {HEALTH_MAX_COMMIT_AGE_SECONDS}s with rows pending"
+            )
+    return problems
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:  # noqa: N802
+        if self.path == "/metrics":
+            self._send_json(200, metrics_snapshot())
+        elif self.path == "/health":
+            problems = health_problems()
+            self._send_json(
+                503 if problems else 200,
+                {"status": "unhealthy" if problems else "ok", "problems": problems},
+            )
+        else:
+            self._send_json(404, {"detail": "Not found"})
+
+    def _send_json(self, status: int, body: dict[str, object]) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    @override
+    def log_message(self, format: str, *args: Any) -> None:
+        # Health probes would otherwise log one line per request
+        return
+
+
+def commit_batch(conn: sqlite3.Connection, batch: list[PendingCount]) -> bool:
+    started = monotonic()
+    try:
+        changes_before = conn.total_changes
+        # Redelivered or replayed readings hit the (location, device_ts) unique index
+        conn.executemany(
+            """
+            INSERT INTO counts (location, count, timestamp, device_ts, seq)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+            """,
+            [
+                (p.location, p.count, p.timestamp, p.device_ts, p.seq)
+                for p in batch
+                if not p.probe
+            ],
+        )
+        conn.executemany(
+            """
+            INSERT INTO freshness_probe (id, timestamp, seq) VALUES (1, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                timestamp = excluded.timestamp,
+                seq = excluded.seq
+            """,
+            [(p.timestamp, p.seq) for p in batch if p.probe],
+        )
+        conn.commit()
+        inserted = conn.total_changes - changes_before
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"Failed to commit batch of {len(batch)} counts: {e}")
+        with _metrics_lock:
+            _metrics.commit_errors += 1
+        return False
+
+    committed = monotonic()
+    with _metrics_lock:
+        _metrics.rows_committed += inserted
+        _metrics.duplicates_dropped += len(batch) - inserted
+        _metrics.last_batch_size = len(batch)
+        _metrics.last_commit_latency_ms = (committed - started) * 1000
+        _metrics.last_lag_ms = (committed - batch[0].received_at) * 1000
+        _metrics.last_commit_at = time()
+    return True
+
+
+def ack_committed(client: mqtt.Client, batch: list[PendingCount]) -> None:
+    for pending in batch:
+        if pending.qos and pending.session == _session:
+            client.ack(pending.mid, pending.qos)
+
+
+def commit_sharded_batch(
+    client: mqtt.Client,
+    connections: dict[str, sqlite3.Connection],
+    batch: list[PendingCount],
+) -> list[PendingCount]:
+    # Acks the rows of every shard that committed and returns the rest, to be retried
+    by_shard: dict[str, list[PendingCount]] = {}
+    for pending in batch:
+        shard = DEFAULT_SHARD if pending.probe else shard_for_location(pending.location)
+        by_shard.setdefault(shard, []).append(pending)
+    failed: list[PendingCount] = []
+    for shard, shard_batch in by_shard.items():
+        if shard not in connections:
+            connections[shard] = sqlite3.connect(
+                shard_database_path(DATABASE_PATH, shard), timeout=5.0
+            )
+        if commit_batch(connections[shard], shard_batch):
+            ack_committed(client, shard_batch)
+        else:
+            failed.extend(shard_batch)
+    return failed
+
+
+def run_writer(client: mqtt.Client) -> None:
+    connections: dict[str, sqlite3.Connection] = {}
+    # Rows whose commit failed; they lead the next batch, so nothing already
+    # taken off the queue is dropped
+    retry: list[PendingCount] = []
+    failures = 0
+    while True:
+        batch = retry or [_pending.get()]
+        deadline = batch[0].received_at + BATCH_MAX_WAIT_SECONDS
+        while len(batch) < BATCH_MAX_ROWS:
+            remaining = deadline - monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(_pending.get_nowait())
+                else:
+                    batch.append(_pending.get(timeout=remaining))
+            except Empty:
+                break
+        retry = commit_sharded_batch(client, connections, batch)
+        with _metrics_lock:
+            _metrics.retrying_rows = len(retry)
+        if not retry:
+            failures = 0
+            continue
+        failures += 1
+        backoff = min(
+            COMMIT_RETRY_MAX_SECONDS, COMMIT_RETRY_BASE_SECONDS * 2 ** (failures - 1)
+        )
+        logger.warning(f"Retrying {len(retry)} uncommitted counts in {backoff:.1f}s")
+        sleep(backoff)
+
+
+def _chunk_reading(timestamp: str) -> tuple[int, int] | None:
+    # Epoch seconds and UTC offset, if the stored text is exactly what the chunk
+    # decoders render back; anything else stays a counts row
+    moment = datetime.fromisoformat(timestamp)
+    offset = moment.utcoffset()
+    if offset is None or int(offset.total_seconds()) % 60 or moment.microsecond:
+        return None
+    if moment.isoformat(sep=" ", timespec="seconds") != timestamp:
+        return None
+    return int(moment.timestamp()), int(offset.total_seconds())
+
+
+def _merge_into_chunk(
+    conn: sqlite3.Connection,
+    location: str,
+    chunk_start: int,
+    utc_offset: int,
+    rows: list[tuple[int, int, int | None]],
+) -> bool:
+    existing = conn.execute(
+        """
+        SELECT utc_offset, first_ts, first_count, payload
+        FROM count_chunks
+        WHERE location = ? AND chunk_start = ?
+        """,
+        (location, chunk_start),
+    ).fetchone()
+    readings: list[tuple[int, int]] = []
+    if existing is not None:
+        if existing[0] != utc_offset:
+            return False
+        readings = list(decode_chunk(existing[1], existing[2], existing[3]))
+    # Chunks drop device_ts, so a replay of an already packed device reading is
+    # recognised by its timestamp and count instead of the unique index
+    packed = set(readings)
+    readings.extend(
+        (ts, count)
+        for ts, count, device_ts in rows
+        if device_ts is None or (ts, count) not in packed
+    )
+    readings.sort(key=lambda reading: reading[0])
+    conn.execute(
+        """
+        INSERT INTO count_chunks (
+            location, chunk_start, utc_offset, first_ts, first_count, readings,
+            payload
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(location, chunk_start) DO UPDATE SET
+            first_ts = excluded.first_ts,
+            first_count = excluded.first_count,
+            readings = excluded.readings,
+            payload = excluded.payload
+        """,
+        (
+            location,
+            chunk_start,
+            utc_offset,
+            readings[0][0],
+            readings[0][1],
+            len(readings),
+            encode_chunk(readings),
+        ),
+    )
+    return True
+
+
+def compact_shard(conn: sqlite3.Connection, cutoff: datetime) -> tuple[int, int]:
+    # Packs counts rows stamped before `cutoff` into count_chunks, a batch per
+    # transaction. Rows that can't be packed are skipped with a keyset cursor
+    rows_compacted = chunks_written = 0
+    after: tuple[str, str, int] = ("", "", 0)
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                """
+                SELECT id, location, count, timestamp, device_ts
+                FROM counts
+                WHERE timestamp < ? AND (location, timestamp, id) > (?, ?, ?)
+                ORDER BY location, timestamp, id
+                LIMIT ?
+                """,
+                (
+                    cutoff.isoformat(sep=" ", timespec="seconds"),
+                    *after,
+                    COMPACT_BATCH_ROWS,
+                ),
+            ).fetchall()
+            if not rows:
+                conn.rollback()
+                return rows_compacted, chunks_written
+            after = (rows[-1][1], rows[-1][3], rows[-1][0])
+
+            chunks: dict[tuple[str, int, int], list[tuple[int, int, int | None]]] = {}
+            ids: dict[tuple[str, int, int], list[int]] = {}
+            for row_id, location, count, timestamp, device_ts in rows:
+                reading = _chunk_reading(timestamp)
+                if reading is None:
+                    continue
+                ts, utc_offset = reading
+                key = (location, ts - ts % CHUNK_SECONDS, utc_offset)
+                chunks.setdefault(key, []).append((ts, count, device_ts))
+                ids.setdefault(key, []).append(row_id)
+
+            for key, chunk_rows in chunks.items():
+                if not _merge_into_chunk(conn, *key, chunk_rows):
+                    continue
+                conn.executemany(
+                    "DELETE FROM counts WHERE id = ?",
+                    [(row_id,) for row_id in ids[key]],
+                )
+                rows_compacted += len(chunk_rows)
+                chunks_written += 1
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+
+def run_compactor() -> None:
+    connections: dict[str, sqlite3.Connection] = {}
+    while True:
+        cutoff = datetime.now(TIMEZONE) - timedelta(hours=COMPACT_AFTER_HOURS)
+        for shard in all_shards():
+            if shard not in connections:
+                connections[shard] = sqlite3.connect(
+                    shard_database_path(DATABASE_PATH, shard),
+                    timeout=5.0,
+                    isolation_level=None,
+                )
+            started = monotonic()
+            try:
+                rows_compacted, chunks_written = compact_shard(
+                    connections[shard], cutoff
+                )
+            except sqlite3.Error as e:
+                logger.error(f"Failed to compact shard {shard}: {e}")
+                continue
+            with _metrics_lock:
+                _metrics.rows_compacted += rows_compacted
+                _metrics.chunks_written += chunks_written
+            if rows_compacted:
+                logger.info(
+                    f"Compacted {rows_compacted} rows into {chunks_written} chunks "
+                    f"in shard {shard} in {monotonic() - started:.1f}s"
+                )
+        sleep(COMPACT_INTERVAL_SECONDS)
+
+
+def run_summary_logger() -> None:
+    previous = (0, 0, 0, 0)
+    while True:
+        sleep(SUMMARY_INTERVAL_SECONDS)
+        with _metrics_lock:
+            current = (
+                _metrics.messages_received,
+                _metrics.rows_committed,
+                _metrics.duplicates_dropped,
+                _metrics.parse_errors,
+            )
+            batch_size = _metrics.last_batch_size
+            latency_ms = _metrics.last_commit_latency_ms
+            lag_ms = _metrics.last_lag_ms
+        received, committed, duplicates, parse_errors = (
+            now - before for now, before in zip(current, previous, strict=True)
+        )
+        logger.info(
+            f"Last {SUMMARY_INTERVAL_SECONDS}s: received {received}, committed {committed}, "
+            f"duplicates {duplicates}, parse errors {parse_errors}, pending {_pending.qsize()}, "
+            f"last batch {batch_size} rows in {latency_ms:.1f}ms, lag {lag_ms:.1f}ms"
+        )
+        previous = current
+
+
+def parse_payload(payload: bytes) -> tuple[int, datetime | None, int | None]:
+    # Either a bare count, or {"count": n, "ts": <epoch seconds or ISO 8601>,
+    # "seq": n} from devices that stamp their own readings
+    text = payload.decode()
+    if not text.lstrip().startswith("{"):
+        return int(text), None, None
+
+    message = json.loads(text)
+    count = message["count"]
+    seq = message.get("seq")
+    if type(count) is not int or count < 0:
+        raise ValueError(f"invalid count {count!r}")
+    if seq is not None and type(seq) is not int:
+        raise ValueError(f"invalid seq {seq!r}")
+
+    ts = message.get("ts")
+    if ts is None:
+        return count, None, seq
+    if isinstance(ts, str):
+        device_time = datetime.fromisoformat(ts)
+        if device_time.tzinfo is None:
+            device_time = device_time.replace(tzinfo=TIMEZONE)
+    elif isinstance(ts, int | float):
+        device_time = datetime.fromtimestamp(ts, TIMEZONE)
+    else:
+        raise ValueError(f"invalid ts {ts!r}")
+    if device_time.timestamp() > time() + MAX_CLOCK_SKEW_SECONDS:
+        raise ValueError(f"ts {ts!r} is in the future")
+    if device_time.timestamp() < time() - MAX_DEVICE_TS_AGE_DAYS * 86400:
+        raise ValueError(f"ts {ts!r} is more than {MAX_DEVICE_TS_AGE_DAYS} days old")
+    return count, device_time.astimezone(TIMEZONE), seq
 
 
 def on_connect(
     client: mqtt.Client,
     _userdata: Any,
-    _flags: ConnectFlags,
+    flags: ConnectFlags,
     _rc: ReasonCode,
     _properties: Properties | None = None,
 ) -> None:
-    logger.info(f"Connected to MQTT broker, subscribing to {TOPIC}")
-    client.subscribe(TOPIC)
+    global _session
+    _session += 1
+    session = "resumed" if flags.session_present else "new"
+    logger.info(f"Connected to MQTT broker ({session} session), subscribing to {TOPIC}")
+    with _metrics_lock:
+        _metrics.mqtt_connected = True
+    client.subscribe([(TOPIC, SUBSCRIBE_QOS), (PROBE_TOPIC, SUBSCRIBE_QOS)])
 
 
-def on_message(
+def on_disconnect(
     _client: mqtt.Client,
     _userdata: Any,
+    _flags: DisconnectFlags,
+    rc: ReasonCode,
+    _properties: Properties | None = None,
+) -> None:
+    logger.warning(f"Disconnected from MQTT broker: {rc}")
+    with _metrics_lock:
+        _metrics.mqtt_connected = False
+
+
+def on_message(
+    client: mqtt.Client,
+    _userdata: Any,
     msg: MQTTMessage,
 ) -> None:
+    received_at = monotonic()
+    with _metrics_lock:
+        _metrics.messages_received += 1
+        _metrics.last_received_at = time()
+    probe = msg.topic == PROBE_TOPIC
     try:
         # Topic format is middlines/{location}/count
-        location = msg.topic.split("/")[1]
-        count = int(msg.payload.decode())
+        location = "" if probe else msg.topic.split("/")[1]
+        count, device_time, seq = parse_payload(msg.payload)
+    except Exception as e:
+        logger.warning(f"Dropping malformed message on {msg.topic}: {e}")
+        with _metrics_lock:
+            _metrics.parse_errors += 1
+        # Redelivery can't fix it
+        client.ack(msg.mid, msg.qos)
+        return
 
-        local_now = datetime.now(TIMEZONE)
-        timestamp = local_now.isoformat(sep=" ", timespec="seconds")
+    if seq is not None and not probe:
+        # A lower sequence number means a restart or a redelivery, not a gap;
+        # either way gaps are counted from the newest number seen
+        last_seq = _last_seq.get(location)
+        if last_seq is not None and seq > last_seq + 1:
+            with _metrics_lock:
+                _metrics.sequence_gaps += 1
+        _last_seq[location] = seq
 
-        conn = sqlite3.connect(DATABASE_PATH, timeout=5.0)
-        conn.execute(
-            "INSERT INTO counts (location, count, timestamp) VALUES (?, ?, ?)",
-            (location, count, timestamp),
+    stamped_at = device_time or datetime.now(TIMEZONE)
+    timestamp = stamped_at.isoformat(sep=" ", timespec="seconds")
+    _pending.put(
+        PendingCount(
+            location,
+            count,
+            timestamp,
+            received_at,
+            int(stamped_at.timestamp()) if device_time else None,
+            seq,
+            probe,
+            msg.mid,
+            msg.qos,
+            _session,
         )
-        conn.commit()
-        conn.close()
-
-        logger.info(f"Saved count {location}: {count} devices")
-    except Exception as e:
-        logger.error(f"Message handling error: {e}")
+    )
 
 
 def main() -> None:
-    client = mqtt.Client(CallbackAPIVersion.VERSION2)
+    client = mqtt.Client(
+        CallbackAPIVersion.VERSION2,
+        client_id=MQTT_CLIENT_ID,
+        clean_session=False,
+        manual_ack=True,
+    )
     client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
     client.on_message = on_message
 
+    threading.Thread(
+        target=run_writer, args=(client,), name="writer", daemon=True
+    ).start()
+    threading.Thread(target=run_summary_logger, name="summary", daemon=True).start()
+    if STORAGE_LAYOUT == "chunked":
+        threading.Thread(target=run_compactor, name="compactor", daemon=True).start()
+
+    server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving metrics on {METRICS_HOST}:{METRICS_PORT}")
+
     logger.info(f"Connecting to {MQTT_HOST}:{MQTT_PORT}")
     client.connect(MQTT_HOST, MQTT_PORT)
     client.loop_forever()
@@ -1,15 +1,23 @@
+import json
 import math
 import os
 import random
 import sqlite3
+from collections import deque
 from datetime import datetime, timedelta
-from time import sleep
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Any, cast
+from urllib.error import URLError
+from urllib.request import urlopen
 from zoneinfo import ZoneInfo
 
 import paho.mqtt.client as mqtt
 from loguru import logger
 from paho.mqtt.enums import CallbackAPIVersion
 
+from middlines_common.shards import shard_database_path, shard_for_location
+
 TIMEZONE = ZoneInfo(os.environ.get("TZ", "America/New_York"))
 
 MQTT_HOST = "mosquitto"
@@ -17,8 +25,27 @@ MQTT_PORT = 1883
 DATABASE_PATH = "/data/middlines.db"
 PUBLISH_INTERVAL_SECONDS = 30
 
+API_URL = "http://api:8000/api"
+
+# "simulate" seeds history and publishes test counts, "probe" measures freshness
+SIMULATOR_MODE = os.environ.get("SIMULATOR_MODE", "simulate")
+
 TEST_LOCATION = "Simulated Test"
 
+# Probe: published outside middlines/+/count, so the ingester keeps it out of counts
+PROBE_TOPIC = "middlines/probe"
+PROBE_RESULTS_PATH = Path("/data/freshness_probe.jsonl")
+# Probe: seconds between probe publishes
+PROBE_INTERVAL_SECONDS = 60
+# Probe: seconds between freshness polls while waiting for a probe to appear
+PROBE_POLL_SECONDS = 1.0
+# Probe: give up on a probe that hasn't appeared after this many seconds
+PROBE_TIMEOUT_SECONDS = 300
+# Probe: number of recent samples in the logged latency distribution
+PROBE_WINDOW = 60
+# Probe: log the latency distribution every N probes
+PROBE_SUMMARY_EVERY = 10
+
 
 def _is_weekend(current: datetime) -> bool:
     # weekday(): Monday=0, Sunday=6
@@ -85,7 +112,10 @@ def generate_count(current: datetime) -> int:
 
 
 def seed_historical_data() -> None:
-    conn = sqlite3.connect(DATABASE_PATH, timeout=5.0)
+    conn = sqlite3.connect(
+        shard_database_path(DATABASE_PATH, shard_for_location(TEST_LOCATION)),
+        timeout=5.0,
+    )
 
     # Clear out any previous generated data for the test location
     conn.execute(
@@ -142,7 +172,99 @@ def run_live_simulation() -> None:
         client.disconnect()
 
 
+def _fetch_probe_timestamp() -> datetime | None:
+    # The latest probe reading in the snapshot /current is served from
+    with urlopen(f"{API_URL}/health/freshness", timeout=10) as response:
+        freshness = cast(dict[str, Any], json.load(response))
+    timestamp = freshness["probe_timestamp"]
+    return None if timestamp is None else datetime.fromisoformat(timestamp)
+
+
+def _wait_until_visible(published_at: datetime, started: float) -> float | None:
+    # Probes carry their publish time as the device timestamp, stored at second
+    # resolution, so the probe is visible once the snapshot reports that second
+    threshold = published_at.replace(microsecond=0)
+    while monotonic() - started < PROBE_TIMEOUT_SECONDS:
+        try:
+            timestamp = _fetch_probe_timestamp()
+        except (URLError, TimeoutError, ValueError) as e:
+            logger.warning(f"Probe poll failed: {e}")
+            timestamp = None
+        if timestamp is not None and timestamp >= threshold:
+            return monotonic() - started
+        sleep(PROBE_POLL_SECONDS)
+    return None
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def run_freshness_probe() -> None:
+    client = mqtt.Client(CallbackAPIVersion.VERSION2)
+
+    logger.info(f"Connecting freshness probe to MQTT at {MQTT_HOST}:{MQTT_PORT}")
+    client.connect(MQTT_HOST, MQTT_PORT)
+    client.loop_start()
+
+    latencies: deque[float] = deque(maxlen=PROBE_WINDOW)
+    sequence = 0
+    try:
+        while True:
+            sequence += 1
+            published_at = datetime.now(TIMEZONE)
+            started = monotonic()
+            payload = {
+                "count": sequence % 100,
+                "ts": published_at.timestamp(),
+                "seq": sequence,
+            }
+            client.publish(PROBE_TOPIC, json.dumps(payload), qos=1)
+
+            latency = _wait_until_visible(published_at, started)
+            with PROBE_RESULTS_PATH.open("a") as results:
+                results.write(
+                    json.dumps(
+                        {
+                            "sequence": sequence,
+                            "published_at": published_at.isoformat(),
+                            "latency_s": latency,
+                        }
+                    )
+                    + "\n"
+                )
+
+            if latency is None:
+                logger.warning(
+                    f"Probe {sequence} not visible after {PROBE_TIMEOUT_SECONDS}s"
+                )
+            else:
+                latencies.append(latency)
+                logger.info(f"Probe {sequence} visible after {latency:.1f}s")
+
+            if sequence % PROBE_SUMMARY_EVERY == 0 and latencies:
+                window = list(latencies)
+                logger.info(
+                    f"Freshness over last {len(window)} probes: "
+                    f"p50 {_percentile(window, 0.5):.1f}s, "
+                    f"p90 {_percentile(window, 0.9):.1f}s, "
+                    f"p99 {_percentile(window, 0.99):.1f}s, "
+                    f"max {max(window):.1f}s"
+                )
+
+            sleep(max(0.0, PROBE_INTERVAL_SECONDS - (monotonic() - started)))
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
 def main() -> None:
+    if SIMULATOR_MODE == "probe":
+        logger.info("Simulator service starting in freshness probe mode")
+        run_freshness_probe()
+        return
+
     logger.info("Simulator service starting")
 
     seed_historical_data()
@@ -0,0 +1,587 @@
+import argparse
+import csv
+import gzip
+import itertools
+import json
+import os
+import sqlite3
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from itertools import pairwise
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+from loguru import logger
+
+from middlines_common.chunks import CHUNK_SECONDS, decode_chunk
+from middlines_common.shards import all_shards, shard_database_path, shard_for_location
+from middlines_common.stats import (
+    DAILY_STATS_GRACE_MINUTES,
+    BaselineStats,
+    compute_baseline_stats,
+    current_stats_day,
+    daily_stats_as_of,
+)
+
+TIMEZONE = ZoneInfo(os.environ.get("TZ", "America/New_York"))
+
+DATABASE_PATH = "/data/middlines.db"
+SWEEPS_DIR = Path("/data/sweeps")
+
+
+# Swept parameters: defaults are the values currently deployed (api and db-init)
+EMA_ALPHA = 0.20
+CLOSED_THRESHOLD = 1.5
+MAX_PERCENTILE = 0.9995
+TIME_BUCKET_SIZE = 2
+TREND_LOOKBACK_ROWS = 20
+
+# Fixed parameters, mirrored from the API
+TREND_THRESHOLD = 0.07
+TREND_MIN_BUSYNESS = 10.0
+LOOKBACK_DAYS = 45
+
+# Replay: the API recomputes aggregates this often (AGGREGATE_REFRESH_SECONDS), and
+# once more when it stores a day's stats
+AGGREGATE_REFRESH = timedelta(hours=1)
+# Replay: raw rows read before the lookback window so the EMA has converged by then
+EMA_WARMUP_ROWS = 1000
+# Replay: days replayed when --start is not given
+DEFAULT_DAYS = 7
+
+
+@dataclass(frozen=True)
+class SweepParams:
+    ema_alpha: float
+    closed_threshold: float
+    max_percentile: float
+    time_bucket_size: int
+    trend_lookback_rows: int
+
+
+@dataclass(frozen=True)
+class ReplayTask:
+    location: str
+    day: date
+    combos: tuple[SweepParams, ...]
+
+
+@dataclass
+class Aggregates:
+    baseline: float
+    max_count: float
+    time_averages: dict[tuple[bool, int], float]
+
+
+# (timestamp, busyness_percentage, vs_typical_percentage, trend initial or "")
+type StatusRow = tuple[str, float | None, float | None, str]
+
+
+@dataclass
+class ComboSummary:
+    readings: int = 0
+    busyness_readings: int = 0
+    busyness_total: float = 0.0
+    vs_typical_readings: int = 0
+    vs_typical_abs_total: float = 0.0
+    increasing: int = 0
+    steady: int = 0
+    decreasing: int = 0
+
+    def add(self, row: StatusRow) -> None:
+        _, busyness, vs_typical, trend = row
+        self.readings += 1
+        if busyness is not None:
+            self.busyness_readings += 1
+            self.busyness_total += busyness
+        if vs_typical is not None:
+            self.vs_typical_readings += 1
+            self.vs_typical_abs_total += abs(vs_typical)
+        if trend == "I":
+            self.increasing += 1
+        elif trend == "S":
+            self.steady += 1
+        elif trend == "D":
+            self.decreasing += 1
+
+    def to_json(self) -> dict[str, object]:
+        return {
+            "readings": self.readings,
+            "mean_busyness": (
+                round(self.busyness_total / self.busyness_readings, 2)
+                if self.busyness_readings
+                else None
+            ),
+            "mean_abs_vs_typical": (
+                round(self.vs_typical_abs_total / self.vs_typical_readings, 2)
+                if self.vs_typical_readings
+                else None
+            ),
+            "trends": {
+                "Increasing": self.increasing,
+                "Steady": self.steady,
+                "Decreasing": self.decreasing,
+            },
+        }
+
+
+def _db_timestamp(moment: datetime) -> str:
+    return moment.isoformat(sep=" ", timespec="seconds")
+
+
+def read_locations(start: datetime, end: datetime) -> list[str]:
+    locations: set[str] = set()
+    for shard in all_shards():
+        conn = sqlite3.connect(shard_database_path(DATABASE_PATH, shard), timeout=5.0)
+        try:
+            rows = conn.execute(
+                """
+                SELECT DISTINCT location FROM counts
+                WHERE timestamp >= ? AND timestamp < ?
+                UNION
+                SELECT DISTINCT location FROM count_chunks
+                WHERE chunk_start >= ? AND chunk_start < ?
+                """,
+                (
+                    _db_timestamp(start),
+                    _db_timestamp(end),
+                    _chunk_start(start),
+                    int(end.timestamp()),
+                ),
+            ).fetchall()
+        finally:
+            conn.close()
+        locations.update(row[0] for row in rows)
+    return sorted(locations)
+
+
+def _chunk_start(moment: datetime) -> int:
+    epoch = int(moment.timestamp())
+    return epoch - epoch % CHUNK_SECONDS
+
+
+def _read_chunks(
+    conn: sqlite3.Connection, location: str, chunk_starts: str, params: tuple[int, ...]
+) -> Iterator[list[tuple[datetime, int]]]:
+    # One decoded chunk at a time, newest first
+    rows = conn.execute(
+        f"""
+        SELECT utc_offset, first_ts, first_count, payload FROM count_chunks
+        WHERE location = ? AND {chunk_starts}
+        ORDER BY chunk_start DESC
+        """,
+        (location, *params),
+    )
+    for utc_offset, first_ts, first_count, payload in rows:
+        offset = timezone(timedelta(seconds=utc_offset))
+        yield [
+            (datetime.fromtimestamp(ts, offset), count)
+            for ts, count in decode_chunk(first_ts, first_count, payload)
+        ]
+
+
+def read_counts(
+    location: str, start: datetime, end: datetime
+) -> list[tuple[datetime, int]]:
+    # Readings come from counts rows and, with chunked storage, from count_chunks
+    conn = sqlite3.connect(
+        shard_database_path(DATABASE_PATH, shard_for_location(location)), timeout=5.0
+    )
+    try:
+        warmup = [
+            (datetime.fromisoformat(timestamp), count)
+            for timestamp, count in conn.execute(
+                """
+                SELECT timestamp, count FROM counts
+                WHERE location = ? AND timestamp < ?
+                ORDER BY timestamp DESC
+                LIMIT ?
+                """,
+                (location, _db_timestamp(start), EMA_WARMUP_ROWS),
+            )
+        ]
+        # Chunks are read newest first until they cover the warmup on their own
+        chunk_warmup = 0
+        for chunk in _read_chunks(
+            conn, location, "chunk_start <= ?", (_chunk_start(start),)
+        ):
+            if chunk_warmup >= EMA_WARMUP_ROWS:
+                break
+            before = [reading for reading in chunk if reading[0] < start]
+            warmup.extend(before)
+            chunk_warmup += len(before)
+        window = [
+            (datetime.fromisoformat(timestamp), count)
+            for timestamp, count in conn.execute(
+                """
+                SELECT timestamp, count FROM counts
+                WHERE location = ? AND timestamp >= ? AND timestamp < ?
+                ORDER BY timestamp
+                """,
+                (location, _db_timestamp(start), _db_timestamp(end)),
+            )
+        ]
+        window.extend(
+            reading
+            for chunk in _read_chunks(
+                conn,
+                location,
+                "chunk_start >= ? AND chunk_start < ?",
+                (_chunk_start(start), int(end.timestamp())),
+            )
+            for reading in chunk
+            if start <= reading[0] < end
+        )
+    finally:
+        conn.close()
+    warmup.sort(key=lambda reading: reading[0])
+    window.sort(key=lambda reading: reading[0])
+    return [*warmup[-EMA_WARMUP_ROWS:], *window]
+
+
+def smooth(
+    counts: list[tuple[datetime, int]], alpha: float
+) -> list[tuple[datetime, float]]:
+    # Same recurrence as the smoothed_counts view, seeded by the first row read
+    smoothed: list[tuple[datetime, float]] = []
+    previous: float | None = None
+    for timestamp, count in counts:
+        previous = (
+            float(count) if previous is None else alpha * count + (1 - alpha) * previous
+        )
+        smoothed.append((timestamp, previous))
+    return smoothed
+
+
+def _bucket(moment: datetime, bucket_size: int) -> tuple[bool, int]:
+    return (
+        moment.weekday() >= 5,
+        moment.hour * 60 + (moment.minute // bucket_size) * bucket_size,
+    )
+
+
+def stats_as_of(timestamps: list[datetime], now: datetime) -> datetime:
+    # The API's full pass takes the baseline and max count from the current day's
+    # stored stats, and computes them as of now until those are stored (or when the
+    # location had no readings to store them for)
+    as_of = daily_stats_as_of(current_stats_day(now), TIMEZONE)
+    if now < as_of + timedelta(minutes=DAILY_STATS_GRACE_MINUTES):
+        return now
+    if bisect_right(timestamps, as_of - timedelta(days=LOOKBACK_DAYS)) == bisect_right(
+        timestamps, as_of
+    ):
+        return now
+    return as_of
+
+
+def compute_stats(
+    smoothed: list[tuple[datetime, float]],
+    timestamps: list[datetime],
+    as_of: datetime,
+    params: SweepParams,
+) -> BaselineStats:
+    return compute_baseline_stats(
+        smoothed[
+            bisect_right(
+                timestamps, as_of - timedelta(days=LOOKBACK_DAYS)
+            ) : bisect_right(timestamps, as_of)
+        ],
+        as_of,
+        LOOKBACK_DAYS,
+        params.closed_threshold,
+        params.max_percentile,
+    )
+
+
+def compute_aggregates(
+    smoothed: list[tuple[datetime, float]],
+    timestamps: list[datetime],
+    now: datetime,
+    stats: BaselineStats,
+    params: SweepParams,
+) -> Aggregates:
+    # Mirrors the API's full pass with `stats` from stats_as_of(), using only
+    # readings that existed at `now`
+    threshold = stats.baseline * params.closed_threshold
+    time_buckets: dict[tuple[bool, int], list[float]] = {}
+    for timestamp, count in smoothed[
+        bisect_right(timestamps, now - timedelta(days=LOOKBACK_DAYS)) : bisect_right(
+            timestamps, now
+        )
+    ]:
+        if count > threshold:
+            time_buckets.setdefault(
+                _bucket(timestamp, params.time_bucket_size), []
+            ).append(count)
+
+    return Aggregates(
+        baseline=stats.baseline,
+        max_count=stats.max_count,
+        time_averages={k: sum(v) / len(v) for k, v in time_buckets.items()},
+    )
+
+
+def _calculate_busyness(count: float, agg: Aggregates) -> float | None:
+    if agg.max_count <= 0:
+        return None
+    busyness = ((count - agg.baseline) / agg.max_count) * 100
+    return max(0.0, min(100.0, busyness))
+
+
+def _status_row(
+    smoothed: list[tuple[datetime, float]],
+    index: int,
+    agg: Aggregates,
+    params: SweepParams,
+) -> StatusRow:
+    timestamp, count = smoothed[index]
+    busyness = _calculate_busyness(count, agg)
+
+    typical = agg.time_averages.get(_bucket(timestamp, params.time_bucket_size))
+    vs_typical = (
+        ((count - typical) / typical) * 100 if typical and typical > 0 else None
+    )
+
+    trend = ""
+    past_index = index - params.trend_lookback_rows
+    past_count = smoothed[past_index][1] if past_index >= 0 else None
+    if (
+        busyness is not None
+        and busyness >= TREND_MIN_BUSYNESS
+        and past_count
+        and past_count > 0
+    ):
+        change = (count - past_count) / past_count
+        if change > TREND_THRESHOLD:
+            trend = "I"
+        elif change < -TREND_THRESHOLD:
+            trend = "D"
+        else:
+            trend = "S"
+
+    return (_db_timestamp(timestamp), busyness, vs_typical, trend)
+
+
+def refresh_times(day_start: datetime, day_end: datetime) -> list[datetime]:
+    refreshes = {
+        daily_stats_as_of(day_start.date(), TIMEZONE)
+        + timedelta(minutes=DAILY_STATS_GRACE_MINUTES)
+    }
+    refreshed_at = day_start
+    while refreshed_at < day_end:
+        refreshes.add(refreshed_at)
+        refreshed_at += AGGREGATE_REFRESH
+    return sorted(refreshes)
+
+
+def replay_statuses(
+    smoothed: list[tuple[datetime, float]],
+    params: SweepParams,
+    day_start: datetime,
+    day_end: datetime,
+) -> list[StatusRow]:
+    # Every reading of the day gets the status the API would have served right
+    # after it arrived, with aggregates from the most recent refresh
+    timestamps = [timestamp for timestamp, _ in smoothed]
+    stats_by_as_of: dict[datetime, BaselineStats] = {}
+    rows: list[StatusRow] = []
+    for refreshed_at, next_refresh in pairwise(
+        [*refresh_times(day_start, day_end), day_end]
+    ):
+        first = bisect_left(timestamps, refreshed_at)
+        last = bisect_left(timestamps, next_refresh)
+        if first < last:
+            as_of = stats_as_of(timestamps, refreshed_at)
+            if as_of not in stats_by_as_of:
+                stats_by_as_of[as_of] = compute_stats(
+                    smoothed, timestamps, as_of, params
+                )
+            agg = compute_aggregates(
+                smoothed, timestamps, refreshed_at, stats_by_as_of[as_of], params
+            )
+            rows.extend(
+                _status_row(smoothed, index, agg, params)
+                for index in range(first, last)
+            )
+    return rows
+
+
+def replay_location_day(task: ReplayTask) -> list[list[StatusRow]]:
+    day_start = datetime.combine(task.day, time(), TIMEZONE)
+    day_end = datetime.combine(task.day + timedelta(days=1), time(), TIMEZONE)
+    # Until the day's stats are stored the API uses the previous day's, whose
+    # lookback starts a day earlier
+    counts = read_counts(
+        task.location, day_start - timedelta(days=LOOKBACK_DAYS + 1), day_end
+    )
+
+    smoothed_by_alpha: dict[float, list[tuple[datetime, float]]] = {}
+    results: list[list[StatusRow]] = []
+    for params in task.combos:
+        if params.ema_alpha not in smoothed_by_alpha:
+            smoothed_by_alpha[params.ema_alpha] = smooth(counts, params.ema_alpha)
+        results.append(
+            replay_statuses(
+                smoothed_by_alpha[params.ema_alpha], params, day_start, day_end
+            )
+        )
+    return results
+
+
+def _format(value: float | None) -> str:
+    return "" if value is None else f"{value:.2f}"
+
+
+def run_sweep(
+    combos: list[SweepParams],
+    locations: list[str],
+    days: list[date],
+    output_dir: Path,
+    workers: int,
+) -> None:
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tasks = [
+        ReplayTask(location, day, tuple(combos))
+        for location in locations
+        for day in days
+    ]
+    summaries = [ComboSummary() for _ in combos]
+
+    with ExitStack() as stack, ProcessPoolExecutor(max_workers=workers) as pool:
+        writers = [
+            csv.writer(
+                stack.enter_context(
+                    gzip.open(output_dir / f"combo-{i:03d}.csv.gz", "wt", newline="")
+                )
+            )
+            for i in range(len(combos))
+        ]
+        for writer in writers:
+            writer.writerow(
+                [
+                    "location",
+                    "timestamp",
+                    "busyness_percentage",
+                    "vs_typical_percentage",
+                    "trend",
+                ]
+            )
+
+        # map() keeps submission order, so every file comes out sorted by
+        # location and time
+        for done, (task, results) in enumerate(
+            zip(tasks, pool.map(replay_location_day, tasks), strict=True), 1
+        ):
+            for writer, summary, rows in zip(writers, summaries, results, strict=True):
+                for row in rows:
+                    summary.add(row)
+                    timestamp, busyness, vs_typical, trend = row
+                    writer.writerow(
+                        [
+                            task.location,
+                            timestamp,
+                            _format(busyness),
+                            _format(vs_typical),
+                            trend,
+                        ]
+                    )
+            logger.info(f"Replayed {task.location} on {task.day} ({done}/{len(tasks)})")
+
+    manifest = {
+        "generated_at": datetime.now(TIMEZONE).isoformat(),
+        "start": days[0].isoformat() if days else None,
+        "end": days[-1].isoformat() if days else None,
+        "locations": locations,
+        "combos": [
+            {
+                "file": f"combo-{i:03d}.csv.gz",
+                "params": asdict(params),
+                "summary": summary.to_json(),
+            }
+            for i, (params, summary) in enumerate(zip(combos, summaries, strict=True))
+        ],
+    }
+    (output_dir / "sweep.json").write_text(json.dumps(manifest, indent=2))
+    logger.info(f"Wrote {len(combos)} result files to {output_dir}")
+
+
+def _float_list(value: str) -> list[float]:
+    return [float(v) for v in value.split(",") if v.strip()]
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def parse_args() -> argparse.Namespace:
+    today = datetime.now(TIMEZONE).date()
+    parser = argparse.ArgumentParser(
+        description="Replay counts history and recompute location statuses for "
+        "every combination of the given parameter values"
+    )
+    parser.add_argument("--alpha", type=_float_list, default=[EMA_ALPHA])
+    parser.add_argument(
+        "--closed-threshold", type=_float_list, default=[CLOSED_THRESHOLD]
+    )
+    parser.add_argument("--max-percentile", type=_float_list, default=[MAX_PERCENTILE])
+    parser.add_argument("--bucket-size", type=_int_list, default=[TIME_BUCKET_SIZE])
+    parser.add_argument(
+        "--trend-lookback", type=_int_list, default=[TREND_LOOKBACK_ROWS]
+    )
+    parser.add_argument(
+        "--start",
+        type=date.fromisoformat,
+        default=today - timedelta(days=DEFAULT_DAYS),
+    )
+    parser.add_argument(
+        "--end", type=date.fromisoformat, default=today - timedelta(days=1)
+    )
+    parser.add_argument(
+        "--locations",
+        type=lambda value: [v.strip() for v in value.split(",") if v.strip()],
+        default=None,
+        help="comma-separated; defaults to every location with readings in range",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", type=Path, default=None)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    combos = [
+        SweepParams(*values)
+        for values in itertools.product(
+            args.alpha,
+            args.closed_threshold,
+            args.max_percentile,
+            args.bucket_size,
+            args.trend_lookback,
+        )
+    ]
+    days = [
+        args.start + timedelta(days=offset)
+        for offset in range((args.end - args.start).days + 1)
+    ]
+    locations = args.locations or read_locations(
+        datetime.combine(args.start, time(), TIMEZONE),
+        datetime.combine(args.end + timedelta(days=1), time(), TIMEZONE),
+    )
+    output_dir = args.output or SWEEPS_DIR / datetime.now(TIMEZONE).strftime(
+        "%Y%m%d-%H%M%S"
+    )
+
+    logger.info(
+        f"Sweeping {len(combos)} parameter combinations over {len(locations)} "
+        f"locations and {len(days)} days with {args.workers} workers"
+    )
+    run_sweep(combos, locations, days, output_dir, args.workers)
+
+
+if __name__ == "__main__":
+    main()